@@ -0,0 +1,93 @@
+# ingredients/autocomplete.py
+# In-process prefix index for the ingredient autocomplete (/ingredients/autocomplete/?q=). Names are stored
+# lowercase, so a sorted array of them answers "every name starting with q" with two binary searches; the
+# matches are then ranked by the stored recipe_count. A narrow range is ranked directly; a wide one is
+# answered by walking all positions from the most used down until enough of them fall inside the range, which
+# takes about limit * total / matches steps. Results of one- and two-letter prefixes are remembered per
+# snapshot.
+#
+# Each process keeps one snapshot of the names that follows the 'ingredients' CatalogVersion token, checked at
+# most every AUTOCOMPLETE_REFRESH_INTERVAL seconds (recipes/snapshots.py). A refresh only reads the rows whose
+# updated_at moved since the last one (renames and count changes included); a delete triggers a full rebuild.
+# Until the first snapshot exists, or when the catalog is larger than AUTOCOMPLETE_INDEX_MAX_ENTRIES, lookups
+# fall back to an indexed range query.
+import heapq
+from bisect import bisect_left
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from recipes.snapshots import Snapshot, SnapshotHolder
+from .models import Ingredient
+
+MEMO_PREFIX_LENGTH = 2                          # Prefixes up to this long keep their ranked results
+RANK_DIRECTLY = 20                              # Matches per requested result up to which the range is ranked directly
+PREFIX_END = '\U0010ffff'                       # Sorts after every character a name can continue with
+
+class PrefixIndex(Snapshot):
+    def __init__(self, rows, token, since, usable=True, built=None):
+        super().__init__(token, since, usable, built)
+        self.rows = rows                        # pk -> (name, recipe_count)
+        ordered = sorted(rows.items(), key=lambda item: item[1][0])
+        self.ids = [pk for pk, _ in ordered]
+        self.names = [name for _, (name, _) in ordered]
+        self.counts = [count for _, (_, count) in ordered]
+        self.by_usage = sorted(range(len(ordered)), key=lambda i: -self.counts[i])    # Stable: ties stay in name order
+        self.memo = {}
+
+    @classmethod
+    def build(cls, token):
+        since = timezone.now()
+        if Ingredient.objects.count() > settings.AUTOCOMPLETE_INDEX_MAX_ENTRIES:
+            return cls({}, token, since, usable=False)
+        rows = {pk: (name, count) for pk, name, count in Ingredient.objects.values_list('pk', 'name', 'recipe_count')}
+        return cls(rows, token, since)
+
+    # A new snapshot with the rows changed since this one, or None when rows were deleted (a full rebuild is needed)
+    def refreshed(self, token):
+        since = timezone.now()
+        changed = Ingredient.objects.filter(updated_at__gte=self.changed_since())
+        rows = dict(self.rows)
+        rows.update((pk, (name, count)) for pk, name, count in changed.values_list('pk', 'name', 'recipe_count'))
+        if len(rows) != Ingredient.objects.count() or len(rows) > settings.AUTOCOMPLETE_INDEX_MAX_ENTRIES:
+            return None
+        return PrefixIndex(rows, token, since, built=self.built)
+
+    def search(self, prefix, limit):
+        if len(prefix) <= MEMO_PREFIX_LENGTH:
+            if prefix not in self.memo:
+                self.memo[prefix] = self._search(prefix, settings.AUTOCOMPLETE_MAX_RESULTS)
+            return self.memo[prefix][:limit]
+        return self._search(prefix, limit)
+
+    # Most used first, then by name
+    def _search(self, prefix, limit):
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix + PREFIX_END, start)
+        if end - start <= RANK_DIRECTLY * limit:
+            best = heapq.nsmallest(limit, range(start, end), key=lambda i: (-self.counts[i], i))
+        else:
+            best = list(islice((i for i in self.by_usage if start <= i < end), limit))
+        return [{'id': self.ids[i], 'name': self.names[i], 'recipe_count': self.counts[i]} for i in best]
+
+_holder = SnapshotHolder(PrefixIndex, 'ingredients', 'AUTOCOMPLETE_REFRESH_INTERVAL')
+
+get_index = _holder.get
+reset_index = _holder.reset
+
+# Range on the unique name index plus an exact LIKE 'prefix%', for when there is no in-process index
+def search_database(prefix, limit):
+    matches = Ingredient.objects.filter(Q(name__gte=prefix, name__lt=prefix + PREFIX_END), name__startswith=prefix)
+    rows = matches.order_by('-recipe_count', 'name').values_list('pk', 'name', 'recipe_count')[:limit]
+    return [{'id': pk, 'name': name, 'recipe_count': count} for pk, name, count in rows]
+
+def autocomplete(prefix, limit):
+    prefix = Ingredient.normalize_name(prefix)
+    if not prefix:
+        return []
+    index = get_index()
+    if index is None or not index.usable:
+        return search_database(prefix, limit)
+    return index.search(prefix, limit)
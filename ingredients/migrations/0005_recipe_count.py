@@ -0,0 +1,37 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.migrations._search_triggers import without_search_triggers
+
+
+# One UPDATE with a correlated COUNT fills the new column for the existing rows
+def fill_recipe_count(apps, schema_editor):
+    Ingredient = apps.get_model('ingredients', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    link_count = (
+        RecipeIngredient.objects.filter(ingredient=OuterRef('pk'))
+        .order_by()
+        .values('ingredient')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    Ingredient.objects.update(recipe_count=Coalesce(Subquery(link_count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredients', '0004_updated_at'),
+        ('recipes', '0010_updated_at'),
+    ]
+
+    operations = without_search_triggers(
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_recipe_count, migrations.RunPython.noop),
+    )
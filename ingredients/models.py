@@ -1,15 +1,160 @@
 # ingredients/models.py
+from collections import defaultdict
+from itertools import batched
+
+from django.apps import apps
 from django.db import models
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Substr, Upper
+from django.utils import timezone
+from recipes.images import enqueue_derivatives
+
+# Deleting ingredients cascades to the recipes' junction rows without calling RecipeIngredient.delete(),
+# so both delete paths below recompute the affected recipes themselves.
+# The Recipe model is resolved through the app registry to avoid a circular import with the recipes app.
+def _recipe_model():
+    return apps.get_model('recipes', 'Recipe')
+
+# Invalidates the cached pages that show ingredients (see recipes.models.CatalogVersion)
+def _bump_version():
+    apps.get_model('recipes', 'CatalogVersion').bump('ingredients')
+
+def _affected_recipe_ids(ingredients):
+    links = _recipe_model().ingredients.through.objects.filter(ingredient__in=ingredients)
+    return set(links.values_list('recipe_id', flat=True))
+
+# Correlated subquery counting the junction rows of the outer ingredient
+def recipe_count_subquery():
+    link_count = (
+        _recipe_model().ingredients.through.objects.filter(ingredient=OuterRef('pk'))
+        .order_by()
+        .values('ingredient')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(link_count), 0)
+
+# Index buckets: names are stored lowercase, so a name belongs to the upper-cased letter it starts with, and
+# names starting with anything else (digits, accented letters) to OTHER_LETTER
+LETTERS = [chr(code) for code in range(ord('A'), ord('Z') + 1)]
+OTHER_LETTER = '#'
+
+# Compared by equality rather than by range so that the buckets do not depend on the database collation
+def letter_expression():
+    return Case(
+        When(Q(initial__in=[letter.lower() for letter in LETTERS]), then=Upper('initial')),
+        default=Value(OTHER_LETTER),
+        output_field=models.CharField(),
+    )
+
+# Custom QuerySet so that bulk deletes keep the recipe counters and difficulty correct and bulk writes
+# invalidate the cached pages
+class IngredientQuerySet(models.QuerySet):
+    def delete(self):
+        recipe_ids = _affected_recipe_ids(self)     # Evaluated before the delete, while the links still exist
+        result = super().delete()
+        _recipe_model().objects.mark_dirty(recipe_ids, background=True)
+        _bump_version()
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())    # auto_now is only applied by save()
+        rows = super().update(**kwargs)
+        _bump_version()
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        _bump_version()
+        return objs
+
+    # Recount recipe_count for every ingredient in the queryset, one UPDATE ... SET = (SELECT COUNT ...) per batch
+    def recompute_recipe_count(self, batch_size=2000):
+        ids = list(self.order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        for chunk in batched(ids, batch_size):
+            updated += Ingredient.objects.filter(pk__in=chunk).update(recipe_count=recipe_count_subquery())
+        return updated
+
+    # Applies {ingredient id: change} to recipe_count with one UPDATE per distinct change,
+    # for write paths that know exactly which links they added and removed
+    def shift_recipe_count(self, deltas, batch_size=2000):
+        by_delta = defaultdict(list)
+        for pk, delta in deltas.items():
+            if delta:
+                by_delta[delta].append(pk)
+        for delta, ids in by_delta.items():
+            for chunk in batched(sorted(ids), batch_size):
+                self.filter(pk__in=chunk).update(recipe_count=F('recipe_count') + delta)
+
+    # Ingredients whose stored recipe_count disagrees with the junction table
+    def with_drift(self):
+        return self.annotate(expected_count=recipe_count_subquery()).exclude(recipe_count=F('expected_count'))
+
+    def in_letter(self, letter):
+        initials = self.annotate(initial=Substr('name', 1, 1))
+        if letter == OTHER_LETTER:
+            return initials.exclude(initial__in=[letter.lower() for letter in LETTERS])
+        # The range lets the unique name index find the bucket; the initial keeps it exact under any collation
+        start = letter.lower()
+        bucket = initials.filter(name__gte=start, initial=start)
+        if start != 'z':                        # '{' follows 'z' in byte order but not in every collation
+            bucket = bucket.filter(name__lt=chr(ord(start) + 1))
+        return bucket
+
+    # {letter: number of ingredients}, one pass over the name index without loading any row
+    def letter_counts(self):
+        rows = (
+            self.order_by().annotate(initial=Substr('name', 1, 1), letter=letter_expression())
+            .values('letter').annotate(total=Count('pk'))
+        )
+        return dict(rows.values_list('letter', 'total'))
 
 # Ingredients models
 class Ingredient(models.Model):
     name = models.CharField(max_length=128, unique=True, null=False, blank=False)
     image = models.ImageField(upload_to='ingredients/', null=True, blank=True)
+    # Widths of the resized WebP/JPEG copies of `image` (see recipes/images.py), maintained by save()
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    # Denormalized number of recipes using the ingredient, kept in sync by the RecipeIngredient write paths
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    # Part of the index pill's fragment cache key (recipes/fragments.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = IngredientQuerySet.as_manager()
+
+    # Single source of the name cleanup, shared with the bulk paths that bypass save()
+    @staticmethod
+    def normalize_name(name):
+        return name.strip().lower()             # Remove leading/trailing whitespace and convert to lowercase
 
     def save(self, *args, **kwargs):
-        self.name = self.name.strip().lower()   # Remove leading/trailing whitespace and convert to lowercase
+        self.name = self.normalize_name(self.name)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # recipe_count is owned by the junction write paths; a full save must not write back a stale value
+            kwargs['update_fields'] = {
+                field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'recipe_count'
+            }
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}    # auto_now only writes listed fields
         super().save(*args, **kwargs)           # Call the original save method
+        _bump_version()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'image' in update_fields:
+            enqueue_derivatives(self)
+
+    def delete(self, *args, **kwargs):
+        recipe_ids = _affected_recipe_ids([self])   # Remember the linked recipes before the cascade removes the links
+        result = super().delete(*args, **kwargs)
+        _recipe_model().objects.mark_dirty(recipe_ids, background=True)
+        _bump_version()
+        return result
 
     # String representation
     def __str__(self):
-        return f"Ingredient: {self.name}"
\ No newline at end of file
+        return f"Ingredient: {self.name}"
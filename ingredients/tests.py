@@ -1,9 +1,17 @@
 # ingredients/tests.py
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.db import IntegrityError
 from .models import Ingredient
 from django.urls import reverse
 from django.contrib.auth.models import User # Added for auth
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from io import StringIO
+from unittest import mock
+from recipes.importers import RecipeImporter
+from recipes.models import Recipe, RecipeIngredient
+from .autocomplete import PrefixIndex, autocomplete, reset_index, search_database
+from .views import IngredientsIndexView
 
 # --- Models tests ---
 class IngredientModelTest(TestCase):
@@ -55,6 +63,7 @@ class IngredientViewsTest(TestCase):
 
     def setUp(self):
         self.client.login(username='testchef', password='password123')  # Log in the user before each test
+        caches['pages'].clear()                 # Render every page rather than serving an earlier test's copy
 
     def test_ingredient_index_view_status_and_template(self):
         url = reverse('ingredients:ingredients_index')
@@ -62,6 +71,8 @@ class IngredientViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)     # Now returns 200 because we are logged in
         self.assertTemplateUsed(response, 'ingredients/ingredients_index.html')
         self.assertContains(response, self.ingredient1.name)
+        # The index shows one letter at a time, the first non-empty one by default
+        response = self.client.get(url, {'letter': 'B'})
         self.assertContains(response, self.ingredient2.name)
 
     def test_ingredient_index_recipe_count(self):
@@ -81,6 +92,7 @@ class IngredientIndexFunctionalTest(TestCase):
 
     def setUp(self):
         self.client.login(username='sous_chef', password='password123')
+        caches['pages'].clear()
 
     def test_ingredient_regrouping_logic(self):
         """Verify ingredients are grouped by the first letter in the template."""
@@ -95,4 +107,161 @@ class IngredientIndexFunctionalTest(TestCase):
         url = reverse('ingredients:ingredients_index')
         response = self.client.get(url)
         # Verify data-name attribute exists for the JS logic to grab
-        self.assertContains(response, 'data-name="apple"')
\ No newline at end of file
+        self.assertContains(response, 'data-name="apple"')
+
+# --- Stored recipe_count ---
+class RecipeCountTest(TestCase):
+    def setUp(self):
+        self.salt, self.pepper, self.thyme = (Ingredient.objects.create(name=name) for name in ('salt', 'pepper', 'thyme'))
+        self.soup = Recipe.objects.create(name='Soup', cooking_time=20)
+        self.stew = Recipe.objects.create(name='Stew', cooking_time=60)
+
+    def counts(self):
+        return dict(Ingredient.objects.values_list('name', 'recipe_count'))
+
+    def test_link_save_and_delete_shift_the_count(self):
+        link = RecipeIngredient.objects.create(recipe=self.soup, ingredient=self.salt)
+        RecipeIngredient.objects.create(recipe=self.stew, ingredient=self.salt)
+        self.assertEqual(self.counts()['salt'], 2)
+        link.delete()
+        self.assertEqual(self.counts()['salt'], 1)
+
+    def test_set_ingredients_shifts_added_and_removed(self):
+        self.soup.set_ingredients(['salt', 'pepper'])
+        self.stew.set_ingredients(['salt', 'basil'])
+        self.soup.set_ingredients(['salt', 'thyme'])
+        self.assertEqual(self.counts(), {'salt': 2, 'pepper': 0, 'thyme': 1, 'basil': 1})
+
+    def test_bulk_writes_and_cascades_recount(self):
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient=self.pepper) for recipe in (self.soup, self.stew)
+        ])
+        self.assertEqual(self.counts()['pepper'], 2)
+        self.stew.delete()                      # Cascade to the links
+        self.assertEqual(self.counts()['pepper'], 1)
+        Recipe.objects.all().delete()
+        self.assertEqual(self.counts()['pepper'], 0)
+
+    def test_deferred_block_recounts_once_on_exit(self):
+        with Recipe.objects.deferred_difficulty():
+            RecipeIngredient.objects.create(recipe=self.soup, ingredient=self.thyme)
+            RecipeIngredient.objects.create(recipe=self.stew, ingredient=self.thyme)
+            self.assertEqual(self.counts()['thyme'], 0)
+        self.assertEqual(self.counts()['thyme'], 2)
+
+    def test_upsert_import_shifts_by_the_difference(self):
+        self.soup.set_ingredients(['salt', 'pepper'])
+        RecipeImporter(upsert=True).import_batch([('Soup', 25, ['salt', 'thyme']), ('Broth', 10, ['salt'])])
+        self.assertEqual(self.counts(), {'salt': 2, 'pepper': 0, 'thyme': 1})
+
+    def test_full_save_keeps_the_stored_count(self):
+        stale = Ingredient.objects.get(pk=self.salt.pk)
+        RecipeIngredient.objects.create(recipe=self.soup, ingredient=self.salt)
+        stale.save()                            # Loaded before the link was added
+        self.assertEqual(self.counts()['salt'], 1)
+
+    def test_repair_command_fixes_drift(self):
+        RecipeIngredient.objects.create(recipe=self.soup, ingredient=self.salt)
+        Ingredient.objects.filter(pk=self.salt.pk).update(recipe_count=7)     # As a raw SQL write would leave it
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('recompute_difficulty', '--check', stdout=out)
+        self.assertIn('salt: 7 -> 1 recipes', out.getvalue())
+        call_command('recompute_difficulty', stdout=out)
+        self.assertEqual(self.counts()['salt'], 1)
+        self.assertFalse(Ingredient.objects.with_drift().exists())
+
+# --- Letter buckets of the index ---
+class IngredientLetterIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='pantry', password='password123')
+        Ingredient.objects.bulk_create([Ingredient(name=name) for name in ('anise', 'apple', 'avocado', 'basil', '7up', 'édam')])
+
+    def setUp(self):
+        self.client.login(username='pantry', password='password123')
+        caches['pages'].clear()
+
+    def test_letter_counts_and_buckets(self):
+        self.assertEqual(Ingredient.objects.letter_counts(), {'A': 3, 'B': 1, '#': 2})
+        self.assertEqual(list(Ingredient.objects.in_letter('#').order_by('name').values_list('name', flat=True)), ['7up', 'édam'])
+
+    def test_pages_within_a_letter(self):
+        url = reverse('ingredients:ingredients_index')
+        with mock.patch.object(IngredientsIndexView, 'paginate_by', 2):
+            response = self.client.get(url, {'letter': 'a'})
+            self.assertEqual([item.name for item in response.context['ingredients']], ['anise', 'apple'])
+            self.assertEqual(response.context['next_after'], 'apple')
+            response = self.client.get(url, {'letter': 'A', 'after': 'apple'})
+        self.assertEqual([item.name for item in response.context['ingredients']], ['avocado'])
+        self.assertIsNone(response.context['next_after'])
+        self.assertNotContains(response, 'basil')
+
+    def test_unknown_letter_falls_back_to_the_first_bucket(self):
+        response = self.client.get(reverse('ingredients:ingredients_index'), {'letter': 'Q'})
+        self.assertEqual(response.context['letter'], 'A')
+
+    def test_letter_counts_follow_writes(self):
+        url = reverse('ingredients:ingredients_index')
+        self.client.get(url)
+        Ingredient.objects.create(name='bay leaf')
+        response = self.client.get(url)
+        self.assertIn(('B', 2), response.context['letters'])
+
+# --- Autocomplete ---
+@override_settings(AUTOCOMPLETE_REFRESH_INTERVAL=0)
+class AutocompleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='typist', password='password123')
+        Ingredient.objects.bulk_create([
+            Ingredient(name='pepper', recipe_count=3), Ingredient(name='peas', recipe_count=5),
+            Ingredient(name='pear', recipe_count=3), Ingredient(name='paprika', recipe_count=9),
+            Ingredient(name='salt', recipe_count=20),
+        ])
+
+    def setUp(self):
+        reset_index()
+
+    def names(self, prefix, limit=10):
+        return [item['name'] for item in autocomplete(prefix, limit)]
+
+    def test_most_used_first_then_by_name(self):
+        self.assertEqual(self.names('pe'), ['peas', 'pear', 'pepper'])
+        self.assertEqual(self.names('  P ', limit=2), ['paprika', 'peas'])
+        self.assertEqual(self.names('pepp'), ['pepper'])
+        self.assertEqual(self.names('x'), [])
+        self.assertEqual(self.names(''), [])
+
+    def test_index_and_database_agree(self):
+        index = PrefixIndex.build(token=0)
+        for prefix in ('p', 'pe', 'pea', 'sal', 'z'):
+            self.assertEqual(index.search(prefix, 2), search_database(prefix, 2))
+
+    def test_refresh_reads_only_changed_rows(self):
+        self.names('p')                         # Builds the index
+        Ingredient.objects.filter(name='pepper').update(recipe_count=30)
+        Ingredient.objects.create(name='pecan')
+        Ingredient.objects.filter(name='peas').update(name='petit pois')
+        with self.assertNumQueries(3):          # Version check, changed rows, row count
+            self.assertEqual(self.names('pe'), ['pepper', 'petit pois', 'pear', 'pecan'])
+        with self.assertNumQueries(1):          # Version check only
+            self.names('pe')
+
+    def test_delete_rebuilds(self):
+        self.names('p')
+        Ingredient.objects.filter(name='paprika').delete()
+        self.assertEqual(self.names('p'), ['peas', 'pear', 'pepper'])
+
+    @override_settings(AUTOCOMPLETE_INDEX_MAX_ENTRIES=2)
+    def test_large_catalogs_query_the_database(self):
+        self.assertEqual(self.names('pe', limit=1), ['peas'])
+        self.assertFalse(PrefixIndex.build(token=0).usable)
+
+    def test_endpoint(self):
+        url = reverse('ingredients:autocomplete')
+        self.assertEqual(self.client.get(url, {'q': 'pe'}).status_code, 302)      # Behind the login like the index
+        self.client.login(username='typist', password='password123')
+        data = self.client.get(url, {'q': 'Pe', 'limit': '1'}).json()
+        self.assertEqual(data, {'query': 'Pe', 'results': [{'id': Ingredient.objects.get(name='peas').pk, 'name': 'peas', 'recipe_count': 5}]})
+        self.assertEqual(len(self.client.get(url, {'q': 'p', 'limit': 'many'}).json()['results']), 4)
@@ -1,9 +1,12 @@
 # ingredients/urls.py
 from django.urls import path
-from .views import IngredientsIndexView
+from .views import IngredientsIndexView, ingredient_autocomplete
 
 app_name = 'ingredients'
 
 urlpatterns = [
     path('list/', IngredientsIndexView.as_view(), name='ingredients_index'),
+
+    # Most used ingredients by name prefix, as JSON: http://127.0.0.1:8000/ingredients/autocomplete/?q=<prefix>&limit=N
+    path('autocomplete/', ingredient_autocomplete, name='autocomplete'),
 ]
\ No newline at end of file
@@ -1,16 +1,75 @@
 # ingredients/views.py
+from django.conf import settings
+from django.http import JsonResponse
 from django.views.generic import ListView      # Import ListView and DetailView for class-based views
+from django.contrib.auth.decorators import login_required       # For protecting function-based views
 from django.contrib.auth.mixins import LoginRequiredMixin # For protecting Class-based views
-from .models import Ingredient
-from django.db.models import Count
+from .autocomplete import autocomplete
+from .models import Ingredient, LETTERS, OTHER_LETTER
+from recipes.page_cache import CachedPageMixin, page_cache
 
-# Class based view for listing ingredients
-class IngredientsIndexView(LoginRequiredMixin, ListView):
+LETTER_COUNTS_KEY = 'ingredient-letters:{}'
+
+# Class based view for listing ingredients, one letter at a time.
+# The letter bar comes from a {letter: count} summary cached per 'ingredients' version, and a letter's
+# ingredients are paged by name (name > after) over the unique index, so a request reads at most
+# paginate_by rows however large the catalog is. recipe_count is a stored column, so no join or COUNT runs.
+class IngredientsIndexView(LoginRequiredMixin, CachedPageMixin, ListView):
+    cache_versions = ('ingredients',)           # Link writes update the stored recipe_count, which bumps 'ingredients'
     model = Ingredient
     template_name = 'ingredients/ingredients_index.html'
     context_object_name = 'ingredients'
+    paginate_by = 500                           # Pills per page within a letter
+
+    # Counts per letter, recomputed once per catalog version rather than on every page
+    def get_letter_counts(self):
+        token = self.catalog_versions['ingredients'][0]
+        cache = page_cache()
+        counts = cache.get(LETTER_COUNTS_KEY.format(token))
+        if counts is None:
+            counts = Ingredient.objects.letter_counts()
+            cache.set(LETTER_COUNTS_KEY.format(token), counts, None)
+        return counts
+
+    # ?letter=B selects the bucket; missing or unknown letters fall back to the first non-empty one
+    def get_letter(self):
+        letter = self.request.GET.get('letter', '').upper()
+        if self.letter_counts.get(letter):
+            return letter
+        return next((letter for letter in [*LETTERS, OTHER_LETTER] if self.letter_counts.get(letter)), None)
 
-    # Override the get_queryset method to annotate each ingredient with the count of recipes that use it
     def get_queryset(self):
-            # We fetch ingredients and count how many recipes use them
-            return Ingredient.objects.annotate(recipe_count=Count('recipes')).order_by('name')
\ No newline at end of file
+        self.letter_counts = self.get_letter_counts()
+        self.letter = self.get_letter()
+        if self.letter is None:
+            return Ingredient.objects.none()
+        ingredients = Ingredient.objects.in_letter(self.letter).order_by('name')
+        after = self.request.GET.get('after')
+        if after:
+            ingredients = ingredients.filter(name__gt=after)
+        return ingredients
+
+    # Keyset paging: one row beyond the page tells whether there is a next one, without a COUNT
+    def paginate_queryset(self, queryset, page_size):
+        rows = list(queryset[:page_size + 1])
+        return None, None, rows[:page_size], len(rows) > page_size
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        ingredients = context['ingredients']
+        context.update(
+            letter=self.letter,
+            letters=[(letter, self.letter_counts.get(letter, 0)) for letter in [*LETTERS, OTHER_LETTER]],
+            next_after=ingredients[-1].name if context['is_paginated'] else None,
+        )
+        return context
+
+# Typeahead: GET ?q=<prefix>&limit=N returns the most used ingredients starting with the prefix as JSON
+@login_required
+def ingredient_autocomplete(request):
+    query = request.GET.get('q', '')[:Ingredient._meta.get_field('name').max_length]
+    try:
+        limit = min(max(int(request.GET.get('limit', settings.AUTOCOMPLETE_RESULTS)), 1), settings.AUTOCOMPLETE_MAX_RESULTS)
+    except ValueError:
+        limit = settings.AUTOCOMPLETE_RESULTS
+    return JsonResponse({'query': query, 'results': autocomplete(query, limit)})
@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recipes.instrumentation.RequestProfilingMiddleware',  # First, so its total covers the other middleware too
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -104,6 +105,91 @@ DATABASES = {
     )
 }
 
+# --- CACHES ---
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+# Rendered Data Lab charts live in their own bounded cache. LocMemCache evicts the least recently used
+# entry once MAX_ENTRIES is reached (CULL_FREQUENCY == MAX_ENTRIES drops one entry at a time).
+# With several worker processes, point CHART_CACHE_URL at a shared cache, e.g. filecache:///var/tmp/charts
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+    'charts': {
+        **env.cache('CHART_CACHE_URL', default='locmemcache://charts?max_entries=256&cull_frequency=256'),
+        'TIMEOUT': None,                        # Content-addressed entries never go stale, they are only evicted
+    },
+    # Rendered catalog pages (recipes/page_cache.py). Keys carry the catalog version, so writes never need to
+    # delete entries. Use a shared cache (PAGE_CACHE_URL=redis://... or filecache://...) with several processes,
+    # otherwise each process keeps its own copies and its own hit counters.
+    'pages': env.cache('PAGE_CACHE_URL', default='locmemcache://pages?max_entries=2000'),
+    # Recipe cards and ingredient pills (recipes/fragments.py), keyed on each row's updated_at
+    'fragments': env.cache('FRAGMENT_CACHE_URL', default='locmemcache://fragments?max_entries=20000'),
+}
+PAGE_CACHE_ALIAS = 'pages'
+PAGE_CACHE_TIMEOUT = env.int('PAGE_CACHE_TIMEOUT', default=600)       # Seconds; 0 turns the page cache off
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = env.int('FRAGMENT_CACHE_TIMEOUT', default=86400)  # Changed rows get new keys, so this only bounds memory
+
+# --- INGREDIENT AUTOCOMPLETE ---
+# /ingredients/autocomplete/ answers from a per-process sorted index of the names (ingredients/autocomplete.py)
+AUTOCOMPLETE_RESULTS = env.int('AUTOCOMPLETE_RESULTS', default=10)             # Default number of suggestions
+AUTOCOMPLETE_MAX_RESULTS = 50                                                   # Upper bound of ?limit=
+AUTOCOMPLETE_REFRESH_INTERVAL = env.float('AUTOCOMPLETE_REFRESH_INTERVAL', default=1.0)   # Seconds between version checks
+AUTOCOMPLETE_INDEX_MAX_ENTRIES = env.int('AUTOCOMPLETE_INDEX_MAX_ENTRIES', default=500000)  # Larger catalogs query the database
+
+# --- WHAT CAN I COOK ---
+# /recipes/pantry/ ranks recipes from a per-process inverted index of the ingredient links (recipes/pantry.py)
+PANTRY_RESULTS = env.int('PANTRY_RESULTS', default=24)                         # Recipes listed per query
+PANTRY_MAX_INGREDIENTS = 100                                                    # Pantry size accepted by the form
+PANTRY_REFRESH_INTERVAL = env.float('PANTRY_REFRESH_INTERVAL', default=1.0)   # Seconds between version checks
+PANTRY_INDEX_MAX_RECIPES = env.int('PANTRY_INDEX_MAX_RECIPES', default=1000000)   # Larger catalogs query the database
+
+# --- SIMILAR RECIPES ---
+# MinHash/LSH neighbours on the recipe detail page (recipes/similarity.py), kept fresh by the worker
+SIMILAR_RECIPES = env.int('SIMILAR_RECIPES', default=6)                        # Neighbours shown per recipe
+SIMILARITY_REFRESH_DELAY = env.int('SIMILARITY_REFRESH_DELAY', default=10)     # Seconds a write waits for the batched refresh
+SIMILARITY_CACHE_TIMEOUT = env.int('SIMILARITY_CACHE_TIMEOUT', default=86400)  # Lists are keyed on the index version
+
+# --- CHART RENDERING ---
+# 0 renders Data Lab charts on the request thread; N > 0 uses a pool of N warmed worker processes
+CHART_RENDER_PROCESSES = env.int('CHART_RENDER_PROCESSES', default=0)
+CHART_RENDER_TIMEOUT = env.float('CHART_RENDER_TIMEOUT', default=10.0)     # Seconds before a pooled render is abandoned
+CHART_RENDER_MAX_TASKS = env.int('CHART_RENDER_MAX_TASKS', default=1000)   # Renders before a worker is replaced
+
+# --- REQUEST PROFILING ---
+# Server-Timing header and a JSON log line per request with query count, SQL, template and chart time
+# (recipes/instrumentation.py). Off by default; the middleware removes itself unless REQUEST_PROFILING is set.
+REQUEST_PROFILING = env.bool('REQUEST_PROFILING', default=False)
+N_PLUS_ONE_THRESHOLD = env.int('N_PLUS_ONE_THRESHOLD', default=10)    # Identical queries in one request that count as an N+1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'recipes.requests': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# --- BACKGROUND TASKS ---
+# https://docs.djangoproject.com/en/6.0/topics/tasks/
+# Queued in the project database and run by `python manage.py run_worker` (image derivatives, large
+# difficulty recomputes). Without a running worker the tasks wait in the recipes_queuedtask table.
+TASKS = {
+    'default': {
+        'BACKEND': 'recipes.task_queue.DatabaseBackend',
+        'QUEUES': ['default'],
+        'OPTIONS': {
+            'MAX_ATTEMPTS': env.int('TASK_MAX_ATTEMPTS', default=3),
+            'RETRY_DELAY': env.float('TASK_RETRY_DELAY', default=10.0),    # Seconds, doubled after every failed attempt
+            'LEASE_SECONDS': env.int('TASK_LEASE_SECONDS', default=900),   # RUNNING rows older than this are requeued
+        },
+    },
+}
+# Difficulty recomputes touching more recipes than this (e.g. deleting a common ingredient) go to the queue
+DIFFICULTY_INLINE_LIMIT = env.int('DIFFICULTY_INLINE_LIMIT', default=500)
+
 # --- AUTHENTICATION ---
 
 # Password validation
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recipe-project.settings')
 
 application = get_wsgi_application()
+
+# Start the chart render pool (if CHART_RENDER_PROCESSES is set) before the first request needs it
+from recipes.charts import warm_pool
+warm_pool()
@@ -0,0 +1,89 @@
+# recipes/benchmarks.py
+# Request-level benchmark of the main pages, run by `manage.py benchmark_views`. Each scenario is a request
+# made through Django's test client, so the numbers include URL routing, middleware, the view, the ORM and
+# template rendering, but not the network or the WSGI server. Every run records latency percentiles and the
+# number of SQL queries; the results are plain dicts that the command writes as JSON for later comparison.
+import random
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ingredients.models import Ingredient
+from .models import Recipe
+
+SEARCH_TERM = 'pasta'                           # One dish out of the synthetic catalog's twenty
+PANTRY_SIZE = 50                                # Ingredients per "what can I cook" query
+
+def recipes_list(client, recipe_id):
+    return client.get(reverse('recipes:recipes_list'))
+
+def recipe_detail(client, recipe_id):
+    return client.get(reverse('recipes:recipe_detail', args=[recipe_id]))
+
+def ingredients_index(client, recipe_id):
+    return client.get(reverse('ingredients:ingredients_index'))
+
+def recipes_search(chart_type):
+    def search(client, recipe_id):
+        return client.post(reverse('recipes:recipes_search'), {'recipe_name': SEARCH_TERM, 'chart_type': chart_type})
+    return search
+
+# A different random pantry per request, drawn from the ingredient names read once by prepare()
+class Pantry:
+    def prepare(self):
+        self.names = list(Ingredient.objects.values_list('name', flat=True))
+
+    def __call__(self, client, recipe_id):
+        names = random.Random(recipe_id).sample(self.names, min(PANTRY_SIZE, len(self.names)))
+        return client.get(reverse('recipes:pantry'), {'ingredients': ', '.join(names)})
+
+# name -> function(client, recipe_id) making one request; recipe_id is a random existing recipe.
+# A scenario with a prepare() method gets it called once, untimed, before the warmup.
+SCENARIOS = {
+    'recipes_list': recipes_list,
+    'recipe_detail': recipe_detail,
+    'recipes_search#1': recipes_search('#1'),
+    'recipes_search#2': recipes_search('#2'),
+    'recipes_search#3': recipes_search('#3'),
+    'ingredients_index': ingredients_index,
+    'pantry': Pantry(),
+}
+
+# Nearest-rank percentile of an already sorted list
+def percentile(values, q):
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+def run_scenario(client, name, repeat, warmup=2, seed=0):
+    rng = random.Random(seed)
+    request = SCENARIOS[name]
+    ids = list(Recipe.objects.values_list('pk', flat=True))
+    if hasattr(request, 'prepare'):
+        request.prepare()
+    for _ in range(warmup):                     # Template loading, first connection, lazy imports
+        request(client, rng.choice(ids))
+
+    timings, queries = [], []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = request(client, rng.choice(ids))
+            timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'{name} answered {response.status_code}')
+        queries.append(len(ctx.captured_queries))
+    timings.sort()
+    return {
+        'scenario': name,
+        'runs': repeat,
+        'p50_ms': round(percentile(timings, 0.50), 2),
+        'p90_ms': round(percentile(timings, 0.90), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'max_ms': round(timings[-1], 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'queries': max(queries),
+        'bytes': len(response.content),
+    }
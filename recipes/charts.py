@@ -0,0 +1,253 @@
+# recipes/charts.py
+# Chart rendering for the Data Lab. Charts are drawn on their own Figure with the Agg canvas instead of
+# pyplot's global current figure, so renders are thread-safe and leave nothing behind in the worker.
+# With settings.CHART_RENDER_PROCESSES > 0 they run in a bounded pool of warmed processes instead of
+# the request thread; workers are replaced after CHART_RENDER_MAX_TASKS renders to keep memory flat.
+# chart_payload() and render_svg() are the lightweight alternative: pre-aggregated series for drawing
+# in the browser, or a hand-built SVG, both downsampled to at most MAX_POINTS points.
+# This module must stay importable without Django settings: pool workers only import it to render.
+# matplotlib is imported on the first PNG render, so workers that never draw one never load it.
+import html
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+MAX_POINTS = 60                                 # More bars than this are unreadable at 600px anyway
+
+TITLES = {
+    '#1': 'Cooking Time Comparison',
+    '#2': 'Difficulty Distribution',
+    '#3': 'Complexity Trends',
+}
+
+class ChartRenderTimeout(Exception):
+    pass
+
+# Truncate recipe names to 18 characters followed by '...'
+def truncate(name, length=18):
+    return (name[:length] + '...') if len(name) > length else name
+
+# Returns the PNG bytes of a figure
+def get_graph(fig):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    buffer = BytesIO()
+    FigureCanvasAgg(fig).print_png(buffer)
+    return buffer.getvalue()
+
+# Tilt category labels 45 degrees
+def _tilt_labels(ax):
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+
+# Renders one chart from the series produced by utils.chart_series() and returns the PNG bytes
+def render_chart(chart_type, series):
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(6,4))
+    ax = fig.add_subplot()
+
+    truncated_names = [truncate(name) for name in series['labels']]
+
+    try:
+        if chart_type == '#1':
+            # Bar Chart: Cooking Time Comparison
+            ax.bar(truncated_names, series['cooking_time'], color='#e67e22')
+            ax.set_ylabel('Cooking Time (min)')
+            ax.set_title(TITLES['#1'])
+            _tilt_labels(ax)
+
+        elif chart_type == '#2':
+            # Pie Chart: Difficulty Distribution (occurrences of each difficulty level)
+            ax.pie(series['counts'], labels=series['labels'], autopct='%1.1f%%', startangle=140)
+            ax.set_title(TITLES['#2'])
+
+        elif chart_type == '#3':
+            # Line Chart: Ingredients vs Time
+            ax.plot(truncated_names, series['cooking_time'], marker='o', label='Cooking Time')
+            ax.plot(truncated_names, series['ingredient_count'], marker='s', label='Ingredient Count')
+            ax.set_title(TITLES['#3'])
+            ax.legend()
+            _tilt_labels(ax)
+
+        fig.tight_layout()
+        return get_graph(fig)
+    finally:
+        fig.clear()                             # Drop the artists right away instead of waiting for the GC
+
+# --- Data mode: pre-aggregated series and SVG ---
+
+# Averages consecutive points into at most max_points buckets; a bucket is labelled by its first recipe
+def downsample(labels, values, max_points):
+    if len(labels) <= max_points:
+        return labels, values, 1
+    size = math.ceil(len(labels) / max_points)
+    bucket_labels, bucket_values = [], []
+    for start in range(0, len(labels), size):
+        chunk = labels[start:start + size]
+        bucket_labels.append(f'{chunk[0]} (+{len(chunk) - 1})' if len(chunk) > 1 else chunk[0])
+        bucket_values.append([round(sum(column[start:start + size]) / len(chunk), 1) for column in values])
+    return bucket_labels, [list(column) for column in zip(*bucket_values)], size
+
+# Compact, JSON-serializable description of a chart, ready to be drawn by the browser or by render_svg()
+def chart_payload(chart_type, series, max_points=MAX_POINTS):
+    if chart_type == '#2':
+        return {
+            'type': 'pie', 'title': TITLES['#2'], 'points': sum(series['counts']),
+            'labels': series['labels'], 'series': [{'name': 'Recipes', 'values': series['counts']}],
+        }
+    names = ['Cooking Time (min)'] + (['Ingredient Count'] if chart_type == '#3' else [])
+    keys = ['cooking_time'] + (['ingredient_count'] if chart_type == '#3' else [])
+    labels, values, bucket = downsample(
+        [truncate(name) for name in series['labels']], [series[key] for key in keys], max_points
+    )
+    return {
+        'type': 'line' if chart_type == '#3' else 'bar', 'title': TITLES.get(chart_type, ''),
+        'points': len(series['labels']), 'bucket': bucket, 'labels': labels,
+        'series': [{'name': name, 'values': column} for name, column in zip(names, values)],
+    }
+
+COLORS = ['#e67e22', '#2c3e50', '#27ae60', '#8e44ad', '#c0392b']
+
+# Minimal SVG for a chart payload: string formatting only, no plotting library involved
+def render_svg(payload, width=600, height=400):
+    left, right, top, bottom = 50, 20, 40, 110
+    plot_w, plot_h = width - left - right, height - top - bottom
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" role="img" '
+        f'font-family="sans-serif" font-size="10">',
+        f'<text x="{width / 2}" y="22" text-anchor="middle" font-size="14">{html.escape(payload["title"])}</text>',
+    ]
+    labels = payload['labels']
+
+    if not labels:
+        parts.append(f'<text x="{width / 2}" y="{height / 2}" text-anchor="middle">No data</text>')
+
+    elif payload['type'] == 'pie':
+        values = payload['series'][0]['values']
+        total = sum(values)
+        cx, cy, r = width / 2, top + (height - top) / 2 - 10, (height - top) / 2 - 30
+        angle = -math.pi / 2
+        for i, (label, value) in enumerate(zip(labels, values)):
+            sweep = 2 * math.pi * value / total
+            x1, y1 = cx + r * math.cos(angle), cy + r * math.sin(angle)
+            x2, y2 = cx + r * math.cos(angle + sweep), cy + r * math.sin(angle + sweep)
+            color = COLORS[i % len(COLORS)]
+            if value == total:                  # A single slice is a full circle, which an arc cannot draw
+                parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{r:.1f}" fill="{color}"/>')
+            else:
+                parts.append(
+                    f'<path d="M{cx:.1f},{cy:.1f} L{x1:.1f},{y1:.1f} A{r:.1f},{r:.1f} 0 {int(sweep > math.pi)} 1 '
+                    f'{x2:.1f},{y2:.1f} Z" fill="{color}"/>'
+                )
+            mid = angle + sweep / 2
+            parts.append(
+                f'<text x="{cx + (r + 14) * math.cos(mid):.1f}" y="{cy + (r + 14) * math.sin(mid):.1f}" '
+                f'text-anchor="middle">{html.escape(label)} {100 * value / total:.1f}%</text>'
+            )
+            angle += sweep
+
+    else:
+        peak = max((max(s['values']) for s in payload['series'] if s['values']), default=0) or 1
+        step = plot_w / len(labels)
+        y = lambda value: top + plot_h - plot_h * value / peak
+        parts.append(f'<line x1="{left}" y1="{top + plot_h}" x2="{left + plot_w}" y2="{top + plot_h}" stroke="#999"/>')
+        parts.append(f'<text x="{left - 6}" y="{top + 4}" text-anchor="end">{peak:g}</text>')
+        for i, s in enumerate(payload['series']):
+            color = COLORS[i % len(COLORS)]
+            if payload['type'] == 'bar':
+                for j, value in enumerate(s['values']):
+                    parts.append(
+                        f'<rect x="{left + j * step + step * 0.1:.1f}" y="{y(value):.1f}" width="{step * 0.8:.1f}" '
+                        f'height="{top + plot_h - y(value):.1f}" fill="{color}"/>'
+                    )
+            else:
+                points = ' '.join(f'{left + (j + 0.5) * step:.1f},{y(value):.1f}' for j, value in enumerate(s['values']))
+                parts.append(f'<polyline points="{points}" fill="none" stroke="{color}" stroke-width="2"/>')
+                parts.append(
+                    f'<text x="{left + plot_w}" y="{top + 12 * i}" text-anchor="end" fill="{color}">'
+                    f'{html.escape(s["name"])}</text>'
+                )
+        for j, label in enumerate(labels):
+            x = left + (j + 0.5) * step
+            parts.append(
+                f'<text x="{x:.1f}" y="{top + plot_h + 12}" text-anchor="end" '
+                f'transform="rotate(-45 {x:.1f} {top + plot_h + 12})">{html.escape(label)}</text>'
+            )
+
+    parts.append('</svg>')
+    return ''.join(parts)
+
+# --- Process pool ---
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Pool initializer: pays for the matplotlib imports and font cache before the first real request
+def _warm_up():
+    render_chart('#1', {'labels': ['warm-up'], 'cooking_time': [1]})
+
+def _settings():
+    from django.conf import settings
+    return (
+        getattr(settings, 'CHART_RENDER_PROCESSES', 0),
+        getattr(settings, 'CHART_RENDER_TIMEOUT', 10),
+        getattr(settings, 'CHART_RENDER_MAX_TASKS', 1000),
+    )
+
+# One pool per process; a pool inherited through fork() (e.g. gunicorn --preload) is not reused
+def get_pool():
+    global _pool, _pool_pid
+    processes, _, max_tasks = _settings()
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn'),    # max_tasks_per_child needs spawn/forkserver
+                initializer=_warm_up,
+                max_tasks_per_child=max_tasks,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+# Starts every pool worker now instead of on the first renders (called from wsgi.py)
+def warm_pool():
+    processes = _settings()[0]
+    if processes:
+        pool = get_pool()
+        for _ in range(processes):
+            pool.submit(int)
+
+# Kills the workers of a pool that has a stuck or crashed render; the next render starts a fresh pool
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    if hasattr(pool, 'terminate_workers'):      # Python 3.14+
+        pool.terminate_workers()
+    else:
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# Renders in the pool when one is configured, otherwise on the calling thread.
+# Raises ChartRenderTimeout when a pooled render takes longer than CHART_RENDER_TIMEOUT seconds.
+def render(chart_type, series):
+    processes, timeout, _ = _settings()
+    if not processes:
+        return render_chart(chart_type, series)
+
+    pool = get_pool()
+    try:
+        return pool.submit(render_chart, chart_type, series).result(timeout=timeout)
+    except TimeoutError:
+        _discard_pool(pool)
+        raise ChartRenderTimeout(f'Chart rendering took longer than {timeout}s')
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return render_chart(chart_type, series)     # A crashed worker should not fail the request
@@ -0,0 +1,70 @@
+# recipes/exports.py
+# Catalog dumps as CSV or JSON Lines. Rows come from the database in chunks through QuerySet.iterator()
+# with the ingredient names already joined by the database (StringAgg: string_agg on PostgreSQL,
+# GROUP_CONCAT on SQLite), so memory stays flat whatever the size of the catalog.
+import csv
+import json
+
+from django.db import connection
+from django.db.models import OuterRef, StringAgg, Subquery, Value
+
+EXPORT_COLUMNS = ('id', 'name', 'cooking_time', 'difficulty', 'ingredient_count', 'ingredients')
+AGGREGATE_SEPARATOR = '\x1f'                    # ASCII unit separator: cannot clash with an ingredient name
+CSV_SEPARATOR = '; '                            # How the ingredients cell of a CSV row lists the names
+
+# Ingredient names of the outer recipe joined into one string. A correlated subquery instead of a join + GROUP BY
+# keeps the outer query usable with any search queryset (including ranked full-text ones) and with iterator().
+def ingredient_names_subquery():
+    from .models import RecipeIngredient
+    ordering = {'order_by': 'ingredient__name'} if connection.features.supports_aggregate_order_by_clause else {}
+    names = (
+        RecipeIngredient.objects.filter(recipe=OuterRef('pk'))
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', Value(AGGREGATE_SEPARATOR), **ordering))
+        .values('names')
+    )
+    return Subquery(names)
+
+# (id, name, cooking_time, difficulty, ingredient_count, ingredients) tuples, fetched chunk_size rows at a time
+def export_rows(queryset, chunk_size=2000):
+    return (
+        queryset.annotate(ingredient_names=ingredient_names_subquery())
+        .values_list('id', 'name', 'cooking_time', 'difficulty', 'ingredient_count', 'ingredient_names')
+        .iterator(chunk_size=chunk_size)
+    )
+
+# csv.writer needs a file; this one hands each formatted line back instead of storing it
+class Echo:
+    def write(self, value):
+        return value
+
+# Output is grouped into blocks of `lines_per_block` rows to keep the number of WSGI writes low.
+# The header goes out before the query runs, so clients get the first byte immediately.
+def csv_lines(rows, lines_per_block=500):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    block = []
+    for row in rows:
+        block.append(writer.writerow(row[:-1] + ((row[-1] or '').replace(AGGREGATE_SEPARATOR, CSV_SEPARATOR),)))
+        if len(block) == lines_per_block:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+def jsonl_lines(rows, lines_per_block=500):
+    block = []
+    for row in rows:
+        record = dict(zip(EXPORT_COLUMNS, row))
+        record['ingredients'] = record['ingredients'].split(AGGREGATE_SEPARATOR) if record['ingredients'] else []
+        block.append(json.dumps(record, ensure_ascii=False) + '\n')
+        if len(block) == lines_per_block:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', csv_lines),
+    'jsonl': ('application/x-ndjson; charset=utf-8', jsonl_lines),
+}
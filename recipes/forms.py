@@ -1,4 +1,6 @@
 from django import forms
+from django.conf import settings
+from ingredients.models import Ingredient
 
 # Choices for the chart type dropdown
 CHART__CHOICES = (
@@ -7,6 +9,12 @@ CHART__CHOICES = (
     ('#3', 'Line Chart (Ingredients vs Time)'),
 )
 
+# Choices for how the chart is delivered: a matplotlib PNG, or a lightweight SVG built from downsampled series
+CHART_FORMAT_CHOICES = (
+    ('svg', 'Vector (fast, downsampled)'),
+    ('png', 'Image (detailed)'),
+)
+
 # Class-based form for searching recipes and selecting chart type
 class RecipeSearchForm(forms.Form):
     # Search field for recipe name or ingredients
@@ -26,4 +34,41 @@ class RecipeSearchForm(forms.Form):
         required=False,
         label="Chart Type",
         initial='#1' 
-    )
\ No newline at end of file
+    )
+
+    # Dropdown for the chart format, SVG by default since it needs no server-side plotting
+    chart_format = forms.ChoiceField(
+        choices=CHART_FORMAT_CHOICES,
+        required=False,
+        label="Chart Format",
+        initial='svg'
+    )
+
+# Choices for the "What can I cook" query (recipes/pantry.py)
+PANTRY_MODE_CHOICES = (
+    ('rank', 'Most of my ingredients'),
+    ('all', 'Uses all of them'),
+    ('missing', 'Missing at most...'),
+)
+
+# Form for the pantry search: ingredient names separated by commas or new lines
+class PantryForm(forms.Form):
+    ingredients = forms.CharField(
+        max_length=8000,
+        label="My Ingredients",
+        widget=forms.Textarea(attrs={'rows': 3, 'placeholder': 'e.g. eggs, flour, milk, butter'})
+    )
+
+    mode = forms.ChoiceField(choices=PANTRY_MODE_CHOICES, required=False, label="Show Recipes That")
+
+    max_missing = forms.IntegerField(min_value=0, max_value=20, required=False, initial=1, label="Missing Ingredients")
+
+    # Normalized like Ingredient.save(), deduplicated, in the order given
+    def clean_ingredients(self):
+        names = self.cleaned_data['ingredients'].replace('\n', ',').split(',')
+        names = list(dict.fromkeys(filter(None, map(Ingredient.normalize_name, names))))
+        if not names:
+            raise forms.ValidationError('Enter at least one ingredient.')
+        if len(names) > settings.PANTRY_MAX_INGREDIENTS:
+            raise forms.ValidationError(f'Enter at most {settings.PANTRY_MAX_INGREDIENTS} ingredients.')
+        return names
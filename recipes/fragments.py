@@ -0,0 +1,60 @@
+# recipes/fragments.py
+# Per-object fragment cache for the markup that is the same for every user: recipe cards and ingredient pills.
+# Each fragment is keyed on the object's (pk, updated_at), any extra fields the fragment shows that live
+# outside the row (e.g. an annotated recipe_count) and a hash of the fragment template's source, so a
+# deploy that edits the template does not serve old markup. A page of N objects costs one get_many() and,
+# for the fragments that were missing or stale, one set_many(); only those are rendered.
+#
+# This sits under the page cache (recipes/page_cache.py): after a catalog write invalidates a whole page,
+# the re-render only has to redo the cards of the rows that actually changed.
+from functools import cache
+from hashlib import blake2b
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.safestring import SafeString, mark_safe
+
+# Rendered fragments in the order of the objects, also addressable by primary key
+class Fragments(dict):
+    def __init__(self, items, rendered):
+        super().__init__(items)
+        self.rendered = rendered                # Number of fragments rendered in this call (cache misses)
+
+    def __html__(self):
+        return SafeString(''.join(self.values()))
+
+    __str__ = __html__
+
+# Template sources change only with a deploy (or runserver's autoreload, which restarts the process)
+@cache
+def template_token(template_name):
+    source = get_template(template_name).template.source
+    return blake2b(source.encode(), digest_size=4).hexdigest()
+
+def fragment_key(template_name, obj, key_fields=()):
+    parts = [template_name, template_token(template_name), str(obj.pk), f'{obj.updated_at.timestamp():.6f}']
+    parts += [str(getattr(obj, field)) for field in key_fields]
+    return 'fragment:' + ':'.join(parts)
+
+# Renders `template_name` once per object with the object as `name` in the context.
+# The fragment sees nothing else (no request, no user), which is what makes it safe to share.
+def render_fragments(objects, template_name, name, key_fields=()):
+    objects = list(objects)
+    if not objects:
+        return Fragments({}, 0)
+    fragment_cache = caches[settings.FRAGMENT_CACHE_ALIAS]
+    keys = [fragment_key(template_name, obj, key_fields) for obj in objects]
+    found = fragment_cache.get_many(keys)
+
+    template = get_template(template_name)
+    missing = {}
+    items = []
+    for key, obj in zip(keys, objects):
+        html = found.get(key)
+        if html is None:
+            html = missing[key] = template.render({name: obj})
+        items.append((obj.pk, mark_safe(html)))
+    if missing:
+        fragment_cache.set_many(missing, settings.FRAGMENT_CACHE_TIMEOUT)
+    return Fragments(items, len(missing))
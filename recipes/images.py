@@ -0,0 +1,97 @@
+# recipes/images.py
+# Resized derivatives of uploaded recipe and ingredient images. Every original gets one WebP and one JPEG file
+# per width in DERIVATIVE_WIDTHS (never wider than the original), stored next to it under derivatives/.
+# The model keeps {'source': <original name>, 'widths': [...]} in its image_derivatives field, so templates
+# build srcset lists without touching the storage and stale entries are spotted by comparing the source name.
+# The resizing runs in the task queue worker, not in the upload request; until it is done pages show the
+# original. Pillow is imported inside the functions to keep it out of web worker boot.
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+DERIVATIVE_WIDTHS = (480, 960, 1920)            # Card, card on 2x screens, hero
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),    # Fallback for browsers without WebP
+}
+PLACEHOLDER_NAMES = {'no_image.png'}            # Model defaults that point at the shared placeholder, not an upload
+
+def derivative_name(name, width, ext):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'derivatives', f'{stem}-{width}w.{ext}')
+
+def has_upload(field_file):
+    return bool(field_file) and field_file.name not in PLACEHOLDER_NAMES
+
+# Writes the derivatives of an image field and returns the value for image_derivatives
+def generate_derivatives(field_file, storage=None):
+    from PIL import Image, ImageOps
+    storage = storage or field_file.storage
+    with field_file.open('rb') as source, Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)  # Phone photos carry their rotation in EXIF, the derivatives do not
+        if image.mode != 'RGB':
+            image = image.convert('RGB')        # JPEG has no alpha; the images are photos shown on a white page
+        widths = sorted({min(width, image.width) for width in DERIVATIVE_WIDTHS})
+        for width in widths:
+            resized = image if width == image.width else image.resize(
+                (width, round(image.height * width / image.width)), Image.LANCZOS
+            )
+            for ext, (fmt, options) in DERIVATIVE_FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, fmt, **options)
+                name = derivative_name(field_file.name, width, ext)
+                if storage.exists(name):
+                    storage.delete(name)        # Keep the predictable name instead of a suffixed copy
+                storage.save(name, ContentFile(buffer.getvalue()))
+    return {'source': field_file.name, 'widths': widths}
+
+def is_stale(field_file, info):
+    return (info or {}).get('source') != (field_file.name if has_upload(field_file) else None)
+
+# Called from save(): queues sync_derivatives (see recipes/tasks.py) when the image changed since the last run
+def enqueue_derivatives(instance, field='image', info_field='image_derivatives'):
+    if is_stale(getattr(instance, field), getattr(instance, info_field)):
+        from .tasks import sync_image_derivatives
+        sync_image_derivatives.enqueue(instance._meta.label, instance.pk)
+
+# (Re)generates derivatives when the image changed since the last run, and drops those of a replaced image.
+# The field is written with a queryset update so the model's own save() logic does not run again, while the
+# default manager still invalidates the cached pages that embed the old srcset.
+def sync_derivatives(instance, field='image', info_field='image_derivatives'):
+    field_file = getattr(instance, field)
+    info = getattr(instance, info_field) or {}
+    if not is_stale(field_file, info):
+        return
+    if info.get('source'):
+        delete_derivatives(info['source'], info, field_file.storage)     # The image was replaced or cleared
+    try:
+        info = generate_derivatives(field_file) if has_upload(field_file) else {}
+    except OSError:
+        info = {}                               # Unreadable image: pages show the original, the backfill command reports it
+    setattr(instance, info_field, info)
+    type(instance)._default_manager.filter(pk=instance.pk).update(**{info_field: info})
+
+# "url 480w, url 960w" for one format, or '' when the image has no derivatives yet
+def srcset(field_file, info, ext):
+    if not has_upload(field_file) or not info or info.get('source') != field_file.name:
+        return ''
+    storage = field_file.storage
+    return ', '.join(f'{storage.url(derivative_name(field_file.name, width, ext))} {width}w' for width in info['widths'])
+
+# Derivative of at least `width` pixels (or the largest one) for the plain src of an <img>
+def fallback_url(field_file, info, width):
+    widths = info['widths']
+    chosen = next((candidate for candidate in widths if candidate >= width), widths[-1])
+    return field_file.storage.url(derivative_name(field_file.name, chosen, 'jpg'))
+
+# Removes the derivative files recorded in `info` for the original `name`
+def delete_derivatives(name, info, storage=None):
+    storage = storage or default_storage
+    for width in info.get('widths', []):
+        for ext in DERIVATIVE_FORMATS:
+            derivative = derivative_name(name, width, ext)
+            if storage.exists(derivative):
+                storage.delete(derivative)
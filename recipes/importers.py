@@ -0,0 +1,176 @@
+# recipes/importers.py
+# Bulk loading of recipes with their ingredients. Rows are consumed in batches, one transaction per batch:
+# ingredient names are resolved through an in-memory name -> id map (new ones bulk-created), recipes are
+# bulk-created with ingredient_count and difficulty computed in memory, and links are bulk-inserted without
+# the per-link counter updates of RecipeIngredient.save(); the ingredients' recipe_count is shifted once per
+# batch from the links it added and removed.
+import csv
+from collections import Counter
+import json
+from itertools import batched
+
+from django.db import transaction
+from ingredients.models import Ingredient
+from .models import Recipe, RecipeIngredient, difficulty_for
+
+LOOKUP_CHUNK = 900                              # Values per IN (...) lookup, below every backend's parameter limit
+
+class ImportRowError(ValueError):
+    pass
+
+# One input record as (name, cooking_time, [normalized unique ingredient names])
+def clean_row(name, cooking_time, ingredients):
+    if name is not None and not isinstance(name, str):
+        raise ImportRowError(f'name {name!r} is not a string')
+    name = (name or '').strip()
+    if not name:
+        raise ImportRowError('missing name')
+    if len(name) > Recipe._meta.get_field('name').max_length:
+        raise ImportRowError(f'name longer than {Recipe._meta.get_field("name").max_length} characters')
+    try:
+        cooking_time = int(cooking_time)
+    except (TypeError, ValueError):
+        raise ImportRowError(f'cooking_time {cooking_time!r} is not a number')
+    if cooking_time < 0:
+        raise ImportRowError('negative cooking_time')
+    names = dict.fromkeys(filter(None, map(Ingredient.normalize_name, ingredients)))
+    # Checked here rather than left to the INSERT, which on PostgreSQL would abort the whole batch
+    max_length = Ingredient._meta.get_field('name').max_length
+    for ingredient in names:
+        if len(ingredient) > max_length:
+            raise ImportRowError(f'ingredient {ingredient[:20]!r}... longer than {max_length} characters')
+    return name, cooking_time, list(names)
+
+# Readers yield (line number, raw record); parsers turn a raw record into (name, cooking_time, ingredients).
+# The columns are those written by /recipes/export.csv and export.jsonl; id, difficulty and ingredient_count
+# are recomputed rather than trusted.
+def read_csv(stream):
+    return enumerate(csv.DictReader(stream), start=2)
+
+def parse_csv(row):
+    return row.get('name'), row.get('cooking_time'), (row.get('ingredients') or '').split(';')
+
+def read_jsonl(stream):
+    return ((line, text) for line, text in enumerate(stream, start=1) if text.strip())
+
+def parse_jsonl(text):
+    try:
+        record = json.loads(text)
+    except ValueError as error:
+        raise ImportRowError(f'invalid JSON ({error})')
+    if not isinstance(record, dict):
+        raise ImportRowError('expected a JSON object')
+    ingredients = record.get('ingredients') or []
+    # A bare string would otherwise be iterated into one-letter ingredients
+    if not isinstance(ingredients, list) or not all(isinstance(ingredient, str) for ingredient in ingredients):
+        raise ImportRowError('ingredients must be a list of strings')
+    return record.get('name'), record.get('cooking_time'), ingredients
+
+FORMATS = {
+    'csv': (read_csv, parse_csv),
+    'jsonl': (read_jsonl, parse_jsonl),
+}
+
+# Legacy databases of the cml-prototype app: a flat `recipes` table (id, name, ingredients, cooking_time,
+# difficulty) with the ingredients joined by ', '. SQLAlchemy is only needed for this migration, so it is
+# imported here rather than at module level and is not part of requirements.txt.
+
+# Checkpoint key of a legacy table; the password is masked so it never reaches the database
+def legacy_source(url, table):
+    from sqlalchemy.engine import make_url
+    return f'{make_url(url).render_as_string(hide_password=True)}#{table}'
+
+# Yields lists of rows with id > after_id in id order, chunk_size rows at a time. stream_results asks for a
+# server-side cursor (PostgreSQL, MySQL); drivers without one (SQLite) still fetch in chunks via yield_per.
+def read_legacy_table(url, table='recipes', after_id=0, chunk_size=5000):
+    from sqlalchemy import MetaData, Table, create_engine, select
+    engine = create_engine(url)
+    try:
+        legacy = Table(table, MetaData(), autoload_with=engine)
+        query = (
+            select(legacy.c.id, legacy.c.name, legacy.c.cooking_time, legacy.c.ingredients)
+            .where(legacy.c.id > after_id)
+            .order_by(legacy.c.id)
+        )
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+            yield from result.partitions()
+    finally:
+        engine.dispose()
+
+def parse_legacy(row):
+    return row.name, row.cooking_time, (row.ingredients or '').split(',')
+
+class RecipeImporter:
+    def __init__(self, upsert=False, insert_batch_size=2000):
+        self.upsert = upsert
+        self.insert_batch_size = insert_batch_size
+        self.ingredient_ids = {}                # Normalized name -> id, grows with the import
+        self.created = self.updated = self.skipped = self.links = 0
+
+    # Resolves every name to an id: first the map, then the database, then bulk_create for the rest
+    def _resolve_ingredients(self, names):
+        missing = [name for name in set(names) if name not in self.ingredient_ids]
+        for chunk in batched(missing, LOOKUP_CHUNK):
+            self.ingredient_ids.update(Ingredient.objects.filter(name__in=chunk).values_list('name', 'pk'))
+        new = [name for name in missing if name not in self.ingredient_ids]
+        if new:
+            # ignore_conflicts: another process may have created some of them meanwhile, so re-read the ids
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name) for name in new], batch_size=self.insert_batch_size, ignore_conflicts=True
+            )
+            for chunk in batched(new, LOOKUP_CHUNK):
+                self.ingredient_ids.update(Ingredient.objects.filter(name__in=chunk).values_list('name', 'pk'))
+
+    # Imports cleaned (name, cooking_time, ingredient names) rows in one transaction
+    def import_batch(self, rows):
+        if self.upsert:
+            rows = list({name: (name, time, names) for name, time, names in rows}.values())    # Last row wins
+        with transaction.atomic():
+            self._resolve_ingredients([ingredient for _, _, names in rows for ingredient in names])
+
+            existing = set()
+            for chunk in batched([name for name, _, _ in rows], LOOKUP_CHUNK):
+                existing.update(Recipe.objects.filter(name__in=chunk).values_list('name', flat=True))
+            if not self.upsert:
+                # Names are unique: rows whose recipe already exists (or repeats within the batch) are skipped
+                fresh = []
+                for row in rows:
+                    if row[0] in existing:
+                        self.skipped += 1
+                    else:
+                        existing.add(row[0])
+                        fresh.append(row)
+                rows = fresh
+
+            deltas = Counter()                  # Ingredient id -> links added minus links removed in this batch
+            recipes = [
+                Recipe(name=name, cooking_time=time, ingredient_count=len(names), difficulty=difficulty_for(time, len(names)))
+                for name, time, names in rows
+            ]
+            if self.upsert:
+                Recipe.objects.bulk_create(
+                    recipes, batch_size=self.insert_batch_size, update_conflicts=True, unique_fields=['name'],
+                    update_fields=['cooking_time', 'ingredient_count', 'difficulty', 'updated_at'],
+                )
+                replaced = [recipe.pk for recipe in recipes if recipe.name in existing]
+                for chunk in batched(replaced, LOOKUP_CHUNK):
+                    old_links = RecipeIngredient._base_manager.filter(recipe_id__in=chunk)
+                    deltas.subtract(old_links.values_list('ingredient_id', flat=True))    # Read before the delete
+                    old_links.delete()
+                self.updated += len(replaced)
+                self.created += len(recipes) - len(replaced)
+            else:
+                Recipe.objects.bulk_create(recipes, batch_size=self.insert_batch_size)
+                self.created += len(recipes)
+
+            # The counters were set above, so the links skip RecipeIngredient's own counter maintenance
+            links = [
+                RecipeIngredient(recipe_id=recipe.pk, ingredient_id=self.ingredient_ids[ingredient])
+                for recipe, (_, _, names) in zip(recipes, rows)
+                for ingredient in names
+            ]
+            RecipeIngredient._base_manager.bulk_create(links, batch_size=self.insert_batch_size)
+            self.links += len(links)
+            deltas.update(link.ingredient_id for link in links)
+            Ingredient.objects.shift_recipe_count(deltas)
@@ -0,0 +1,151 @@
+# recipes/instrumentation.py
+# Opt-in per-request profiling (REQUEST_PROFILING=True): number of SQL queries, SQL time, template render
+# time and chart render time of every request. Reported as a Server-Timing header (shown by the browser's
+# devtools next to the request) and as one JSON log line on the 'recipes.requests' logger.
+#
+# Queries are grouped by shape, i.e. the SQL text with its parameters left out and IN (...) lists collapsed.
+# A shape repeated N_PLUS_ONE_THRESHOLD times in one request is almost always a query inside a loop
+# (`obj.ingredients.count()` per row and the like); it is logged as a warning with the view that ran it.
+#
+# Streaming responses run most of their queries after the view has returned, while the server iterates the
+# body. Their header only covers the view; the log line is written when the body is finished.
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+logger = logging.getLogger('recipes.requests')
+
+_profile = ContextVar('request_profile', default=None)
+
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+SHAPE_LENGTH = 300                              # Characters of a repeated shape quoted in the warning
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.shapes = Counter()
+        self.timings = Counter()                # 'sql', 'template', 'chart' -> seconds
+        self.depth = Counter()                  # Nesting of timed sections, so inner renders are not counted twice
+
+    # django.db execute wrapper: times every statement run on a connection while installed
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings['sql'] += time.perf_counter() - started
+            self.queries += 1
+            self.shapes[IN_LIST.sub('(...)', sql)] += 1
+
+    @contextmanager
+    def section(self, name):
+        self.depth[name] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.depth[name] -= 1
+            if not self.depth[name]:
+                self.timings[name] += time.perf_counter() - started
+
+    def repeated_shapes(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def server_timing(self):
+        metrics = [
+            f'sql;dur={self.timings["sql"] * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.timings["template"] * 1000:.1f};desc="Templates"',
+        ]
+        if self.timings['chart']:
+            metrics.append(f'chart;dur={self.timings["chart"] * 1000:.1f};desc="Charts"')
+        metrics.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(metrics)
+
+# Times a block against the current request's profile; a no-op when profiling is off
+@contextmanager
+def timed(name):
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.section(name):
+        yield
+
+# Every top-level render of a Django template, including TemplateResponse and render_to_string(),
+# goes through the backend Template.render; {% include %} does not, and nested renders are counted once.
+_template_render = Template.render
+
+def _timed_render(self, *args, **kwargs):
+    with timed('template'):
+        return _template_render(self, *args, **kwargs)
+
+class RequestProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = settings.N_PLUS_ONE_THRESHOLD
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        for connection in connections.all():
+            connection.execute_wrappers.append(profile)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.finish(request, profile, None)
+            raise
+        finally:
+            _profile.reset(token)
+
+        response['Server-Timing'] = profile.server_timing()
+        if response.streaming:
+            response.streaming_content = self.stream(request, profile, response, response.streaming_content)
+        else:
+            self.finish(request, profile, response)
+        return response
+
+    # Keeps counting queries while the server sends the body, then reports the whole request
+    def stream(self, request, profile, response, content):
+        try:
+            yield from content
+        finally:
+            self.finish(request, profile, response)
+
+    def finish(self, request, profile, response):
+        for connection in connections.all():
+            if profile in connection.execute_wrappers:
+                connection.execute_wrappers.remove(profile)
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else None
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code if response is not None else None,
+            'queries': profile.queries,
+            'sql_ms': round(profile.timings['sql'] * 1000, 1),
+            'template_ms': round(profile.timings['template'] * 1000, 1),
+            'chart_ms': round(profile.timings['chart'] * 1000, 1),
+            'total_ms': round((time.perf_counter() - profile.started) * 1000, 1),
+        }
+        repeated = profile.repeated_shapes(self.threshold)
+        record['n_plus_one'] = len(repeated)
+        logger.info(json.dumps(record))
+        for shape, count in repeated:
+            logger.warning(
+                'Probable N+1 in %s: %d identical queries: %s', view, count, shape[:SHAPE_LENGTH],
+                extra={'view': view, 'query_count': count, 'shape': shape},
+            )
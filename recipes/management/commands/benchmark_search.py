@@ -0,0 +1,51 @@
+# recipes/management/commands/benchmark_search.py
+# Measures Data Lab search latency of the original icontains search against the active search backend.
+# With --recipes N a synthetic catalog is generated inside a transaction that is rolled back afterwards.
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe
+from recipes.search import BasicSearchBackend, get_search_backend
+from recipes.synthetic import generate_catalog
+
+DEFAULT_TERMS = ['pasta', 'spicy curry', 'garlic', 'smoked salmon', 'hard', 'tom']
+
+class Command(BaseCommand):
+    help = 'Benchmark recipe search latency (icontains vs. the full-text backend).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=0, help='Generate this many synthetic recipes first (rolled back at the end).')
+        parser.add_argument('--ingredients', type=int, default=2000, help='Size of the synthetic ingredient pool.')
+        parser.add_argument('--links', type=int, default=8, help='Ingredients per synthetic recipe.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per term.')
+        parser.add_argument('--terms', nargs='+', default=DEFAULT_TERMS, help='Search terms to time.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['recipes']:
+                started = time.perf_counter()
+                generate_catalog(options['recipes'], options['ingredients'], options['links'])
+                self.stdout.write(f"Generated {options['recipes']} recipes in {time.perf_counter() - started:.1f}s")
+            self.stdout.write(f'Catalog: {Recipe.objects.count()} recipes')
+
+            for backend in (BasicSearchBackend(), get_search_backend()):
+                self.stdout.write(self.style.MIGRATE_HEADING(type(backend).__name__))
+                for term in options['terms']:
+                    self.report(backend, term, options['repeat'])
+
+            transaction.set_rollback(True)      # Never keep the synthetic rows
+
+    # Times the full search (query + materializing the rows the Data Lab needs)
+    def report(self, backend, term, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = list(backend.search(Recipe.objects.all(), term).values_list('id', 'name', 'cooking_time', 'difficulty', 'ingredient_count'))
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, round(0.95 * (len(timings) - 1)))]
+        self.stdout.write(
+            f'  {term!r:<18} {len(rows):>7} rows   p50 {statistics.median(timings):8.1f} ms   p95 {p95:8.1f} ms'
+        )
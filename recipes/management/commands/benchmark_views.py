@@ -0,0 +1,105 @@
+# recipes/management/commands/benchmark_views.py
+# Latency percentiles and query counts of the main pages at growing catalog sizes (recipes/benchmarks.py).
+# The catalog is grown to each --sizes value with the synthetic generator inside a transaction that is
+# rolled back at the end, so the benchmark can run against any database. Results are written as JSON with
+# --output; --compare prints the p50 change against an earlier results file, e.g. one from the previous commit.
+import json
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+from recipes.benchmarks import SCENARIOS, run_scenario
+from recipes.models import Recipe
+from recipes.synthetic import generate_catalog
+
+DUMMY_CACHE = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Command(BaseCommand):
+    help = 'Benchmark the recipe list, detail, Data Lab and ingredient index at several catalog sizes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Catalog sizes (recipes) to measure at.')
+        parser.add_argument('--ingredients', type=int, default=2000, help='Size of the synthetic ingredient pool.')
+        parser.add_argument('--links-per-recipe', type=int, default=8, help='Ingredients per synthetic recipe.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per scenario and size.')
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append', help='Only this scenario (repeatable).')
+        parser.add_argument('--cached', action='store_true', help='Keep the page, fragment and chart caches on (default: measure renders).')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='Earlier results file to compare the p50 latencies with.')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenario'] or list(SCENARIOS)
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'], 'REQUEST_PROFILING': False}
+        if not options['cached']:
+            overrides['PAGE_CACHE_TIMEOUT'] = 0
+            overrides['CACHES'] = {**settings.CACHES, 'fragments': DUMMY_CACHE, 'charts': DUMMY_CACHE}
+        baseline = self.load(options['compare']) if options['compare'] else {}
+
+        results = []
+        with transaction.atomic(), override_settings(**overrides):
+            client = Client()
+            client.force_login(User.objects.create_user(f'benchmark-{time.time_ns()}'))
+            for size in sorted(options['sizes']):
+                existing = Recipe.objects.count()
+                if existing < size:
+                    started = time.perf_counter()
+                    generate_catalog(size - existing, options['ingredients'], options['links_per_recipe'], seed=size)
+                    self.stdout.write(f'Grew the catalog to {size} recipes in {time.perf_counter() - started:.1f}s')
+                elif existing > size:
+                    self.stdout.write(self.style.WARNING(f'Catalog already has {existing} recipes, measuring that instead of {size}'))
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{max(existing, size)} recipes'))
+                for name in scenarios:
+                    result = {'size': max(existing, size), **run_scenario(client, name, options['repeat'])}
+                    results.append(result)
+                    self.report(result, baseline.get((result['size'], name)))
+            transaction.set_rollback(True)      # Never keep the synthetic rows or the benchmark user
+
+        if options['output']:
+            document = {
+                'created': timezone.now().isoformat(),
+                'commit': git_commit(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'cached': options['cached'],
+                'ingredients': options['ingredients'],
+                'links_per_recipe': options['links_per_recipe'],
+                'results': results,
+            }
+            Path(options['output']).write_text(json.dumps(document, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Wrote {len(results)} results to {options["output"]}'))
+
+    def report(self, result, previous):
+        line = (
+            f'  {result["scenario"]:<18} p50 {result["p50_ms"]:8.1f} ms   p95 {result["p95_ms"]:8.1f} ms   '
+            f'p99 {result["p99_ms"]:8.1f} ms   {result["queries"]:>3} queries'
+        )
+        if previous:
+            change = (result['p50_ms'] - previous['p50_ms']) / max(previous['p50_ms'], 1e-9) * 100
+            line += f'   p50 {change:+.0f}% vs {previous["p50_ms"]:.1f} ms'
+            if result['queries'] != previous['queries']:
+                line += f', queries {previous["queries"]} -> {result["queries"]}'
+        self.stdout.write(line)
+
+    def load(self, path):
+        try:
+            document = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        return {(result['size'], result['scenario']): result for result in document['results']}
@@ -0,0 +1,26 @@
+# recipes/management/commands/build_similarity_index.py
+# Builds the MinHash/LSH index behind the "Similar recipes" section (recipes/similarity.py). After the first
+# build the worker keeps it current; run this again after loading links outside the ORM, or with --full
+# after changing the signature parameters.
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe, RecipeBand
+from recipes.similarity import BANDS, NUM_PERM, refresh, stale_recipes
+
+class Command(BaseCommand):
+    help = 'Compute the MinHash signatures and LSH buckets of recipes that have none or whose ingredients changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every recipe, not only the stale ones.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Recipes per batch and transaction.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all() if options['full'] else stale_recipes()
+        started = time.perf_counter()
+        updated = refresh(recipes.values_list('pk', flat=True), batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {updated} recipes in {elapsed:.2f}s '
+            f'({NUM_PERM} hashes in {BANDS} bands, {RecipeBand.objects.count()} bucket rows).'
+        ))
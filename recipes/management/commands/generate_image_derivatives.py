@@ -0,0 +1,60 @@
+# recipes/management/commands/generate_image_derivatives.py
+# Backfills the resized WebP/JPEG copies of recipe and ingredient images that were uploaded before the
+# derivative pipeline existed (or whose files were restored from a backup). New uploads get theirs on save().
+import time
+
+from django.core.management.base import BaseCommand
+from ingredients.models import Ingredient
+from recipes.images import DERIVATIVE_WIDTHS, delete_derivatives, derivative_name, generate_derivatives, has_upload
+from recipes.models import Recipe
+
+MODELS = {'recipes': Recipe, 'ingredients': Ingredient}
+
+class Command(BaseCommand):
+    help = 'Generate the resized WebP/JPEG derivatives of recipe and ingredient images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), action='append', help='Only this model (repeatable, default: all).')
+        parser.add_argument('--force', action='store_true', help='Regenerate images whose derivatives are already up to date.')
+
+    def handle(self, *args, **options):
+        generated = current = failed = original_bytes = card_bytes = 0
+        started = time.perf_counter()
+        for key in options['model'] or sorted(MODELS):
+            model = MODELS[key]
+            objects = model.objects.exclude(image='').exclude(image__isnull=True).only('pk', 'image', 'image_derivatives')
+            for obj in objects.order_by('pk').iterator(chunk_size=500):
+                if not has_upload(obj.image):
+                    continue
+                info = obj.image_derivatives or {}
+                if info.get('source') == obj.image.name and not options['force']:
+                    current += 1
+                    continue
+                try:
+                    if info.get('source'):
+                        delete_derivatives(info['source'], info, obj.image.storage)
+                    info = generate_derivatives(obj.image)
+                except OSError as error:
+                    failed += 1
+                    self.stderr.write(f'{key} {obj.pk} ({obj.image.name}): {error}')
+                    continue
+                model.objects.filter(pk=obj.pk).update(image_derivatives=info)   # Also invalidates the cached pages
+                generated += 1
+
+                storage = obj.image.storage
+                original_bytes += storage.size(obj.image.name)
+                card_bytes += storage.size(derivative_name(obj.image.name, info['widths'][0], 'webp'))
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'  {key} {obj.pk}: {obj.image.name} -> {info["widths"]}')
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {generated} images in {elapsed:.1f}s ({current} already up to date).'
+        ))
+        if generated:
+            self.stdout.write(
+                f'Originals {original_bytes / 1024:,.0f} KB -> {DERIVATIVE_WIDTHS[0]}w WebP cards {card_bytes / 1024:,.0f} KB '
+                f'({original_bytes / max(card_bytes, 1):.1f}x smaller).'
+            )
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Skipped {failed} unreadable images.'))
@@ -0,0 +1,59 @@
+# recipes/management/commands/import_recipes.py
+# Streams a CSV or JSONL catalog (the format of /recipes/export.csv and export.jsonl) into the database
+# in batched bulk inserts. The search index triggers are suspended during the load and the index is
+# rebuilt once at the end.
+import sys
+import time
+from contextlib import nullcontext
+from itertools import batched
+
+from django.core.management.base import BaseCommand, CommandError
+from recipes.importers import FORMATS, ImportRowError, RecipeImporter, clean_row
+from recipes.search import bulk_indexing
+
+class Command(BaseCommand):
+    help = 'Bulk-import recipes and their ingredients from a CSV or JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file with name, cooking_time and ingredients columns, or - for stdin.')
+        parser.add_argument('--format', choices=sorted(FORMATS), help='Input format (default: from the file extension, else csv).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Recipes per transaction.')
+        parser.add_argument('--upsert', action='store_true', help='Update recipes whose name already exists (and replace their ingredients) instead of skipping them.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        try:
+            stream = nullcontext(sys.stdin) if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(error)
+
+        read, parse = FORMATS[fmt]
+        importer = RecipeImporter(upsert=options['upsert'])
+        self.invalid = 0
+        started = time.perf_counter()
+        with stream as lines, bulk_indexing():
+            for batch in batched(self.clean_rows(read(lines), parse), options['batch_size']):
+                importer.import_batch(batch)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'  {importer.created + importer.updated} recipes, {importer.links} links')
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.created} new and {importer.updated} updated recipes with {importer.links} links '
+            f'in {elapsed:.1f}s ({(importer.created + importer.updated) / elapsed:,.0f} recipes/s, '
+            f'{importer.links / elapsed:,.0f} links/s).'
+        ))
+        if importer.skipped:
+            self.stdout.write(self.style.WARNING(f'Skipped {importer.skipped} recipes that already exist (use --upsert to update them).'))
+        if self.invalid:
+            self.stdout.write(self.style.WARNING(f'Skipped {self.invalid} invalid rows.'))
+
+    # Invalid rows are reported with their line number and skipped, the rest of the file still loads
+    def clean_rows(self, records, parse):
+        for line, record in records:
+            try:
+                yield clean_row(*parse(record))
+            except ImportRowError as error:
+                self.invalid += 1
+                self.stderr.write(f'Line {line}: {error}')
@@ -0,0 +1,78 @@
+# recipes/management/commands/recompute_difficulty.py
+# Repairs the stored ingredient_count and difficulty of recipes with set-based UPDATEs,
+# e.g. after ingredients were removed with raw SQL or rows were loaded outside the ORM. Without --ids or
+# --from-id the ingredients' stored recipe_count is repaired (or checked) as well.
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from ingredients.models import Ingredient
+from recipes.models import Recipe
+
+class Command(BaseCommand):
+    help = 'Recompute ingredient_count and difficulty for recipes (and recipe_count for ingredients) in batched UPDATE statements.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', nargs='+', type=int, help='Only the recipes with these ids.')
+        parser.add_argument('--from-id', type=int, help='Only recipes with an id greater than or equal to FROM_ID (e.g. the rows of the last import).')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of recipes per UPDATE statement.')
+        parser.add_argument('--check', action='store_true', help='Dry run: report drifted recipes and exit with status 1 if there are any.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options['ids']:
+            recipes = recipes.filter(pk__in=options['ids'])
+        if options['from_id'] is not None:
+            recipes = recipes.filter(pk__gte=options['from_id'])
+        whole_catalog = not options['ids'] and options['from_id'] is None
+
+        if options['check']:
+            drifted = self.report_drift(recipes)
+            if whole_catalog:
+                drifted += self.report_ingredient_drift(Ingredient.objects.all())
+            if drifted:
+                # Non-zero status so scheduled checks can alert on drift
+                raise CommandError(f'{drifted} drifted rows found; run without --check to repair them.', returncode=1)
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+            return
+
+        started = time.perf_counter()
+        updated = recipes.recompute_difficulty(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {updated} recipes in {elapsed:.2f}s.'))
+        if whole_catalog:
+            started = time.perf_counter()
+            updated = Ingredient.objects.recompute_recipe_count(batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f'Recounted recipes of {updated} ingredients in {elapsed:.2f}s.'))
+
+    # Lists the recipes whose stored values disagree with their ingredient links without writing anything
+    def report_drift(self, recipes, limit=20):
+        drifted = recipes.with_drift().order_by('pk')
+        total = drifted.count()
+        if not total:
+            return 0
+
+        self.stdout.write(self.style.WARNING(f'{total} recipes have drifted:'))
+        for recipe in drifted[:limit]:
+            self.stdout.write(
+                f'  {recipe.pk} {recipe.name}: '
+                f'{recipe.ingredient_count} ingredients / {recipe.difficulty} '
+                f'-> {recipe.expected_count} ingredients / {recipe.expected_difficulty}'
+            )
+        if total > limit:
+            self.stdout.write(f'  ... and {total - limit} more')
+        return total
+
+    # Same for the ingredients' stored recipe_count
+    def report_ingredient_drift(self, ingredients, limit=20):
+        drifted = ingredients.with_drift().order_by('pk')
+        total = drifted.count()
+        if not total:
+            return 0
+
+        self.stdout.write(self.style.WARNING(f'{total} ingredients have drifted:'))
+        for ingredient in drifted[:limit]:
+            self.stdout.write(f'  {ingredient.pk} {ingredient.name}: {ingredient.recipe_count} -> {ingredient.expected_count} recipes')
+        if total > limit:
+            self.stdout.write(f'  ... and {total - limit} more')
+        return total
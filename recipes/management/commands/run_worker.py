@@ -0,0 +1,85 @@
+# recipes/management/commands/run_worker.py
+# Runs the database task queue (recipes/task_queue.py): image derivatives, large difficulty recomputes and
+# any other @task enqueued on a DatabaseBackend. Several workers (commands or machines) may share one queue.
+# SIGINT/SIGTERM let the running tasks finish before the worker exits.
+import multiprocessing
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.tasks import DEFAULT_TASK_BACKEND_ALIAS, task_backends
+from recipes.task_queue import DatabaseBackend, Worker
+from recipes.worker import run_process
+
+# Worker threads own their database connection and close it on exit
+def run_thread(worker):
+    try:
+        worker.run()
+    finally:
+        connection.close()
+
+class Command(BaseCommand):
+    help = 'Run background tasks from the database task queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default=DEFAULT_TASK_BACKEND_ALIAS, help='Alias in settings.TASKS.')
+        parser.add_argument('--queue', action='append', help='Queue to work on (repeatable, default: all queues of the backend).')
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of worker threads (or processes with --processes).')
+        parser.add_argument('--processes', action='store_true', help='Run the workers in separate processes, for CPU-bound tasks.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queues are empty instead of polling.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls of an empty queue.')
+
+    def handle(self, *args, **options):
+        backend = task_backends[options['backend']]
+        if not isinstance(backend, DatabaseBackend):
+            raise CommandError(f'Task backend {options["backend"]!r} is {type(backend).__name__}, not a database queue.')
+        queues = options['queue'] or sorted(backend.queues)
+        concurrency = max(options['concurrency'], 1)
+        started = time.perf_counter()
+
+        stop = threading.Event()
+        previous = {sig: signal.signal(sig, lambda *args: stop.set()) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            if concurrency == 1 and not options['processes']:
+                processed = Worker(backend, queues, stop, options['burst'], options['poll_interval']).run()
+            elif options['processes']:
+                processed = self.run_processes(options['backend'], queues, concurrency, stop, options)
+            else:
+                workers = [Worker(backend, queues, stop, options['burst'], options['poll_interval']) for _ in range(concurrency)]
+                threads = [threading.Thread(target=run_thread, args=(worker,), daemon=True) for worker in workers]
+                for thread in threads:
+                    thread.start()
+                while any(thread.is_alive() for thread in threads):
+                    for thread in threads:
+                        thread.join(timeout=0.5)    # Short joins keep the main thread responsive to signals
+                processed = sum(worker.processed for worker in workers)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+        summary = f'Worker stopped after {time.perf_counter() - started:.1f}s'
+        if processed is not None:
+            summary += f', {processed} tasks run'
+        self.stdout.write(self.style.SUCCESS(summary + '.'))
+
+    # Processes report no count back; the queue table holds the outcome of every task
+    def run_processes(self, alias, queues, concurrency, stop, options):
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=run_process, args=(alias, queues, options['burst'], options['poll_interval']))
+            for _ in range(concurrency)
+        ]
+        for process in processes:
+            process.start()
+        while any(process.is_alive() for process in processes):
+            if stop.is_set():
+                for process in processes:
+                    process.terminate()     # SIGTERM: each process finishes its current task
+            for process in processes:
+                process.join(timeout=0.5)
+        failed = [process.exitcode for process in processes if process.exitcode not in (0, -signal.SIGTERM)]
+        if failed:
+            raise CommandError(f'{len(failed)} worker processes exited with status {failed}.')
+        return None
@@ -0,0 +1,65 @@
+# recipes/management/commands/startup_profile.py
+# Cold-start check for web workers: loads the WSGI application and the URLconf (and with it every view)
+# in a fresh interpreter under `python -X importtime`, then reports the slowest imports and the peak memory
+# of that process. Fails when a module reserved for the Data Lab (pandas, matplotlib) or for the in-process
+# indexes (numpy) is imported at boot.
+import os
+import resource
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+BOOT_SCRIPT = '''
+import importlib
+import django
+django.setup()
+importlib.import_module({wsgi!r})
+importlib.import_module({urlconf!r})
+'''
+
+class Command(BaseCommand):
+    help = 'Profile worker boot with python -X importtime and fail if heavy analytics modules load at startup.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forbid', nargs='+', default=['pandas', 'matplotlib', 'numpy'], help='Top-level packages that must not be imported at boot.')
+        parser.add_argument('--budget-ms', type=float, help='Also fail when the total import time exceeds this many milliseconds.')
+        parser.add_argument('--top', type=int, default=10, help='Number of slowest top-level imports to list.')
+
+    def handle(self, *args, **options):
+        script = BOOT_SCRIPT.format(
+            wsgi=settings.WSGI_APPLICATION.rsplit('.', 1)[0],
+            urlconf=settings.ROOT_URLCONF,
+        )
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            capture_output=True, text=True, env=os.environ.copy(),
+        )
+        if result.returncode:
+            raise CommandError(f'Boot failed:\n{result.stderr[-2000:]}')
+        peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024    # ru_maxrss is in KB on Linux
+
+        # "import time: self [us] | cumulative | imported package", nested imports are indented
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((name.rstrip(), int(cumulative)))
+        top_level = [(name, cumulative) for name, cumulative in imports if not name.startswith('  ')]
+        total_ms = sum(cumulative for _, cumulative in top_level) / 1000
+
+        self.stdout.write(f'Boot imports: {len(imports)} modules, {total_ms:.0f} ms, peak RSS {peak_mb:.0f} MB')
+        for name, cumulative in sorted(top_level, key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'  {cumulative / 1000:8.1f} ms  {name.strip()}')
+
+        loaded = sorted({
+            package for name, _ in imports for package in options['forbid']
+            if name.strip() == package or name.strip().startswith(package + '.')
+        })
+        if loaded:
+            raise CommandError(f'Imported at boot: {", ".join(loaded)}. Defer these imports to the views that need them.')
+        if options['budget_ms'] is not None and total_ms > options['budget_ms']:
+            raise CommandError(f'Boot imports took {total_ms:.0f} ms, over the {options["budget_ms"]:.0f} ms budget.')
+        self.stdout.write(self.style.SUCCESS('Startup profile OK.'))
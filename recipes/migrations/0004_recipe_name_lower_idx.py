@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:20
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredients', '0002_ingredient_image'),
+        ('recipes', '0003_recipe_ingredient_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('id'), name='recipe_name_lower_idx'),
+        ),
+    ]
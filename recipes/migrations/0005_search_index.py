@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:40
+
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from recipes.search import get_search_backend
+    get_search_backend(schema_editor.connection.vendor).install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from recipes.search import get_search_backend
+    get_search_backend(schema_editor.connection.vendor).uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_name_lower_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:09
+
+from django.db import migrations, models
+from recipes.migrations._search_triggers import without_search_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_import_checkpoint'),
+    ]
+
+    operations = without_search_triggers(
+        migrations.AddField(
+            model_name='recipe',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    )
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:40
+
+import django.utils.timezone
+from django.db import migrations, models
+from recipes.migrations._search_triggers import without_search_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_catalog_version'),
+    ]
+
+    operations = without_search_triggers(
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    )
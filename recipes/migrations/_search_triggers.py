@@ -0,0 +1,40 @@
+# recipes/migrations/_search_triggers.py
+# Shared by the migrations that add a column to a table the search index triggers refer to (recipes, links,
+# ingredients). SQLite adds the column by rebuilding the table, which fails while the search triggers refer to it.
+# They are dropped around the change (in both directions); the recipes app's post_migrate handler re-creates them.
+# Frozen with the migrations: the triggers are found in the database catalog rather than through recipes.search,
+# whose trigger list may change later. The leading underscore keeps the migration loader from reading this module.
+from django.db import migrations
+
+SEARCH_TABLES = ('recipes_recipe', 'recipes_recipeingredient', 'ingredients_ingredient')
+
+def drop_search_triggers(connection):
+    placeholders = ', '.join(['%s'] * len(SEARCH_TABLES))
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"SELECT name, tbl_name FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN ({placeholders})",
+                SEARCH_TABLES,
+            )
+            for name, _ in cursor.fetchall():
+                cursor.execute(f'DROP TRIGGER IF EXISTS {quote(name)}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f'SELECT t.tgname, c.relname FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid '
+                f'WHERE NOT t.tgisinternal AND c.relname IN ({placeholders})',
+                SEARCH_TABLES,
+            )
+            for name, table in cursor.fetchall():
+                cursor.execute(f'DROP TRIGGER IF EXISTS {quote(name)} ON {quote(table)}')
+
+def _drop(apps, schema_editor):
+    drop_search_triggers(schema_editor.connection)
+
+# The operations wrapped in a trigger drop before them (forwards) and after them (backwards)
+def without_search_triggers(*operations):
+    return [
+        migrations.RunPython(_drop, migrations.RunPython.noop),
+        *operations,
+        migrations.RunPython(migrations.RunPython.noop, _drop),
+    ]
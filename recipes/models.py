@@ -1,5 +1,18 @@
 # recipes/models.py
-from django.db import models
+import secrets
+import threading
+import uuid
+from contextlib import contextmanager
+from itertools import batched
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Lower
+from django.db.models.lookups import LessThan
+from django.tasks import TaskResultStatus
+from django.utils import timezone
+from .images import enqueue_derivatives
 
 # Recipes models
 
@@ -8,12 +21,150 @@ from django.db import models
 #   - medium:       cooking time < 10 minutes and number of ingredients >= 4
 #   - intermediate: cooking time >= 10 minutes and number of ingredients < 4
 #   - hard:         cooking time >= 10 minutes and number of ingredients >= 4
+QUICK_COOKING_TIME = 10     # Recipes below this many minutes are quick
+FEW_INGREDIENTS = 4         # Recipes below this many ingredients are simple
+
+# Python version of the difficulty rules, used for single objects
+def difficulty_for(cooking_time, num_ingredients):
+    if cooking_time < QUICK_COOKING_TIME:
+        return 'easy' if num_ingredients < FEW_INGREDIENTS else 'medium'
+    return 'intermediate' if num_ingredients < FEW_INGREDIENTS else 'hard'
+
+# SQL version of the same rules, used for set-based updates and drift checks
+def difficulty_expression(cooking_time, num_ingredients):
+    def by_count(few, many):
+        return Case(When(LessThan(num_ingredients, FEW_INGREDIENTS), then=Value(few)), default=Value(many))
+    return Case(
+        When(LessThan(cooking_time, QUICK_COOKING_TIME), then=by_count('easy', 'medium')),
+        default=by_count('intermediate', 'hard'),
+        output_field=models.CharField(),
+    )
+
+# Correlated subquery counting the junction rows of the outer recipe
+def ingredient_count_subquery():
+    link_count = (
+        RecipeIngredient.objects.filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(link_count), 0)
+
+# Ingredients linked to the recipes matching the filter, read before a cascade removes the links
+def linked_ingredient_ids(**filters):
+    return set(RecipeIngredient._base_manager.filter(**filters).values_list('ingredient_id', flat=True).distinct())
+
+# Custom QuerySet for set-based maintenance of the denormalized recipe columns
+class RecipeQuerySet(models.QuerySet):
+    # Recount ingredients and recompute difficulty for every recipe in the queryset.
+    # Each batch is a single UPDATE ... SET = (SELECT COUNT ...), so repairing 100k recipes
+    # takes a handful of statements instead of one round trip per recipe.
+    def recompute_difficulty(self, batch_size=2000):
+        ids = list(self.order_by('pk').values_list('pk', flat=True))
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            count = ingredient_count_subquery()
+            updated += Recipe.objects.filter(pk__in=ids[start:start + batch_size]).update(
+                ingredient_count=count,
+                difficulty=difficulty_expression(F('cooking_time'), count),
+            )
+        return updated
+
+    # Every bulk write path bumps the catalog version, so cached pages never outlive the rows they show.
+    # update() also stamps updated_at, which auto_now leaves alone outside save().
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        CatalogVersion.bump('recipes')
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        CatalogVersion.bump('recipes')
+        return objs
+
+    def delete(self):
+        # The cascade removes the links without RecipeIngredient.delete(), so the ingredients are recounted here
+        ingredient_ids = linked_ingredient_ids(recipe__in=self)
+        result = super().delete()
+        Recipe.objects.mark_ingredients_dirty(ingredient_ids)
+        CatalogVersion.bump('recipes')
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    # Recipes whose stored ingredient_count or difficulty disagree with the junction table
+    def with_drift(self):
+        count = ingredient_count_subquery()
+        return self.annotate(
+            expected_count=count,
+            expected_difficulty=difficulty_expression(F('cooking_time'), count),
+        ).exclude(ingredient_count=F('expected_count'), difficulty=F('expected_difficulty'))
+
+# Per-thread sets of recipe ids whose difficulty, and of CatalogVersion names whose bump, are waiting for
+# the end of a deferred_difficulty() block
+_deferred = threading.local()
+
+# Manager adding the write-coalescing helpers on top of RecipeQuerySet
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    # Recompute the given recipes now, or once on exit of the enclosing deferred_difficulty() block.
+    # Request-path callers pass background=True: above DIFFICULTY_INLINE_LIMIT recipes the recompute
+    # is handed to the task queue (run_worker) and the stored values catch up a moment later.
+    def mark_dirty(self, recipe_ids, background=False):
+        dirty = getattr(_deferred, 'recipe_ids', None)
+        if dirty is not None:
+            dirty.update(recipe_ids)
+        elif background and len(recipe_ids) > settings.DIFFICULTY_INLINE_LIMIT:
+            from .tasks import recompute_difficulty
+            for chunk in batched(sorted(recipe_ids), 2000):
+                recompute_difficulty.enqueue(list(chunk))
+        elif recipe_ids:
+            self.filter(pk__in=recipe_ids).recompute_difficulty()
+
+    # Same for the recipe_count of ingredients whose links changed
+    def mark_ingredients_dirty(self, ingredient_ids):
+        dirty = getattr(_deferred, 'ingredient_ids', None)
+        if dirty is not None:
+            dirty.update(ingredient_ids)
+        elif ingredient_ids:
+            Ingredient = self.model._meta.get_field('ingredients').related_model
+            Ingredient.objects.filter(pk__in=ingredient_ids).recompute_recipe_count()
+
+    # Collect the recipes touched by junction writes and recompute each of them once on exit.
+    # Nested blocks join the outermost one. Wrap the block in transaction.atomic() so that an
+    # error rolls the links back together with the skipped recompute.
+    @contextmanager
+    def deferred_difficulty(self):
+        if getattr(_deferred, 'recipe_ids', None) is not None:
+            yield
+            return
+        _deferred.recipe_ids = set()
+        _deferred.ingredient_ids = set()
+        _deferred.versions = set()
+        try:
+            yield
+            dirty, dirty_ingredients, versions = _deferred.recipe_ids, _deferred.ingredient_ids, _deferred.versions
+        finally:
+            _deferred.recipe_ids = _deferred.ingredient_ids = _deferred.versions = None
+        self.mark_dirty(dirty)
+        self.mark_ingredients_dirty(dirty_ingredients)
+        CatalogVersion.bump(*versions)
 
 class Recipe(models.Model):
     name = models.CharField(max_length=128, unique=True, null=False, blank=False)
     cooking_time = models.PositiveIntegerField(help_text='in minutes')
     difficulty = models.CharField(max_length=20, editable=False)
     image = models.ImageField(upload_to='recipes/', null=True, blank=True, default='no_image.png')
+    # Widths of the resized WebP/JPEG copies of `image` (see recipes/images.py), maintained by save()
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    # Denormalized number of linked ingredients, kept in sync by the RecipeIngredient write paths
+    ingredient_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    # Last change of anything a recipe card shows; part of the card's fragment cache key (recipes/fragments.py)
+    updated_at = models.DateTimeField(auto_now=True)
 
     # Link to the ingredients app's model using a string reference.
     # No import of the Ingredient model helps to avoid circular import issues.
@@ -23,48 +174,265 @@ class Recipe(models.Model):
         related_name='recipes'
     )
 
-    # Method to calculate the difficulty level based on cooking time and number of ingredients
-    def calculate_difficulty(self):
-        num_ingredients = self.ingredients.count()  # Count ingredients linked via the junction table
-        if self.cooking_time < 10:                  # Cooking time less than 10 minutes
-            self.difficulty = 'easy' if num_ingredients < 4 else 'medium'
-        else:                                       # Cooking time 10 minutes or more
-            self.difficulty = 'intermediate' if num_ingredients < 4 else 'hard'
-        self.save(update_fields=['difficulty'])     # Save only the updated difficulty field to prevent recursion
-    
+    objects = RecipeManager()
+
+    class Meta:
+        indexes = [
+            # Serves the case-insensitive name prefix filter and keyset pagination of the recipe list
+            models.Index(Lower('name'), F('id'), name='recipe_name_lower_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        # If the recipe already exists in DB, we can update difficulty based on cooking_time
         update_fields = kwargs.get('update_fields', None)   # Grab 'update_fields' from the arguments if it exists
 
-        # Only calculate difficulty if:
-        #    - The object already exists (self.pk)
-        #    - AND we aren't ALREADY just updating the difficulty (to prevent loop)
-        if self.pk and (update_fields is None or 'difficulty' not in update_fields):
-            self.calculate_difficulty()
+        if self._state.adding:
+            # A new recipe has no links yet, so its difficulty only depends on the counter's current value
+            self.difficulty = difficulty_for(self.cooking_time, self.ingredient_count)
+        elif update_fields is None or ('cooking_time' in update_fields and 'difficulty' not in update_fields):
+            # ingredient_count is owned by the junction write paths, so a full save of an existing row
+            # must not overwrite it with a value that may be stale on this instance
+            update_fields = {
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'ingredient_count'
+            } if update_fields is None else {*update_fields, 'difficulty'}
+            kwargs['update_fields'] = update_fields
+            # Difficulty is computed from the stored counter inside the same UPDATE and read back with RETURNING,
+            # so an edit costs one statement and a stale instance cannot write a wrong value
+            self.difficulty = difficulty_expression(Value(self.cooking_time), F('ingredient_count'))
 
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}    # auto_now only writes listed fields
         super().save(*args, **kwargs)
+        CatalogVersion.bump('recipes')
+        if update_fields is None or 'image' in update_fields:
+            enqueue_derivatives(self)           # Resized by run_worker, outside the request
+
+    def delete(self, *args, **kwargs):
+        ingredient_ids = linked_ingredient_ids(recipe=self)
+        result = super().delete(*args, **kwargs)
+        Recipe.objects.mark_ingredients_dirty(ingredient_ids)
+        CatalogVersion.bump('recipes')
+        return result
+
+    # Replace the recipe's ingredients with the given names in a fixed number of queries:
+    # one IN lookup, bulk inserts for new ingredients and links, one delete for dropped links
+    # and a single UPDATE for ingredient_count and difficulty, however many names are passed.
+    def set_ingredients(self, names):
+        Ingredient = self._meta.get_field('ingredients').related_model
+        wanted = list(dict.fromkeys(filter(None, map(Ingredient.normalize_name, names))))  # Normalized, deduplicated, ordered
+
+        with transaction.atomic():
+            ids_by_name = dict(Ingredient.objects.filter(name__in=wanted).values_list('name', 'pk'))
+            missing = [name for name in wanted if name not in ids_by_name]
+            if missing:
+                # ignore_conflicts tolerates a concurrent insert of the same name; the ids are read back afterwards
+                Ingredient.objects.bulk_create([Ingredient(name=name) for name in missing], ignore_conflicts=True)
+                ids_by_name.update(Ingredient.objects.filter(name__in=missing).values_list('name', 'pk'))
+            wanted_ids = {ids_by_name[name] for name in wanted}
+
+            # The base manager skips the per-call recompute of RecipeIngredientQuerySet; this method writes the counters once below
+            links = RecipeIngredient._base_manager.filter(recipe=self)
+            current_ids = set(links.values_list('ingredient_id', flat=True))
+            if wanted_ids - current_ids:
+                RecipeIngredient._base_manager.bulk_create(
+                    [RecipeIngredient(recipe=self, ingredient_id=pk) for pk in wanted_ids - current_ids],
+                    ignore_conflicts=True,
+                )
+            if current_ids - wanted_ids:
+                links.filter(ingredient_id__in=current_ids - wanted_ids).delete()
+            Ingredient.objects.shift_recipe_count(
+                {pk: +1 for pk in wanted_ids - current_ids} | {pk: -1 for pk in current_ids - wanted_ids}
+            )
+
+            self.ingredient_count = len(wanted_ids)
+            self.difficulty = difficulty_for(self.cooking_time, self.ingredient_count)
+            Recipe.objects.filter(pk=self.pk).update(ingredient_count=self.ingredient_count, difficulty=self.difficulty)
 
     # String representation
     def __str__(self):
         return f"Recipe ID: {self.id} | Name: {self.name} | Difficulty: {self.difficulty}"
     
+# Custom QuerySet so that bulk writes on the junction table keep ingredient_count and difficulty correct
+class RecipeIngredientQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        Recipe.objects.mark_dirty({obj.recipe_id for obj in objs})
+        Recipe.objects.mark_ingredients_dirty({obj.ingredient_id for obj in objs})
+        CatalogVersion.bump('recipes')
+        return objs
+
+    def delete(self):
+        pairs = list(self.values_list('recipe_id', 'ingredient_id'))    # Collect the affected rows before they are gone
+        result = super().delete()
+        Recipe.objects.mark_dirty({recipe_id for recipe_id, _ in pairs})
+        Recipe.objects.mark_ingredients_dirty({ingredient_id for _, ingredient_id in pairs})
+        CatalogVersion.bump('recipes')
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
 class RecipeIngredient(models.Model):
     # Naming the fields 'recipe' and 'ingredient' lets Django handle the SQL column names correctly as recipe_id.    
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='recipe_junction')
     ingredient = models.ForeignKey('ingredients.Ingredient', on_delete=models.CASCADE, related_name='ingredient_junction')
 
+    objects = RecipeIngredientQuerySet.as_manager()
+
     class Meta:
         unique_together = ('recipe', 'ingredient')  # Ensure that the same ingredient is not added multiple times to the same recipe.
 
     def save(self, *args, **kwargs):
+        # The stored pair, read before the UPDATE: a link moved to another recipe or ingredient changes the
+        # counters on both sides. None for a new link (or a pk that has no row yet), which adds one ingredient
+        stored = None if self._state.adding else (
+            RecipeIngredient._base_manager.filter(pk=self.pk).values_list('recipe_id', 'ingredient_id').first()
+        )
         super().save(*args, **kwargs)           # Save the recipe-ingredient link first
-        self.recipe.calculate_difficulty()      # Tells the linked recipe to update its difficulty
+        if stored is None:
+            self._shift_ingredient_count(+1)
+        elif stored != (self.recipe_id, self.ingredient_id):
+            Recipe.objects.mark_dirty({stored[0], self.recipe_id})
+            Recipe.objects.mark_ingredients_dirty({stored[1], self.ingredient_id})
 
     def delete(self, *args, **kwargs):
-        temp_recipe = self.recipe               # Save reference to a recipebefore deleting the link
-        super().delete(*args, **kwargs)         # Delete the recipe-ingredient link
-        temp_recipe.calculate_difficulty()      # Tells the linked recipe to update its difficulty after deletion
+        result = super().delete(*args, **kwargs)    # Delete the recipe-ingredient link
+        self._shift_ingredient_count(-1)
+        return result
+
+    # Tells the linked recipe to update its counter and difficulty with a single UPDATE ... RETURNING,
+    # or just records it when inside Recipe.objects.deferred_difficulty()
+    def _shift_ingredient_count(self, delta):
+        if getattr(_deferred, 'recipe_ids', None) is not None:
+            Recipe.objects.mark_dirty({self.recipe_id})
+            Recipe.objects.mark_ingredients_dirty({self.ingredient_id})
+            return
+        Ingredient = self._meta.get_field('ingredient').related_model
+        Ingredient.objects.filter(pk=self.ingredient_id).update(recipe_count=F('recipe_count') + delta)
+        count = F('ingredient_count') + delta
+        self.recipe.ingredient_count = count
+        self.recipe.difficulty = difficulty_expression(F('cooking_time'), count)
+        self.recipe.save(update_fields=['ingredient_count', 'difficulty'])
 
     # String representation
     def __str__(self):
-        return f"Recipe: {self.recipe.name} | Ingredient: {self.ingredient.name}"
\ No newline at end of file
+        return f"Recipe: {self.recipe.name} | Ingredient: {self.ingredient.name}"
+
+# Read-only view of the SQLite FTS5 index (recipes/search.py), which install() creates and the triggers maintain.
+# Only there so the ranked search can join the index through the ORM; Django never creates or writes the table.
+class RecipeSearchEntry(models.Model):
+    recipe = models.OneToOneField(
+        Recipe, primary_key=True, db_column='rowid', db_constraint=False,
+        on_delete=models.DO_NOTHING, related_name='search_entry',
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_fts'
+
+# Version tokens of the catalog, read by the page cache (recipes/page_cache.py) to build its keys and the
+# pages' ETag and Last-Modified headers.
+# 'recipes' changes with any write to recipes or their ingredient links, 'ingredients' with any write to
+# ingredients. The bump is an UPDATE inside the writer's transaction, so other connections see the new token
+# exactly when they see the new data and a page is never cached under a token newer than its content.
+# Tokens are random rather than incremented so that a rolled-back bump is never reused for other content.
+class CatalogVersion(models.Model):
+    name = models.CharField(max_length=32, primary_key=True)
+    version = models.BigIntegerField()
+    bumps = models.PositiveBigIntegerField(default=0)           # Invalidations so far, for the cache stats
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def new_token():
+        return secrets.randbits(62)
+
+    @classmethod
+    def bump(cls, *names):
+        pending = getattr(_deferred, 'versions', None)
+        if pending is not None:
+            pending.update(names)               # Once on exit of the enclosing deferred_difficulty() block
+            return
+        for name in names:
+            updated = cls.objects.filter(name=name).update(
+                version=cls.new_token(), bumps=F('bumps') + 1, updated_at=timezone.now(),
+            )
+            if not updated:
+                cls.objects.get_or_create(name=name, defaults={'version': cls.new_token(), 'bumps': 1})
+        if 'recipes' in names:
+            from .similarity import schedule_refresh
+            transaction.on_commit(schedule_refresh)     # Link changes reach the similar-recipes index from the worker
+
+    # {name: (token, updated_at)} in one primary key lookup; missing rows are created on first use
+    @classmethod
+    def current(cls, *names):
+        fields = ('name', 'version', 'updated_at')
+        versions = {name: rest for name, *rest in cls.objects.filter(name__in=names).values_list(*fields)}
+        missing = [name for name in names if name not in versions]
+        if missing:
+            cls.objects.bulk_create([cls(name=name, version=cls.new_token()) for name in missing], ignore_conflicts=True)
+            versions.update({name: rest for name, *rest in cls.objects.filter(name__in=missing).values_list(*fields)})
+        return {name: tuple(versions[name]) for name in names}
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+# MinHash signature of a recipe's ingredient set and the LSH band buckets derived from it (recipes/similarity.py).
+# computed_at is the time the links were read; a recipe whose updated_at is later has a stale signature.
+class RecipeSignature(models.Model):
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='signature')
+    minhash = models.BinaryField()              # NUM_PERM little-endian uint32 minimums, empty for a recipe without ingredients
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Signature of recipe {self.recipe_id}"
+
+# Recipes sharing a (band, bucket) pair are candidate neighbours
+class RecipeBand(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='bands')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()           # Hash of the band's rows of the signature
+
+    class Meta:
+        indexes = [models.Index(fields=['band', 'bucket'], name='recipe_band_bucket_idx')]
+
+    def __str__(self):
+        return f"Recipe {self.recipe_id} band {self.band}: {self.bucket}"
+
+# Progress of a resumable import from an external source, e.g. a legacy database table.
+# Saved in the same transaction as each imported batch, so last_id never runs ahead of the data.
+class ImportCheckpoint(models.Model):
+    source = models.CharField(max_length=255, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} (last id {self.last_id})"
+
+# One job of the database task queue (see recipes/task_queue.py). Rows are claimed by `manage.py run_worker`;
+# status follows django.tasks: READY -> RUNNING -> SUCCESSFUL or FAILED, or back to READY for a retry.
+class QueuedTask(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    task_path = models.CharField(max_length=255)                # Dotted path of the @task function
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    backend = models.CharField(max_length=64)
+    queue_name = models.CharField(max_length=64)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=TaskResultStatus.choices, default=TaskResultStatus.READY)
+    run_after = models.DateTimeField(default=timezone.now)      # Not claimed before this; retries push it back
+    enqueued_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True)
+    last_attempted_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    worker_ids = models.JSONField(default=list)                 # One entry per attempt
+    errors = models.JSONField(default=list)                     # {'exception_class_path', 'traceback'} per failed attempt
+    return_value = models.JSONField(null=True)
+
+    class Meta:
+        indexes = [
+            # Serves the claim query: next ready row of a queue by priority, then age
+            models.Index(fields=['status', 'queue_name', '-priority', 'run_after'], name='queued_task_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task_path} [{self.status}]"
@@ -0,0 +1,138 @@
+# recipes/page_cache.py
+# Whole-response cache for the read-heavy catalog pages (recipe list and cards, recipe detail, ingredient index).
+# A page is stored under its view, its query string and the current CatalogVersion tokens it depends on, so any
+# write to the catalog (model save/delete, queryset update/delete, bulk_create, imports) makes the old entries
+# unreachable without deleting them; they age out of the cache on their own.
+#
+# The pages sit behind the login, so the only user-specific markup, the navbar's "Hello, <name>" block, is left
+# as a marker in the cached copy and rendered for the current user on every request (hit or miss). Responses
+# that set cookies, touch the session or use a CSRF token are never stored.
+#
+# The same versions give the pages an ETag (plus the user's id, for the navbar) and a Last-Modified date, so
+# a browser revalidating a page it already has gets a 304 after one primary key lookup of CatalogVersion,
+# without the page's own queries or any rendering.
+from hashlib import blake2b
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag, urlencode
+
+from .models import CatalogVersion
+
+USER_NAV_MARKER = b'<!--user-nav-->'
+STATS_KEY = 'page-stats:{}'
+EVENTS = ('hits', 'misses', 'bypassed', 'not_modified')
+
+def digest(*parts):
+    return blake2b('\n'.join(parts).encode(), digest_size=16).hexdigest()
+
+def page_cache():
+    return caches[settings.PAGE_CACHE_ALIAS]
+
+# Counters shared by every process that uses the same cache backend
+def record(event):
+    cache = page_cache()
+    try:
+        cache.incr(STATS_KEY.format(event))
+    except ValueError:                          # First event since the cache was (re)started
+        if not cache.add(STATS_KEY.format(event), 1, timeout=None):
+            cache.incr(STATS_KEY.format(event))
+
+def stats():
+    counts = page_cache().get_many([STATS_KEY.format(event) for event in EVENTS])
+    counts = {event: counts.get(STATS_KEY.format(event), 0) for event in EVENTS}
+    lookups = counts['hits'] + counts['misses']
+    return {
+        **counts,
+        'hit_ratio': round(counts['hits'] / lookups, 4) if lookups else None,
+        'invalidations': dict(CatalogVersion.objects.order_by('name').values_list('name', 'bumps')),
+    }
+
+def reset_stats():
+    page_cache().delete_many([STATS_KEY.format(event) for event in EVENTS])
+
+# Mix in after LoginRequiredMixin so anonymous visitors are redirected before the cache is consulted
+class CachedPageMixin:
+    cache_versions = ('recipes',)               # CatalogVersion names whose writes change this page
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        versions = self.catalog_versions = CatalogVersion.current(*self.cache_versions)   # Also read by the view
+        parts = self.page_parts(request, versions)
+
+        # Conditional GET: a browser that already has this version of the page gets a 304 before any
+        # catalog query or template rendering runs
+        etag = quote_etag(digest(*parts, f'user={request.user.pk}'))   # The page greets the user by name
+        last_modified = max(updated_at for _, updated_at in versions.values())
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is not None:
+            record('not_modified')
+            return self.validators(response, etag, last_modified)
+
+        cache = page_cache() if settings.PAGE_CACHE_TIMEOUT else None
+        key = 'page:' + digest(*parts)
+        cached = cache and cache.get(key)
+        if cached is not None:
+            record('hits')
+            content, content_type = cached
+            response = self.finalize(HttpResponse(content, content_type=content_type), 'HIT')
+            return self.validators(response, etag, last_modified)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        if response.status_code != 200 or response.streaming:
+            return response
+        cacheable = self.is_cacheable(request, response)
+        if cache is not None:
+            record('misses' if cacheable else 'bypassed')
+            if cacheable:
+                cache.set(key, (response.content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+        response = self.finalize(response, 'MISS' if cacheable and cache is not None else 'BYPASS')
+        return self.validators(response, etag, last_modified) if cacheable else response
+
+    def get_context_data(self, **kwargs):
+        return super().get_context_data(user_nav_placeholder=True, **kwargs)
+
+    # What identifies a version of the page for every user: view, URL and the catalog versions it shows
+    def page_parts(self, request, versions):
+        return [
+            f'{type(self).__module__}.{type(self).__qualname__}',
+            request.path,
+            urlencode(sorted(request.GET.lists()), doseq=True),
+            *(f'{name}={versions[name][0]}' for name in self.cache_versions),
+        ]
+
+    def is_cacheable(self, request, response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            and not request.META.get('CSRF_COOKIE_USED')        # A token in the page would be served to other users
+            and not getattr(getattr(request, 'session', None), 'modified', False)
+        )
+
+    # Puts the current user's navbar into the page and keeps shared caches from storing it
+    def finalize(self, response, outcome):
+        nav = render_to_string('user_nav.html', request=self.request).strip().encode()
+        response.content = response.content.replace(USER_NAV_MARKER, nav, 1)
+        response['X-Cache'] = outcome
+        return response
+
+    # no-cache: the browser keeps the page but asks every time, which costs a 304 while nothing changed
+    def validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+# Hit ratio of the page cache and the number of invalidations per catalog version: /recipes/cache/stats/
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(stats())
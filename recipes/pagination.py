@@ -0,0 +1,76 @@
+# recipes/pagination.py
+# Keyset (cursor) pagination helpers. Instead of OFFSET, each page continues after the sort key
+# of the last row shown, so every page is a single index range scan no matter how deep it is.
+import base64
+import binascii
+import json
+import sys
+
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+# Upper bound of a prefix range: 'pas' -> 'pat', so that prefix <= value < bound matches 'pas%'.
+# Range filters can use a plain B-tree index on every backend, unlike LIKE with an ESCAPE clause.
+# None when the last character is already the highest code point and has no successor.
+def prefix_upper_bound(prefix):
+    if prefix[-1] == chr(sys.maxunicode):
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+# Case-insensitive prefix filter backed by the Lower(name) index. The range only selects the index slice:
+# under a linguistic collation (PostgreSQL) it can hold names without the prefix, so startswith decides.
+def filter_name_prefix(queryset, prefix, field='name'):
+    prefix = prefix.strip().lower()
+    if not prefix:
+        return queryset
+    queryset = queryset.alias(name_lower=Lower(field)).filter(name_lower__startswith=prefix)
+    bound = prefix_upper_bound(prefix)
+    if bound is None:
+        return queryset
+    return queryset.filter(name_lower__gte=prefix, name_lower__lt=bound)
+
+# Cursors are opaque to clients: URL-safe base64 of the JSON sort key
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+# Shape of the sort key per sort: [pk] by id, [lowercased name, pk] by name
+CURSOR_TYPES = {'id': (int,), 'name': (str, int)}
+
+# The decoded sort key, or None for a damaged or tampered cursor, which simply restarts from the first page
+def decode_cursor(cursor, sort='name'):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    types = CURSOR_TYPES['id' if sort == 'id' else 'name']
+    if not isinstance(key, list) or len(key) != len(types):
+        return None
+    # bool is a subclass of int, but true/false are never a pk
+    if any(isinstance(value, bool) or not isinstance(value, kind) for value, kind in zip(key, types)):
+        return None
+    return key
+
+# Returns (rows, next_cursor) for one page sorted by case-insensitive name or by id.
+# Ties on the lowercased name are broken by pk so the key is unique.
+def keyset_page(queryset, sort='name', cursor=None, size=24, field='name'):
+    after = decode_cursor(cursor, sort) if cursor else None
+
+    if sort == 'id':
+        queryset = queryset.order_by('pk')
+        if after:
+            queryset = queryset.filter(pk__gt=after[0])
+    else:
+        # The lowercased name is selected, not recomputed in Python, so the cursor matches the database's LOWER()
+        queryset = queryset.annotate(sort_name=Lower(field)).order_by('sort_name', 'pk')
+        if after:
+            queryset = queryset.filter(
+                Q(sort_name__gt=after[0]) | Q(sort_name=after[0], pk__gt=after[1])
+            )
+
+    rows = list(queryset[:size + 1])            # One extra row tells whether another page exists
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    key = [last.pk] if sort == 'id' else [last.sort_name, last.pk]
+    return rows, encode_cursor(key)
@@ -0,0 +1,137 @@
+# recipes/pantry.py
+# "What can I cook": recipes ranked by how many of their ingredients are in a pantry (a set of ingredient ids).
+# Answered from an in-process inverted index, ingredient id -> sorted array of recipe positions, built from
+# RecipeIngredient with numpy:
+#   coverage      one bincount over the pantry's postings gives, per recipe, the number of pantry ingredients
+#                 it uses; with the stored number of links per recipe that is also the number still missing
+#   contains all  intersection of the postings, smallest first
+#   missing <= k  coverage filtered on the missing count
+# Results are ordered by fewest missing ingredients, then most pantry ingredients used, then recipe id.
+#
+# The index follows the 'recipes' CatalogVersion token (recipes/snapshots.py), which every link write bumps.
+# Link writes also move the recipe's updated_at, so a refresh re-reads only the links of the recipes changed
+# since the last one; a deleted recipe triggers a full rebuild. Without an index (first request, a concurrent
+# refresh, more than PANTRY_INDEX_MAX_RECIPES recipes) the same query runs as a GROUP BY on the junction table.
+from functools import reduce
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Recipe, RecipeIngredient
+from .snapshots import Snapshot, SnapshotHolder
+
+MODES = ('rank', 'all', 'missing')
+
+def id_array(values):
+    return np.fromiter(values, dtype=np.int64)
+
+class PantryIndex(Snapshot):
+    def __init__(self, recipe_ids, link_recipes, link_ingredients, token, since, usable=True, built=None):
+        super().__init__(token, since, usable, built)
+        self.recipe_ids = recipe_ids            # Sorted; a recipe's position in it is what the postings store
+        self.link_recipes = link_recipes        # One entry per link, kept for incremental refreshes
+        self.link_ingredients = link_ingredients
+        positions = np.searchsorted(recipe_ids, link_recipes)
+        self.sizes = np.bincount(positions, minlength=len(recipe_ids))    # Ingredients per recipe
+        order = np.lexsort((positions, link_ingredients))                 # By ingredient, then recipe
+        keys, starts = np.unique(link_ingredients[order], return_index=True)
+        self.postings = dict(zip(keys.tolist(), np.split(positions[order], starts[1:])))
+
+    @classmethod
+    def build(cls, token):
+        since = timezone.now()
+        empty = id_array(())
+        if Recipe.objects.count() > settings.PANTRY_INDEX_MAX_RECIPES:
+            return cls(empty, empty, empty, token, since, usable=False)
+        recipe_ids = id_array(Recipe.objects.order_by('pk').values_list('pk', flat=True))
+        links = RecipeIngredient._base_manager.values_list('recipe_id', 'ingredient_id')
+        return cls.from_links(recipe_ids, links, empty, empty, token, since)
+
+    # Adds the (recipe id, ingredient id) pairs to the kept links, dropping those of recipes read concurrently
+    @classmethod
+    def from_links(cls, recipe_ids, links, link_recipes, link_ingredients, token, since, built=None):
+        pairs = np.array(list(links), dtype=np.int64).reshape(-1, 2)
+        known = np.isin(pairs[:, 0], recipe_ids)                # A recipe created between the two reads comes next time
+        link_recipes = np.concatenate([link_recipes, pairs[known, 0]])
+        link_ingredients = np.concatenate([link_ingredients, pairs[known, 1]])
+        return cls(recipe_ids, link_recipes, link_ingredients, token, since, built=built)
+
+    # A new index with the links of the recipes changed since this one, or None after a delete
+    def refreshed(self, token):
+        since = timezone.now()
+        window = self.changed_since()
+        changed = id_array(Recipe.objects.filter(updated_at__gte=window).values_list('pk', flat=True))
+        recipe_ids = np.union1d(self.recipe_ids, changed)
+        if len(recipe_ids) != Recipe.objects.count() or len(recipe_ids) > settings.PANTRY_INDEX_MAX_RECIPES:
+            return None
+        kept = ~np.isin(self.link_recipes, changed)
+        links = RecipeIngredient._base_manager.filter(recipe__updated_at__gte=window).values_list('recipe_id', 'ingredient_id')
+        return self.from_links(
+            recipe_ids, links, self.link_recipes[kept], self.link_ingredients[kept], token, since, built=self.built,
+        )
+
+    # Positions of the recipes using every one of the ingredients
+    def containing_all(self, ingredient_ids):
+        postings = [self.postings.get(pk) for pk in ingredient_ids]
+        if not postings or any(posting is None for posting in postings):
+            return id_array(())
+        postings.sort(key=len)                  # The smallest posting bounds the result
+        return reduce(lambda found, posting: np.intersect1d(found, posting, assume_unique=True), postings)
+
+    # Number of the ingredients used by each recipe, by position
+    def coverage(self, ingredient_ids):
+        postings = [self.postings[pk] for pk in ingredient_ids if pk in self.postings]
+        if not postings:
+            return np.zeros(len(self.recipe_ids), dtype=np.int64)
+        return np.bincount(np.concatenate(postings), minlength=len(self.recipe_ids))
+
+    def query(self, ingredient_ids, mode='rank', max_missing=0, limit=24):
+        ingredient_ids = set(ingredient_ids)
+        have = self.coverage(ingredient_ids)
+        missing = self.sizes - have
+        if mode == 'all':
+            matches = self.containing_all(ingredient_ids)
+        elif mode == 'missing':
+            matches = np.flatnonzero((have > 0) & (missing <= max_missing))
+        else:
+            matches = np.flatnonzero(have)
+        best = matches[np.lexsort((matches, -have[matches], missing[matches]))[:limit]]
+        return {
+            'total': len(matches),
+            'results': [
+                {'id': int(self.recipe_ids[i]), 'have': int(have[i]), 'missing': int(missing[i])} for i in best
+            ],
+        }
+
+_holder = SnapshotHolder(PantryIndex, 'recipes', 'PANTRY_REFRESH_INTERVAL')
+
+get_index = _holder.get
+reset_index = _holder.reset
+
+# The same query over the junction table, ranked on the stored ingredient_count
+def search_database(ingredient_ids, mode='rank', max_missing=0, limit=24):
+    ingredient_ids = set(ingredient_ids)
+    recipes = (
+        Recipe.objects.annotate(have=Count('recipe_junction', filter=Q(recipe_junction__ingredient__in=ingredient_ids)))
+        .filter(have__gt=0)
+        .annotate(missing=F('ingredient_count') - F('have'))
+    )
+    if mode == 'all':
+        recipes = recipes.filter(have=len(ingredient_ids))
+    elif mode == 'missing':
+        recipes = recipes.filter(missing__lte=max_missing)
+    rows = recipes.order_by('missing', '-have', 'pk').values_list('pk', 'have', 'missing')
+    return {
+        'total': recipes.count(),
+        'results': [{'id': pk, 'have': have, 'missing': missing} for pk, have, missing in rows[:limit]],
+    }
+
+def what_can_i_cook(ingredient_ids, mode='rank', max_missing=0, limit=24):
+    if not ingredient_ids:
+        return {'total': 0, 'results': []}
+    index = get_index()
+    if index is None or not index.usable:
+        return search_database(ingredient_ids, mode, max_missing, limit)
+    return index.query(ingredient_ids, mode, max_missing, limit)
@@ -0,0 +1,287 @@
+# recipes/search.py
+# Pluggable search backends for the Data Lab. The index covers the recipe name, the names of its
+# ingredients and its difficulty and is kept in sync by database triggers, so every write path (save(),
+# bulk_create, queryset deletes, raw SQL) updates it without extra queries from the application.
+#   - PostgreSQL: a tsvector column with a GIN index plus a pg_trgm index on the lowercased name
+#   - SQLite:     an FTS5 table keyed by recipe id, ranked with bm25()
+#   - Others:     the original icontains search, without the join + DISTINCT
+import re
+from contextlib import contextmanager
+from functools import cache
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import BooleanField, F, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+RECIPE_TABLE = 'recipes_recipe'
+LINK_TABLE = 'recipes_recipeingredient'
+INGREDIENT_TABLE = 'ingredients_ingredient'
+
+# Words of the search term; the same tokens feed the prefix queries of both full-text backends
+def tokenize(term):
+    return re.findall(r'\w+', term.lower())
+
+class BasicSearchBackend:
+    # Substring search over name, ingredient names and difficulty, unranked
+    def search(self, queryset, term):
+        from .models import RecipeIngredient
+        term = term.strip()
+        return queryset.filter(
+            Q(name__icontains=term)
+            | Q(difficulty__icontains=term)
+            | Q(pk__in=RecipeIngredient.objects.filter(ingredient__name__icontains=term).values('recipe'))
+        )
+
+    # Creates the index and the triggers that keep it in sync; must be idempotent
+    def install(self, conn):
+        pass
+
+    # Stops index maintenance, e.g. for a bulk load that rebuilds the index once at the end
+    def drop_triggers(self, conn):
+        pass
+
+    def uninstall(self, conn):
+        pass
+
+    # Recomputes the index of every recipe in one statement
+    def rebuild(self, conn):
+        pass
+
+class SqliteSearchBackend(BasicSearchBackend):
+    fts_table = 'recipes_recipe_fts'
+    triggers = [
+        f'{RECIPE_TABLE}_fts_insert', f'{RECIPE_TABLE}_fts_update', f'{RECIPE_TABLE}_fts_delete',
+        f'{LINK_TABLE}_fts_insert', f'{LINK_TABLE}_fts_delete', f'{LINK_TABLE}_fts_update',
+        f'{INGREDIENT_TABLE}_fts_rename',
+    ]
+
+    # Ranked word-prefix search: every word of the term must start a word of the name, an ingredient or the difficulty
+    def search(self, queryset, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return super().search(queryset, term)
+        fts = self.fts_table
+        # bm25() only works inside a MATCH query, so the index is joined once (through RecipeSearchEntry) instead
+        # of probed per row (a correlated subquery per row made broad terms quadratic). Lower is better; name hits weigh 10x.
+        return queryset.filter(search_entry__isnull=False).filter(
+            RawSQL(f'"{fts}" MATCH %s', (' '.join(f'"{token}"*' for token in tokens),), output_field=BooleanField())
+        ).annotate(
+            rank=RawSQL(f'bm25("{fts}", 10.0, 1.0, 1.0)', (), output_field=FloatField())
+        ).order_by('rank', 'pk')
+
+    # Statements that rewrite the index rows of the recipes `r` matching `condition`, used by the triggers below
+    def _reindex(self, condition):
+        return f'''
+            DELETE FROM {self.fts_table} WHERE rowid IN (SELECT r.id FROM {RECIPE_TABLE} r WHERE {condition});
+            INSERT INTO {self.fts_table} (rowid, name, ingredients, difficulty)
+            SELECT r.id, r.name, COALESCE((
+                SELECT GROUP_CONCAT(i.name, ' ') FROM {LINK_TABLE} ri
+                JOIN {INGREDIENT_TABLE} i ON i.id = ri.ingredient_id WHERE ri.recipe_id = r.id
+            ), ''), COALESCE(r.difficulty, '')
+            FROM {RECIPE_TABLE} r WHERE {condition};'''
+
+    # Idempotent: creates the FTS5 table and the triggers that keep it in sync.
+    # Also run after every migrate, because SQLite drops triggers when a migration rebuilds a table.
+    def install(self, conn):
+        fts = self.fts_table
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT 1 FROM sqlite_master WHERE name = '{fts}'")
+            created = cursor.fetchone() is None
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} "
+                f"USING fts5(name, ingredients, difficulty, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            bodies = [
+                f'AFTER INSERT ON {RECIPE_TABLE} BEGIN {self._reindex("r.id = NEW.id")} END',
+                # Guarded so that recompute_difficulty() rewriting unchanged values does not reindex every row
+                f'''AFTER UPDATE OF name, difficulty ON {RECIPE_TABLE}
+                    WHEN OLD.name IS NOT NEW.name OR OLD.difficulty IS NOT NEW.difficulty
+                    BEGIN {self._reindex("r.id = NEW.id")} END''',
+                f'AFTER DELETE ON {RECIPE_TABLE} BEGIN DELETE FROM {fts} WHERE rowid = OLD.id; END',
+                f'AFTER INSERT ON {LINK_TABLE} BEGIN {self._reindex("r.id = NEW.recipe_id")} END',
+                f'AFTER DELETE ON {LINK_TABLE} BEGIN {self._reindex("r.id = OLD.recipe_id")} END',
+                f'AFTER UPDATE ON {LINK_TABLE} BEGIN {self._reindex("r.id IN (OLD.recipe_id, NEW.recipe_id)")} END',
+                f'''AFTER UPDATE OF name ON {INGREDIENT_TABLE} WHEN OLD.name IS NOT NEW.name BEGIN
+                    {self._reindex(f"r.id IN (SELECT recipe_id FROM {LINK_TABLE} WHERE ingredient_id = NEW.id)")}
+                END''',
+            ]
+            for name, body in zip(self.triggers, bodies):
+                cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+        if created:
+            self.rebuild(conn)
+
+    def drop_triggers(self, conn):
+        with conn.cursor() as cursor:
+            for name in self.triggers:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+    def uninstall(self, conn):
+        self.drop_triggers(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.fts_table}')
+
+    def rebuild(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.fts_table}')
+            cursor.execute(f'''
+                INSERT INTO {self.fts_table} (rowid, name, ingredients, difficulty)
+                SELECT r.id, r.name, COALESCE(GROUP_CONCAT(i.name, ' '), ''), COALESCE(r.difficulty, '')
+                FROM {RECIPE_TABLE} r
+                LEFT JOIN {LINK_TABLE} ri ON ri.recipe_id = r.id
+                LEFT JOIN {INGREDIENT_TABLE} i ON i.id = ri.ingredient_id
+                GROUP BY r.id''')
+
+class PostgresSearchBackend(BasicSearchBackend):
+    triggers = [
+        (RECIPE_TABLE, 'recipes_recipe_search_insert'), (RECIPE_TABLE, 'recipes_recipe_search_update'),
+        (LINK_TABLE, 'recipes_link_search_insert'), (LINK_TABLE, 'recipes_link_search_delete'),
+        (LINK_TABLE, 'recipes_link_search_update'),
+        (INGREDIENT_TABLE, 'ingredients_search_rename'),
+    ]
+
+    # Ranked search: word prefixes through the tsvector, plus trigram similarity on the name for typos and substrings
+    def search(self, queryset, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return super().search(queryset, term)
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        needle = term.strip().lower()
+        return queryset.filter(
+            RawSQL(
+                f'''"{RECIPE_TABLE}"."search_vector" @@ to_tsquery('simple', %s) OR lower("{RECIPE_TABLE}"."name") %% %s''',
+                (tsquery, needle),
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            rank=RawSQL(
+                f'''ts_rank("{RECIPE_TABLE}"."search_vector", to_tsquery('simple', %s)) + similarity(lower("{RECIPE_TABLE}"."name"), %s)''',
+                (tsquery, needle),
+            )
+        ).order_by(F('rank').desc(), 'pk')
+
+    # Idempotent: adds the tsvector column, GIN indexes and the triggers that maintain the column
+    def install(self, conn):
+        refresh = f'UPDATE {RECIPE_TABLE} r SET search_vector = recipes_recipe_document(r.id, r.name, r.difficulty)'
+        with conn.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(f'ALTER TABLE {RECIPE_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx ON {RECIPE_TABLE} USING GIN (search_vector)')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS recipe_name_trgm_idx ON {RECIPE_TABLE} USING GIN (lower(name) gin_trgm_ops)')
+            # Weighted document: name (A), ingredient names (B), difficulty (C)
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION recipes_recipe_document(bigint, text, text) RETURNS tsvector AS $$
+                    SELECT setweight(to_tsvector('simple', $2), 'A')
+                        || setweight(to_tsvector('simple', COALESCE((
+                            SELECT string_agg(i.name, ' ') FROM {LINK_TABLE} ri
+                            JOIN {INGREDIENT_TABLE} i ON i.id = ri.ingredient_id WHERE ri.recipe_id = $1
+                        ), '')), 'B')
+                        || setweight(to_tsvector('simple', COALESCE($3, '')), 'C')
+                $$ LANGUAGE sql STABLE''')
+            cursor.execute('''
+                CREATE OR REPLACE FUNCTION recipes_recipe_search_row() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector := recipes_recipe_document(NEW.id, NEW.name, NEW.difficulty);
+                    RETURN NEW;
+                END $$ LANGUAGE plpgsql''')
+            # Statement-level triggers with transition tables: a bulk_create of thousands of links
+            # refreshes each affected recipe once instead of once per link
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION recipes_link_search_refresh() RETURNS trigger AS $$
+                BEGIN
+                    {refresh} WHERE r.id IN (SELECT recipe_id FROM changed_links);
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql''')
+            # A link UPDATE may move it to another recipe or ingredient, so the recipes on both sides are refreshed
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION recipes_link_search_move() RETURNS trigger AS $$
+                BEGIN
+                    {refresh} WHERE r.id IN (SELECT recipe_id FROM old_links UNION SELECT recipe_id FROM new_links);
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql''')
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION ingredients_search_refresh() RETURNS trigger AS $$
+                BEGIN
+                    {refresh} WHERE r.id IN (
+                        SELECT ri.recipe_id FROM {LINK_TABLE} ri
+                        JOIN new_ingredients n ON n.id = ri.ingredient_id
+                        JOIN old_ingredients o ON o.id = n.id
+                        WHERE o.name IS DISTINCT FROM n.name
+                    );
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql''')
+            cursor.execute(f'''
+                CREATE OR REPLACE TRIGGER recipes_recipe_search_insert BEFORE INSERT ON {RECIPE_TABLE}
+                FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_row()''')
+            cursor.execute(f'''
+                CREATE OR REPLACE TRIGGER recipes_recipe_search_update BEFORE UPDATE OF name, difficulty ON {RECIPE_TABLE}
+                FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name OR OLD.difficulty IS DISTINCT FROM NEW.difficulty)
+                EXECUTE FUNCTION recipes_recipe_search_row()''')
+            for event, table in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+                cursor.execute(f'''
+                    CREATE OR REPLACE TRIGGER recipes_link_search_{event.lower()} AFTER {event} ON {LINK_TABLE}
+                    REFERENCING {table} TABLE AS changed_links
+                    FOR EACH STATEMENT EXECUTE FUNCTION recipes_link_search_refresh()''')
+            cursor.execute(f'''
+                CREATE OR REPLACE TRIGGER recipes_link_search_update AFTER UPDATE ON {LINK_TABLE}
+                REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+                FOR EACH STATEMENT EXECUTE FUNCTION recipes_link_search_move()''')
+            # Only renames reindex: recipe_count shifts and image updates also rewrite ingredient rows on every link
+            # write. Triggers with transition tables cannot list columns (UPDATE OF name), so the tables are compared
+            cursor.execute(f'''
+                CREATE OR REPLACE TRIGGER ingredients_search_rename AFTER UPDATE ON {INGREDIENT_TABLE}
+                REFERENCING OLD TABLE AS old_ingredients NEW TABLE AS new_ingredients
+                FOR EACH STATEMENT EXECUTE FUNCTION ingredients_search_refresh()''')
+
+    def drop_triggers(self, conn):
+        with conn.cursor() as cursor:
+            for table, name in self.triggers:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name} ON {table}')
+
+    def uninstall(self, conn):
+        self.drop_triggers(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'DROP FUNCTION IF EXISTS recipes_recipe_search_row(), recipes_link_search_refresh(), '
+                'recipes_link_search_move(), ingredients_search_refresh(), recipes_recipe_document(bigint, text, text)'
+            )
+            cursor.execute(f'ALTER TABLE {RECIPE_TABLE} DROP COLUMN IF EXISTS search_vector')
+
+    def rebuild(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f'UPDATE {RECIPE_TABLE} SET search_vector = recipes_recipe_document(id, name, difficulty)')
+
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+# The backend follows the database vendor unless settings.RECIPE_SEARCH_BACKEND names a class
+@cache
+def get_search_backend(vendor=None):
+    path = getattr(settings, 'RECIPE_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return BACKENDS.get(vendor or connection.vendor, BasicSearchBackend)()
+
+# For bulk loads: per-row index maintenance is replaced by a single rebuild at the end.
+# Searches meanwhile run against the old index and miss the rows being loaded.
+@contextmanager
+def bulk_indexing(using='default'):
+    conn = connections[using]
+    backend = get_search_backend(conn.vendor)
+    backend.drop_triggers(conn)
+    try:
+        yield
+    finally:
+        backend.install(conn)
+        backend.rebuild(conn)
+
+# post_migrate handler: re-creates triggers that SQLite dropped while a later migration rebuilt a table.
+# Skipped while the migration that introduced the index is not applied (e.g. after migrating backwards).
+def install_search_index(sender, using='default', **kwargs):
+    conn = connections[using]
+    if ('recipes', '0005_search_index') in MigrationRecorder(conn).applied_migrations():
+        get_search_backend(conn.vendor).install(conn)
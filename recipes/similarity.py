@@ -0,0 +1,157 @@
+# recipes/similarity.py
+# "Similar recipes" for the detail page, by Jaccard similarity of ingredient sets, without a pairwise scan.
+#
+# Every recipe has a MinHash signature: for each of NUM_PERM hash functions h(x) = (a*x + b) mod 2**31-1,
+# the minimum over its ingredient ids. Two recipes agree on a given position with probability equal to their
+# Jaccard similarity. The signature is cut into BANDS bands of ROWS positions and each band hashed into a
+# bucket (RecipeBand rows); recipes sharing any bucket are candidates. With 20 bands of 3 rows a pair is a
+# candidate with probability 1 - (1 - J**3)**20: 93% at J = 0.5, 42% at 0.3, 15% at 0.2. The candidates
+# sharing the most buckets are then ranked by their exact Jaccard similarity, read from the junction table.
+#
+# Signatures are (re)computed in batches for recipes whose updated_at moved past their signature's
+# computed_at, which every link write does: by `manage.py build_similarity_index`, and by the
+# refresh_similarity task that a 'recipes' version bump queues (at most once per SIMILARITY_REFRESH_DELAY).
+# Each refresh bumps the 'similarity' CatalogVersion, which keys the cached neighbour lists.
+# Lookups read the recipe's stored buckets, so only the signature computation needs numpy; it is imported
+# there because the detail view and CatalogVersion.bump() load this module in every web worker.
+import functools
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import CatalogVersion, Recipe, RecipeBand, RecipeIngredient, RecipeSignature
+
+BANDS = 20
+ROWS = 3
+NUM_PERM = BANDS * ROWS
+PRIME = (1 << 31) - 1
+MAX_CANDIDATES = 200                            # Candidates re-ranked by exact Jaccard per lookup
+NEIGHBORS_KEY = 'similar:{}:{}'                 # Recipe pk, 'similarity' version token
+REFRESH_QUEUED_KEY = 'similarity-refresh-queued'
+
+BAND_MULTIPLIER = 0x9E3779B97F4A7C15           # Mixes a band's rows into one 64-bit bucket
+
+# (a, b) of the NUM_PERM hash functions. Fixed seed: signatures are stored, so every process must use the same ones
+@functools.cache
+def hash_functions():
+    import numpy as np
+    rng = np.random.default_rng(20260218)
+    return rng.integers(1, PRIME, NUM_PERM, dtype=np.uint64), rng.integers(0, PRIME, NUM_PERM, dtype=np.uint64)
+
+# {recipe id: signature} for the (recipe id, ingredient id) pairs, which must be sorted by recipe id
+def signatures(pairs):
+    import numpy as np
+    pairs = np.asarray(pairs, dtype=np.uint64).reshape(-1, 2)
+    if not len(pairs):
+        return {}
+    hash_a, hash_b = hash_functions()
+    recipe_ids, starts = np.unique(pairs[:, 0], return_index=True)
+    hashes = (pairs[:, 1, None] * hash_a + hash_b) % PRIME     # One row per link, below 2**62 so no overflow
+    minimums = np.minimum.reduceat(hashes, starts, axis=0).astype(np.uint32)
+    return dict(zip(recipe_ids.tolist(), minimums))
+
+# (recipes, BANDS) signed 64-bit buckets for a (recipes, NUM_PERM) array of signatures
+def band_buckets(signatures):
+    import numpy as np
+    rows = signatures.reshape(-1, BANDS, ROWS).astype(np.uint64)
+    buckets = np.zeros(rows.shape[:2], dtype=np.uint64)
+    for row in range(ROWS):
+        buckets = buckets * np.uint64(BAND_MULTIPLIER) + rows[:, :, row]     # Wraps around modulo 2**64
+    return buckets.view(np.int64)
+
+# BANDS rows per recipe make the bucket table the largest one of the index; a plain executemany writes it
+# several times faster than bulk_create, which builds a model instance per row
+def insert_bands(rows):
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}, {}, {}) VALUES (%s, %s, %s)'.format(
+        quote(RecipeBand._meta.db_table), quote('recipe_id'), quote('band'), quote('bucket'),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, list(rows))
+
+# Recomputes the signatures and buckets of the given recipes, one batch per transaction
+def refresh(recipe_ids, batch_size=2000):
+    import numpy as np
+    recipe_ids = sorted(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        chunk = recipe_ids[start:start + batch_size]
+        computed_at = timezone.now()            # Before the read, so writes racing with it leave the row stale
+        links = RecipeIngredient._base_manager.filter(recipe_id__in=chunk).order_by('recipe_id').values_list('recipe_id', 'ingredient_id')
+        by_recipe = signatures(list(links))
+        existing = set(Recipe._base_manager.filter(pk__in=chunk).values_list('pk', flat=True))   # Skip deleted recipes
+        banded = sorted(existing & by_recipe.keys())
+        buckets = band_buckets(np.array([by_recipe[pk] for pk in banded])) if banded else []
+        with transaction.atomic():
+            RecipeSignature.objects.bulk_create(
+                [
+                    RecipeSignature(
+                        recipe_id=pk, computed_at=computed_at,
+                        minhash=by_recipe[pk].astype('<u4').tobytes() if pk in by_recipe else b'',
+                    )
+                    for pk in sorted(existing)
+                ],
+                update_conflicts=True, unique_fields=['recipe'], update_fields=['minhash', 'computed_at'],
+            )
+            RecipeBand.objects.filter(recipe_id__in=chunk).delete()
+            insert_bands((pk, band, bucket) for pk, row in zip(banded, buckets.tolist()) for band, bucket in enumerate(row))
+    if recipe_ids:
+        CatalogVersion.bump('similarity')
+    return len(recipe_ids)
+
+# Recipes without a signature or changed since it was computed
+def stale_recipes():
+    return Recipe.objects.filter(Q(signature__isnull=True) | Q(updated_at__gt=F('signature__computed_at')))
+
+def refresh_stale(batch_size=2000):
+    return refresh(stale_recipes().values_list('pk', flat=True), batch_size)
+
+# on_commit callback of CatalogVersion.bump('recipes'): one delayed task picks up every write made meanwhile
+def schedule_refresh():
+    # The key expires when the task is due, so writes made while it runs queue the next one
+    if cache.add(REFRESH_QUEUED_KEY, True, timeout=settings.SIMILARITY_REFRESH_DELAY):
+        from .tasks import refresh_similarity
+        run_after = timezone.now() + timedelta(seconds=settings.SIMILARITY_REFRESH_DELAY)
+        refresh_similarity.using(run_after=run_after).enqueue()
+
+# [(recipe id, Jaccard similarity)] of the k most similar recipes, best first
+def find_similar(recipe_id, k):
+    # The recipe's own buckets, as stored by refresh(), rather than recomputed from its signature
+    own_buckets = RecipeBand.objects.filter(recipe_id=recipe_id).values_list('band', 'bucket')
+    lookup = Q()
+    for band, bucket in own_buckets:
+        lookup |= Q(band=band, bucket=bucket)
+    if not lookup:
+        return []                               # Not indexed yet, or no ingredients
+    candidates = list(
+        RecipeBand.objects.filter(lookup).exclude(recipe_id=recipe_id)
+        .values('recipe_id').annotate(shared=Count('pk')).order_by('-shared', 'recipe_id')
+        .values_list('recipe_id', flat=True)[:MAX_CANDIDATES]
+    )
+    if not candidates:
+        return []
+
+    sets = {}
+    links = RecipeIngredient._base_manager.filter(recipe_id__in=[recipe_id, *candidates]).values_list('recipe_id', 'ingredient_id')
+    for pk, ingredient_id in links:
+        sets.setdefault(pk, set()).add(ingredient_id)
+    own = sets.get(recipe_id, set())
+    scored = [
+        (pk, len(own & sets[pk]) / len(own | sets[pk]))
+        for pk in candidates if pk in sets and own & sets[pk]
+    ]
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return [(pk, round(score, 4)) for pk, score in scored[:k]]
+
+# Neighbour list cached per recipe until the next index refresh
+def similar_recipes(recipe_id, token, k=None):
+    k = k or settings.SIMILAR_RECIPES
+    key = NEIGHBORS_KEY.format(recipe_id, token)
+    neighbors = cache.get(key)
+    if neighbors is None:
+        neighbors = find_similar(recipe_id, k)
+        cache.set(key, neighbors, settings.SIMILARITY_CACHE_TIMEOUT)
+    return neighbors
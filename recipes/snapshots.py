@@ -0,0 +1,65 @@
+# recipes/snapshots.py
+# Per-process, in-memory indexes over the catalog (ingredient autocomplete, "what can I cook") that follow a
+# CatalogVersion token. A holder checks the token at most every `interval` seconds; when it changed, the
+# snapshot is asked for an incremental refresh (rows changed since it was read), or rebuilt from scratch when
+# it cannot refresh itself or is older than FULL_REBUILD_AFTER.
+#
+# A snapshot class provides:
+#   build(token) -> snapshot                    classmethod, full read
+#   refreshed(token) -> snapshot | None         incremental read, None when a full rebuild is needed
+#   token, built, checked, usable               attributes (see Snapshot)
+# Readers never wait: while one thread refreshes, the others keep answering from the previous snapshot, or get
+# None before the first one exists and fall back to the database.
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+from .models import CatalogVersion
+
+CHANGE_OVERLAP = timedelta(seconds=5)           # Re-read window for writes that committed after their updated_at
+FULL_REBUILD_AFTER = 600                        # Seconds; also catches writes slower than CHANGE_OVERLAP
+
+class Snapshot:
+    def __init__(self, token, since, usable=True, built=None):
+        self.token = token                      # Version the snapshot was read at
+        self.since = since                      # Database rows changed after this are not in the snapshot yet
+        self.usable = usable                    # False: too large to hold in memory, until the next catalog change
+        self.checked = time.monotonic()
+        self.built = built or self.checked      # Time of the last full read, kept across incremental refreshes
+
+    # Start of the window an incremental refresh has to re-read
+    def changed_since(self):
+        return self.since - CHANGE_OVERLAP
+
+class SnapshotHolder:
+    def __init__(self, snapshot_class, version_name, interval_setting):
+        self.snapshot_class = snapshot_class
+        self.version_name = version_name
+        self.interval_setting = interval_setting
+        self.current = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        snapshot = self.current
+        if snapshot is not None and time.monotonic() - snapshot.checked < getattr(settings, self.interval_setting):
+            return snapshot
+        if not self.lock.acquire(blocking=False):
+            return snapshot
+        try:
+            snapshot = self.current
+            token = CatalogVersion.current(self.version_name)[self.version_name][0]
+            if snapshot is not None and snapshot.token == token:
+                snapshot.checked = time.monotonic()
+            elif snapshot is not None and snapshot.usable and time.monotonic() - snapshot.built < FULL_REBUILD_AFTER:
+                snapshot = snapshot.refreshed(token) or self.snapshot_class.build(token)
+            else:
+                snapshot = self.snapshot_class.build(token)
+            self.current = snapshot
+            return snapshot
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        self.current = None
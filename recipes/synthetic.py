@@ -0,0 +1,70 @@
+# recipes/synthetic.py
+# Generator of synthetic catalogs for benchmarks. Everything is written with bulk inserts, and the
+# recipe counters and the search index are recomputed once at the end instead of row by row.
+import random
+
+from django.db.models import Max
+from ingredients.models import Ingredient
+from .models import Recipe, RecipeIngredient
+from .search import bulk_indexing
+
+ADJECTIVES = [
+    'classic', 'spicy', 'creamy', 'roasted', 'grilled', 'crispy', 'smoky', 'rustic', 'golden', 'zesty',
+    'hearty', 'sweet', 'tangy', 'herbed', 'braised', 'baked', 'fresh', 'slow', 'quick', 'garlic',
+]
+DISHES = [
+    'pasta', 'soup', 'salad', 'curry', 'stew', 'risotto', 'tacos', 'burger', 'pancakes', 'omelette',
+    'casserole', 'pie', 'noodles', 'chili', 'gratin', 'tart', 'skewers', 'bowl', 'sandwich', 'pilaf',
+]
+FOODS = [
+    'tomato', 'onion', 'garlic', 'basil', 'cheese', 'flour', 'butter', 'egg', 'milk', 'rice',
+    'chicken', 'beef', 'salmon', 'potato', 'carrot', 'pepper', 'lemon', 'sugar', 'salt', 'olive oil',
+    'mushroom', 'spinach', 'cream', 'ginger', 'chili', 'lime', 'coriander', 'cumin', 'honey', 'bacon',
+]
+QUALIFIERS = ['', 'fresh', 'dried', 'smoked', 'ground', 'chopped', 'roasted', 'organic', 'wild', 'aged']
+
+# Unique, already normalized ingredient names: 'tomato', 'dried tomato', ..., then numbered variants
+def ingredient_names(count):
+    names = []
+    variant = 0
+    while len(names) < count:
+        for qualifier in QUALIFIERS:
+            for food in FOODS:
+                name = ' '.join(filter(None, [qualifier, food, str(variant) if variant else '']))
+                names.append(name)
+                if len(names) == count:
+                    return names
+        variant += 1
+    return names
+
+# Adds `recipes` recipes linked to `links_per_recipe` random ingredients out of `ingredients` (created if missing).
+# The same seed produces the same catalog. Returns the ids of the new recipes.
+def generate_catalog(recipes, ingredients, links_per_recipe, seed=0, batch_size=5000):
+    rng = random.Random(seed)
+
+    names = ingredient_names(ingredients)
+    Ingredient.objects.bulk_create([Ingredient(name=name) for name in names], batch_size=batch_size, ignore_conflicts=True)
+    ingredient_ids = []
+    for start in range(0, len(names), batch_size):      # Chunked to stay under the database's parameter limit
+        ingredient_ids += Ingredient.objects.filter(name__in=names[start:start + batch_size]).values_list('pk', flat=True)
+    links_per_recipe = min(links_per_recipe, len(ingredient_ids))
+
+    offset = (Recipe.objects.aggregate(last=Max('pk'))['last'] or 0) + 1    # Keeps names unique across runs
+    recipe_ids = []
+    with bulk_indexing(), Recipe.objects.deferred_difficulty():
+        for start in range(0, recipes, batch_size):
+            created = Recipe.objects.bulk_create([
+                Recipe(
+                    name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(DISHES)} {offset + i}',
+                    cooking_time=rng.randint(2, 120),
+                )
+                for i in range(start, min(start + batch_size, recipes))
+            ])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(recipe_id=recipe.pk, ingredient_id=ingredient_id)
+                for recipe in created
+                for ingredient_id in rng.sample(ingredient_ids, links_per_recipe)
+            ], batch_size=batch_size)
+            recipe_ids += [recipe.pk for recipe in created]
+        Recipe.objects.mark_dirty(recipe_ids)   # Also covers recipes without links, which bulk_create left without a difficulty
+    return recipe_ids
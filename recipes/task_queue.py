@@ -0,0 +1,234 @@
+# recipes/task_queue.py
+# A django.tasks backend that keeps the queue in the project database (recipes.QueuedTask), plus the worker
+# loop run by `manage.py run_worker`. Enqueueing is one INSERT inside the caller's transaction, so a task
+# becomes visible to workers only when the data it refers to is committed.
+#
+# Claiming: on PostgreSQL (and other backends with SKIP LOCKED) a worker locks the next ready row with
+# SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never wait on each other. SQLite has no row locks;
+# there the worker flips the row with a conditional UPDATE (... WHERE status = 'READY') and moves on to the
+# next candidate when another worker won the race.
+# Failed attempts are retried after RETRY_DELAY * 2**(attempt - 1) seconds (capped at MAX_RETRY_DELAY) until
+# MAX_ATTEMPTS is reached. Rows left RUNNING by a killed worker go back to READY after LEASE_SECONDS, or to
+# FAILED when that lost run was the last attempt.
+import socket
+import threading
+import time
+from datetime import timedelta
+from traceback import format_exception
+
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.tasks import TaskContext, TaskResult, TaskResultStatus
+from django.tasks.backends.base import BaseTaskBackend
+from django.tasks.base import TaskError
+from django.tasks.exceptions import TaskResultDoesNotExist
+from django.tasks.signals import task_enqueued, task_finished, task_started
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.json import normalize_json
+from django.utils.module_loading import import_string
+
+from .models import QueuedTask
+
+CLAIM_CANDIDATES = 10                           # Ready rows tried per claim on backends without SKIP LOCKED
+OUTCOME_SAVE_ATTEMPTS = 5                       # Writes of a finished task's status before it is left to the lease
+
+# Recorded as the error of an attempt whose worker died or hung past the lease
+class WorkerLost(Exception):
+    pass
+
+def error_record(error):
+    return {
+        'exception_class_path': f'{type(error).__module__}.{type(error).__qualname__}',
+        'traceback': ''.join(format_exception(error)),
+    }
+
+class DatabaseBackend(BaseTaskBackend):
+    supports_defer = True
+    supports_get_result = True
+    supports_priority = True
+
+    def __init__(self, alias, params):
+        super().__init__(alias, params)
+        self.max_attempts = self.options.get('MAX_ATTEMPTS', 3)
+        self.retry_delay = self.options.get('RETRY_DELAY', 10)
+        self.max_retry_delay = self.options.get('MAX_RETRY_DELAY', 3600)
+        self.lease = timedelta(seconds=self.options.get('LEASE_SECONDS', 900))
+
+    def enqueue(self, task, args, kwargs):
+        self.validate_task(task)
+        now = timezone.now()
+        row = QueuedTask.objects.create(
+            task_path=task.module_path,
+            args=normalize_json(args),
+            kwargs=normalize_json(kwargs),
+            backend=self.alias,
+            queue_name=task.queue_name,
+            priority=task.priority,
+            run_after=task.run_after or now,
+            enqueued_at=now,
+        )
+        result = self.to_result(row, task)
+        task_enqueued.send(type(self), task_result=result)
+        return result
+
+    def get_result(self, result_id):
+        try:
+            row = QueuedTask.objects.get(pk=result_id, backend=self.alias)
+        except (QueuedTask.DoesNotExist, ValueError):      # ValueError: not a UUID
+            raise TaskResultDoesNotExist(result_id)
+        return self.to_result(row)
+
+    def to_result(self, row, task=None):
+        task = (task or import_string(row.task_path)).using(
+            priority=row.priority, queue_name=row.queue_name, run_after=row.run_after,
+        )
+        result = TaskResult(
+            task=task,
+            id=str(row.pk),
+            status=TaskResultStatus(row.status),
+            enqueued_at=row.enqueued_at,
+            started_at=row.started_at,
+            last_attempted_at=row.last_attempted_at,
+            finished_at=row.finished_at,
+            args=row.args,
+            kwargs=row.kwargs,
+            backend=row.backend,
+            errors=[TaskError(**error) for error in row.errors],
+            worker_ids=list(row.worker_ids),
+        )
+        object.__setattr__(result, '_return_value', row.return_value)
+        return result
+
+    # --- Worker side ---
+
+    # Marks the next ready task of `queues` as RUNNING for this worker and returns its row, or None
+    def claim(self, queues, worker_id):
+        ready = QueuedTask.objects.filter(
+            backend=self.alias, status=TaskResultStatus.READY, queue_name__in=queues, run_after__lte=timezone.now(),
+        ).order_by('-priority', 'run_after')
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                row = ready.select_for_update(skip_locked=True).first()
+                return row and self._start(row, worker_id)
+        for pk in ready.values_list('pk', flat=True)[:CLAIM_CANDIDATES]:
+            with transaction.atomic():          # A failed _start() leaves the row READY rather than orphaned
+                if QueuedTask.objects.filter(pk=pk, status=TaskResultStatus.READY).update(status=TaskResultStatus.RUNNING):
+                    return self._start(QueuedTask.objects.get(pk=pk), worker_id)
+        return None
+
+    def _start(self, row, worker_id):
+        now = timezone.now()
+        row.status = TaskResultStatus.RUNNING
+        row.started_at = row.started_at or now
+        row.last_attempted_at = now
+        row.worker_ids.append(worker_id)
+        row.save(update_fields=['status', 'started_at', 'last_attempted_at', 'worker_ids'])
+        return row
+
+    # Runs a claimed task and records the outcome: SUCCESSFUL, READY again with a backoff, or FAILED
+    def execute(self, row):
+        try:
+            task = import_string(row.task_path)
+        except ImportError as error:            # Code removed or renamed since the task was queued: no point retrying
+            return self._finish(row, None, error, retry=False)
+        result = self.to_result(row, task)
+        task_started.send(type(self), task_result=result)
+        try:
+            if task.takes_context:
+                value = task.call(TaskContext(task_result=result), *row.args, **row.kwargs)
+            else:
+                value = task.call(*row.args, **row.kwargs)
+            value = normalize_json(value)
+        except KeyboardInterrupt:
+            raise
+        except BaseException as error:
+            return self._finish(row, result, error, retry=len(row.worker_ids) < self.max_attempts)
+        row.return_value = value
+        return self._finish(row, result, None)
+
+    def _finish(self, row, result, error, retry=False):
+        now = timezone.now()
+        if error is None:
+            row.status = TaskResultStatus.SUCCESSFUL
+        else:
+            row.errors.append(error_record(error))
+            row.status = TaskResultStatus.READY if retry else TaskResultStatus.FAILED
+        if retry:
+            delay = min(self.retry_delay * 2 ** (len(row.worker_ids) - 1), self.max_retry_delay)
+            row.run_after = now + timedelta(seconds=delay)
+        else:
+            row.finished_at = now
+        for attempt in range(OUTCOME_SAVE_ATTEMPTS):
+            try:
+                row.save(update_fields=['status', 'errors', 'return_value', 'run_after', 'finished_at'])
+                break
+            except DatabaseError:               # The task already ran: try harder than for a claim before giving up
+                if attempt == OUTCOME_SAVE_ATTEMPTS - 1:
+                    raise
+                time.sleep(0.05 * 2 ** attempt)
+        if result is not None and not retry:
+            task_finished.send(type(self), task_result=self.to_result(row, result.task))
+        return row
+
+    # Puts tasks back whose worker died mid-run. The lost run counts towards MAX_ATTEMPTS (its claim appended a
+    # worker id), so a task that reliably kills its worker ends up FAILED instead of being retried forever.
+    def requeue_abandoned(self):
+        now = timezone.now()
+        abandoned = QueuedTask.objects.filter(
+            backend=self.alias, status=TaskResultStatus.RUNNING, last_attempted_at__lt=now - self.lease,
+        )
+        handled = 0
+        for row in abandoned:
+            worker = row.worker_ids[-1] if row.worker_ids else 'unknown'
+            row.errors.append(error_record(WorkerLost(f'worker {worker} did not finish within {self.lease.total_seconds():.0f}s')))
+            retry = len(row.worker_ids) < self.max_attempts
+            row.status = TaskResultStatus.READY if retry else TaskResultStatus.FAILED
+            row.finished_at = None if retry else now
+            # Conditional on the same attempt, so a late outcome or another worker's requeue is never overwritten
+            updated = QueuedTask.objects.filter(
+                pk=row.pk, status=TaskResultStatus.RUNNING, last_attempted_at=row.last_attempted_at,
+            ).update(status=row.status, errors=row.errors, finished_at=row.finished_at)
+            handled += updated
+            if updated and not retry:
+                try:
+                    task_finished.send(type(self), task_result=self.to_result(row))
+                except ImportError:             # Task code removed since it was queued: nothing to tell listeners
+                    pass
+        return handled
+
+# Claims and runs tasks until `stop` is set, or until the queues are empty when `burst` is true
+class Worker:
+    def __init__(self, backend, queues, stop=None, burst=False, poll_interval=1.0):
+        self.backend = backend
+        self.queues = list(queues)
+        self.stop = stop or threading.Event()
+        self.burst = burst
+        self.poll_interval = poll_interval
+        self.id = f'{socket.gethostname()}:{get_random_string(8)}'
+        self.processed = 0
+
+    def run(self, max_errors=5):
+        errors = 0
+        while not self.stop.is_set():
+            if not connection.in_atomic_block:
+                close_old_connections()         # Honour CONN_MAX_AGE and drop broken connections between tasks
+            try:
+                row = self.backend.claim(self.queues, self.id)
+                if row is None:
+                    if self.burst:
+                        break
+                    self.backend.requeue_abandoned()
+                    self.stop.wait(self.poll_interval)
+                    continue
+                self.backend.execute(row)
+            except DatabaseError:
+                # Lock contention on SQLite or a lost connection: back off and retry. A task whose outcome
+                # could not be saved stays RUNNING and is requeued after the lease.
+                errors += 1
+                if errors >= max_errors:
+                    raise
+                self.stop.wait(min(self.poll_interval, 0.1) * errors)
+                continue
+            errors = 0
+            self.processed += 1
+        return self.processed
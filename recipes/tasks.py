@@ -0,0 +1,25 @@
+# recipes/tasks.py
+# Background work of the recipes and ingredients apps. Enqueued with `<task>.enqueue(...)` on the backend in
+# settings.TASKS (the database queue of recipes/task_queue.py) and run by `manage.py run_worker`.
+# Arguments are stored as JSON, so tasks take model labels and primary keys rather than instances.
+from django.apps import apps
+from django.tasks import task
+
+from .images import sync_derivatives
+
+@task
+def sync_image_derivatives(model_label, pk):
+    instance = apps.get_model(model_label)._base_manager.filter(pk=pk).first()
+    if instance is None:
+        return None                             # Deleted before the worker got to it
+    sync_derivatives(instance)
+    return instance.image_derivatives.get('widths', [])
+
+@task
+def recompute_difficulty(recipe_ids):
+    return apps.get_model('recipes', 'Recipe').objects.filter(pk__in=recipe_ids).recompute_difficulty()
+
+@task
+def refresh_similarity():
+    from .similarity import refresh_stale
+    return refresh_stale()
@@ -0,0 +1,18 @@
+# recipes/templatetags/fragment_cache.py
+# {% cached_fragments %}: renders one fragment per object through the batched fragment cache of
+# recipes/fragments.py. Used as {% cached_fragments recipes "recipes/recipe_card.html" "recipe" %} it outputs
+# every fragment in order; with `as pills` the result can be placed piece by piece with {{ pills|fragment:obj }}.
+from django import template
+
+from recipes.fragments import render_fragments
+
+register = template.Library()
+
+# Extra positional arguments name fields outside the row that the fragment shows, e.g. "recipe_count"
+@register.simple_tag
+def cached_fragments(objects, template_name, name, *key_fields):
+    return render_fragments(objects, template_name, name, key_fields)
+
+@register.filter
+def fragment(fragments, obj):
+    return fragments.get(obj.pk, '')
@@ -0,0 +1,30 @@
+# recipes/templatetags/recipe_images.py
+# {% responsive_image %}: a <picture> with WebP and JPEG srcset lists over the derivatives of an image field,
+# so the browser downloads the smallest copy that fills the slot described by `sizes`.
+from django import template
+from django.templatetags.static import static
+
+from recipes.images import fallback_url, has_upload, srcset
+
+register = template.Library()
+
+# `width` is the rendered width in CSS pixels used for the plain src (browsers without srcset support).
+# Images above the fold pass lazy=False so they are fetched with high priority instead of deferred.
+@register.inclusion_tag('recipes/responsive_image.html')
+def responsive_image(field_file, info, sizes, width, alt='', css_class='', style='', lazy=True,
+                     placeholder='img/no_image.png'):
+    webp = srcset(field_file, info, 'webp')
+    if webp:
+        src = fallback_url(field_file, info, width)
+    else:
+        src = field_file.url if has_upload(field_file) else static(placeholder)
+    return {
+        'src': src,
+        'webp_srcset': webp,
+        'jpg_srcset': srcset(field_file, info, 'jpg'),
+        'sizes': sizes,
+        'alt': alt,
+        'css_class': css_class,
+        'style': style,
+        'lazy': lazy,
+    }
@@ -1,11 +1,37 @@
 # recipes/tests.py
-from django.test import TestCase
-from django.urls import reverse
+import json
+import os
+import sqlite3
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.tasks import task
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.urls import include, path, reverse
 from django.utils.html import escape
 from django.contrib.auth.models import User     # Added for auth testing
-from .models import Recipe, RecipeIngredient
+from .models import CatalogVersion, ImportCheckpoint, QueuedTask, Recipe, RecipeIngredient
 from ingredients.models import Ingredient
 from .forms import RecipeSearchForm
+from . import charts
+from .utils import series_from_queryset
+from .views import search_recipes
+from .search import BasicSearchBackend, bulk_indexing, get_search_backend
+from .fragments import render_fragments
+from .pagination import encode_cursor
+from .similarity import REFRESH_QUEUED_KEY, find_similar, schedule_refresh, signatures, similar_recipes, stale_recipes
+from .pantry import PantryIndex, reset_index as reset_pantry_index, search_database as pantry_database, what_can_i_cook
+
+try:
+    import sqlalchemy                           # Optional, only needed by migrate_legacy_recipes
+except ImportError:
+    sqlalchemy = None
 
 # --- Models tests ---
 
@@ -14,7 +40,6 @@ class RecipeModelTest(TestCase):
     def setUpTestData(cls):
         # Create a base recipe for all tests in this class
         cls.recipe = Recipe.objects.create(name="Tea", cooking_time=5)
-        cls.recipe.calculate_difficulty()   # Ensure difficulty is set based on initial data
 
     def test_initial_difficulty_easy(self):
         """A new recipe with short time and 0 ingredients should be easy."""
@@ -75,6 +100,19 @@ class RecipeIngredientModelTest(TestCase):
         # 8 mins + 2 ingredients = easy
         self.assertEqual(self.recipe.difficulty, 'easy')
 
+    def test_moving_a_link_updates_both_recipes(self):
+        """Re-pointing a saved link to another recipe recounts the old recipe as well as the new one."""
+        other = Recipe.objects.create(name="Soup", cooking_time=8)
+        links = [RecipeIngredient.objects.create(recipe=self.recipe, ingredient=ingredient) for ingredient in self.ingredients[:4]]
+        links[0].recipe = other
+        links[0].save()
+
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.recipe.ingredient_count, self.recipe.difficulty), (3, 'easy'))
+        self.assertEqual((other.ingredient_count, other.difficulty), (1, 'easy'))
+        self.assertEqual(Recipe.objects.with_drift().count(), 0)
+
     def test_unique_together_constraint(self):
         """Test that adding the same ingredient to a recipe twice raises an error."""
         RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.ingredients[0])
@@ -96,6 +134,180 @@ class RecipeIngredientModelTest(TestCase):
         expected_str = f"Recipe: {self.recipe.name} | Ingredient: {self.ingredients[0].name}"
         self.assertEqual(str(link), expected_str)
 
+class IngredientCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = Recipe.objects.create(name="Salad", cooking_time=5)
+        cls.ingredients = [
+            Ingredient.objects.create(name=f"leaf {i}") for i in range(4)
+        ]
+
+    def test_count_follows_single_links(self):
+        """RecipeIngredient.save/delete keep the stored ingredient_count in sync."""
+        links = [RecipeIngredient.objects.create(recipe=self.recipe, ingredient=ing) for ing in self.ingredients]
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 4)
+        links[0].delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 3)
+
+    def test_count_follows_bulk_paths(self):
+        """bulk_create and queryset delete on the junction table refresh the counter."""
+        RecipeIngredient.objects.bulk_create(
+            [RecipeIngredient(recipe=self.recipe, ingredient=ing) for ing in self.ingredients]
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 4)
+        RecipeIngredient.objects.filter(ingredient__in=self.ingredients[:3]).delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 1)
+
+    def test_count_follows_ingredient_cascade(self):
+        """Deleting ingredients (instance or queryset) refreshes the counters of their recipes."""
+        for ing in self.ingredients:
+            RecipeIngredient.objects.create(recipe=self.recipe, ingredient=ing)
+        self.ingredients[0].delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 3)
+        Ingredient.objects.filter(name__in=["leaf 1", "leaf 2"]).delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 1)
+
+    def test_full_save_keeps_counter(self):
+        """Saving a stale Recipe instance must not overwrite the maintained counter."""
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.ingredients[0])
+        stale.cooking_time = 20
+        stale.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 1)
+        self.assertEqual(self.recipe.cooking_time, 20)
+
+class RecomputeDifficultyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ingredients = [Ingredient.objects.create(name=f"spice {i}") for i in range(5)]
+        cls.recipes = [Recipe.objects.create(name=f"Curry {i}", cooking_time=5 + i * 5) for i in range(3)]
+        for recipe in cls.recipes:
+            RecipeIngredient.objects.bulk_create(
+                [RecipeIngredient(recipe=recipe, ingredient=ing) for ing in cls.ingredients]
+            )
+        # Simulate drift, e.g. values written before the counters existed
+        Recipe.objects.update(ingredient_count=0, difficulty='easy')
+
+    def test_recompute_repairs_all_recipes_in_one_update(self):
+        """recompute_difficulty fixes every recipe with a single UPDATE per batch."""
+        with self.assertNumQueries(3):      # Fetch the ids, one UPDATE for the batch, then the CatalogVersion bump
+            updated = Recipe.objects.recompute_difficulty()
+        self.assertEqual(updated, 3)
+        self.assertEqual(
+            list(Recipe.objects.order_by('pk').values_list('ingredient_count', 'difficulty')),
+            [(5, 'medium'), (5, 'hard'), (5, 'hard')],
+        )
+        self.assertFalse(Recipe.objects.with_drift().exists())
+
+    def test_ingredient_queryset_delete_repairs_difficulty(self):
+        """A bulk ingredient cleanup recomputes the recipes that lost links."""
+        Recipe.objects.recompute_difficulty()
+        Ingredient.objects.filter(pk__in=[ing.pk for ing in self.ingredients[:2]]).delete()
+        self.assertEqual(
+            list(Recipe.objects.order_by('pk').values_list('ingredient_count', 'difficulty')),
+            [(3, 'easy'), (3, 'intermediate'), (3, 'intermediate')],
+        )
+
+    def test_command_check_reports_drift_without_writing(self):
+        out = StringIO()
+        with self.assertRaises(CommandError) as raised:
+            call_command('recompute_difficulty', '--check', stdout=out)
+        self.assertEqual(raised.exception.returncode, 1)
+        self.assertIn('3 recipes have drifted', out.getvalue())
+        self.assertEqual(Recipe.objects.with_drift().count(), 3)
+
+    def test_command_repairs_selected_recipes(self):
+        out = StringIO()
+        call_command('recompute_difficulty', '--ids', str(self.recipes[0].pk), stdout=out)
+        call_command('recompute_difficulty', '--from-id', str(self.recipes[2].pk), stdout=out)
+        self.assertEqual(
+            list(Recipe.objects.with_drift().values_list('pk', flat=True)), [self.recipes[1].pk]
+        )
+
+class SetIngredientsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = Recipe.objects.create(name="Stew", cooking_time=40)
+        Ingredient.objects.create(name="onion")
+
+    def test_names_are_normalized_and_linked(self):
+        """set_ingredients cleans names like Ingredient.save and reuses existing rows."""
+        self.recipe.set_ingredients(["  Onion ", "CARROT", "carrot", ""])
+        self.assertEqual(
+            sorted(self.recipe.ingredients.values_list('name', flat=True)), ["carrot", "onion"]
+        )
+        self.assertEqual(Ingredient.objects.filter(name="onion").count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.ingredient_count, self.recipe.difficulty), (2, 'intermediate'))
+
+    def test_dropped_links_are_removed(self):
+        self.recipe.set_ingredients(["onion", "carrot", "potato", "beef"])
+        self.recipe.set_ingredients(["onion", "beef"])
+        self.assertEqual(
+            sorted(self.recipe.ingredients.values_list('name', flat=True)), ["beef", "onion"]
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredient_count, 2)
+        self.assertFalse(Recipe.objects.with_drift().exists())
+
+    def test_query_count_is_constant(self):
+        """Linking 3 or 12 ingredients costs the same number of queries."""
+        other = Recipe.objects.create(name="Ragout", cooking_time=40)
+        with CaptureQueriesContext(connection) as few:
+            self.recipe.set_ingredients([f"herb {i}" for i in range(3)])
+        with CaptureQueriesContext(connection) as many:
+            other.set_ingredients([f"root {i}" for i in range(12)])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+class CoalescedDifficultyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = Recipe.objects.create(name="Omelette", cooking_time=5)
+        cls.ingredients = [Ingredient.objects.create(name=f"filling {i}") for i in range(5)]
+
+    def test_new_recipe_gets_difficulty(self):
+        """Difficulty is set on insert by Recipe.save(), without a second query."""
+        self.assertEqual(Recipe.objects.get(pk=self.recipe.pk).difficulty, 'easy')
+
+    def test_edit_is_a_single_update(self):
+        """Saving an existing recipe writes difficulty in the same UPDATE."""
+        self.recipe.cooking_time = 25
+        with self.assertNumQueries(2):      # The UPDATE and the CatalogVersion bump
+            self.recipe.save()
+        self.assertEqual(self.recipe.difficulty, 'intermediate')
+
+    def test_stale_instance_uses_stored_counter(self):
+        """An instance loaded before links were added still saves the right difficulty."""
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        self.recipe.set_ingredients([ing.name for ing in self.ingredients])
+        stale.cooking_time = 30
+        stale.save()
+        self.assertEqual(stale.difficulty, 'hard')
+
+    def test_link_is_insert_plus_one_update(self):
+        # INSERT, UPDATE of the recipe and of the ingredient's recipe_count, one CatalogVersion bump for each
+        with self.assertNumQueries(5):
+            RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.ingredients[0])
+        self.assertEqual(self.recipe.ingredient_count, 1)
+
+    def test_deferred_difficulty_recomputes_once_on_exit(self):
+        """Links added inside the block only write the junction rows until it exits."""
+        with Recipe.objects.deferred_difficulty():
+            with CaptureQueriesContext(connection) as ctx:
+                for ing in self.ingredients:
+                    RecipeIngredient.objects.create(recipe=self.recipe, ingredient=ing)
+            self.assertEqual(len(ctx.captured_queries), len(self.ingredients))
+            self.assertEqual(Recipe.objects.get(pk=self.recipe.pk).ingredient_count, 0)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual((recipe.ingredient_count, recipe.difficulty), (5, 'medium'))
+
 # --- Views tests ---
 class RecipeViewsTest(TestCase):
     @classmethod
@@ -107,6 +319,7 @@ class RecipeViewsTest(TestCase):
     def setUp(self):
         # Log the user in before every view test that requires authentication
         self.client.login(username='testuser', password='testpassword123')
+        caches['pages'].clear()                 # Render every page rather than serving an earlier test's copy
 
     def test_recipes_list_view_status_and_template(self):
         url = reverse('recipes:recipes_list')
@@ -136,6 +349,144 @@ class RecipeViewsTest(TestCase):
         detail_url = reverse('recipes:recipe_detail', args=[self.recipe1.pk])
         self.assertContains(response, escape(detail_url))
 
+class RecipeListPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='pager', password='password123')
+        for i in range(30):
+            Recipe.objects.create(name=f"{'Pancake' if i % 2 else 'waffle'} {i:02d}", cooking_time=10)
+
+    def setUp(self):
+        self.client.login(username='pager', password='password123')
+        caches['pages'].clear()
+
+    def collect_pages(self, url, **params):
+        names, after = [], None
+        while True:
+            if after:
+                params['after'] = after
+            data = self.client.get(url, params).context
+            names += [recipe.name for recipe in data['recipes']]
+            after = data['next_cursor']
+            if not after:
+                return names
+
+    def test_keyset_pages_cover_every_recipe_once(self):
+        """Following next_cursor walks the whole collection in case-insensitive name order."""
+        names = self.collect_pages(reverse('recipes:recipes_list'))
+        self.assertEqual(names, sorted(Recipe.objects.values_list('name', flat=True), key=str.lower))
+
+    def test_sort_by_id(self):
+        names = self.collect_pages(reverse('recipes:recipes_list'), sort='id')
+        self.assertEqual(names, list(Recipe.objects.order_by('pk').values_list('name', flat=True)))
+
+    def test_prefix_filter_is_server_side_and_case_insensitive(self):
+        response = self.client.get(reverse('recipes:recipes_list'), {'q': 'PAN'})
+        self.assertEqual(len(response.context['recipes']), 15)
+        self.assertNotContains(response, 'waffle')
+
+    def test_prefix_ending_in_the_highest_code_point(self):
+        """A prefix whose last character has no successor is matched with startswith alone."""
+        Recipe.objects.create(name="Pan\U0010ffff Special", cooking_time=10)
+        response = self.client.get(reverse('recipes:recipes_list'), {'q': 'pan\U0010ffff'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([recipe.name for recipe in response.context['recipes']], ["Pan\U0010ffff Special"])
+
+    def test_page_queries_do_not_depend_on_depth(self):
+        url = reverse('recipes:recipes_list')
+        with CaptureQueriesContext(connection) as first:
+            cursor = self.client.get(url).context['next_cursor']
+        with CaptureQueriesContext(connection) as second:
+            self.client.get(url, {'after': cursor})
+        self.assertEqual(len(first.captured_queries), len(second.captured_queries))
+
+    def test_tampered_cursor_restarts_from_first_page(self):
+        """Cursors with the wrong shape or element types fall back to the first page instead of failing."""
+        url = reverse('recipes:recipes_list')
+        first = [recipe.pk for recipe in self.client.get(url, {'sort': 'id'}).context['recipes']]
+        for sort, key in [('id', ['x']), ('id', [True]), ('id', ['a', 'x']), ('name', ['a', 'x']), ('name', [1, 2]), ('name', 'a')]:
+            with self.subTest(sort=sort, key=key):
+                response = self.client.get(url, {'sort': sort, 'after': encode_cursor(key)})
+                self.assertEqual(response.status_code, 200)
+                if sort == 'id':
+                    self.assertEqual([recipe.pk for recipe in response.context['recipes']], first)
+        response = self.client.get(url, {'after': 'not base64!'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cards_endpoint_returns_html_and_cursor(self):
+        response = self.client.get(reverse('recipes:recipe_cards'), {'q': 'waffle'})
+        data = response.json()
+        self.assertEqual(data['html'].count('recipe-item'), 15)
+        self.assertIsNone(data['next'])
+
+class RecipeSearchBackendTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.salmon = Recipe.objects.create(name="Smoked Salmon Bagel", cooking_time=5)
+        cls.salad = Recipe.objects.create(name="Garden Salad", cooking_time=5)
+        cls.salad.set_ingredients(['smoked salmon', 'lettuce', 'tomato', 'lemon', 'olive oil'])
+        cls.stew = Recipe.objects.create(name="Tomato Stew", cooking_time=90)
+
+    def search(self, term):
+        return list(get_search_backend().search(Recipe.objects.all(), term).values_list('name', flat=True))
+
+    def test_name_matches_rank_before_ingredient_matches(self):
+        self.assertEqual(self.search('salmon'), ["Smoked Salmon Bagel", "Garden Salad"])
+
+    def test_every_word_must_match_as_a_prefix(self):
+        self.assertEqual(self.search('tom ste'), ["Tomato Stew"])
+        self.assertEqual(self.search('salmon stew'), [])
+
+    def test_difficulty_is_searchable(self):
+        self.assertEqual(self.search('medium'), ["Garden Salad"])
+        self.assertEqual(self.search('intermediate'), ["Tomato Stew"])
+
+    def test_index_follows_links_and_renames(self):
+        self.stew.set_ingredients(['paprika'])
+        self.assertEqual(self.search('paprika'), ["Tomato Stew"])
+        Ingredient.objects.filter(name='paprika').update(name='saffron')
+        self.assertEqual(self.search('saffron'), ["Tomato Stew"])
+        self.stew.set_ingredients([])
+        self.assertEqual(self.search('saffron'), [])
+        self.stew.name = "Lentil Stew"
+        self.stew.save()
+        self.assertEqual(self.search('lentil'), ["Lentil Stew"])
+
+    def test_index_follows_link_updates(self):
+        """A queryset UPDATE moving a link to another recipe reindexes both recipes."""
+        RecipeIngredient.objects.filter(recipe=self.salad, ingredient__name='lemon').update(recipe=self.stew)
+        self.assertEqual(self.search('lemon'), ["Tomato Stew"])
+
+    # Overwrites the recipe's index entry with a marker word, so a later reindex of the recipe is visible
+    def mark_index(self, recipe, word):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("UPDATE recipes_recipe SET search_vector = to_tsvector('simple', %s) WHERE id = %s", [word, recipe.pk])
+            else:
+                cursor.execute("UPDATE recipes_recipe_fts SET ingredients = %s WHERE rowid = %s", [word, recipe.pk])
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Needs a trigger-maintained search index')
+    def test_only_ingredient_renames_reindex_linked_recipes(self):
+        """recipe_count shifts rewrite ingredient rows on every link write without reindexing the other recipes."""
+        self.mark_index(self.salad, 'sentinel')
+        lemon = Ingredient.objects.get(name='lemon')
+        RecipeIngredient.objects.create(recipe=self.stew, ingredient=lemon)
+        Ingredient.objects.filter(pk=lemon.pk).update(recipe_count=F('recipe_count') + 1)
+        self.assertEqual(self.search('sentinel'), ["Garden Salad"])
+
+        Ingredient.objects.filter(pk=lemon.pk).update(name='lime')
+        self.assertEqual(self.search('sentinel'), [])
+        self.assertCountEqual(self.search('lime'), ["Garden Salad", "Tomato Stew"])
+
+    def test_bulk_indexing_rebuilds_on_exit(self):
+        with bulk_indexing():
+            Recipe.objects.bulk_create([Recipe(name=f"Bulk Curry {i}", cooking_time=10) for i in range(3)])
+        self.assertEqual(len(self.search('curry')), 3)
+
+    def test_matches_are_a_subset_of_the_basic_search(self):
+        basic = set(BasicSearchBackend().search(Recipe.objects.all(), 'salmon').values_list('name', flat=True))
+        self.assertEqual(set(self.search('salmon')), basic)
+
 class RecipeDataLabViewTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -155,18 +506,346 @@ class RecipeDataLabViewTest(TestCase):
         self.assertTemplateUsed(response, 'recipes/recipes_search.html')
 
     def test_data_lab_post_logic(self):
-        """Verify the search generates a dataframe and chart in context."""
+        """Verify the search generates the result rows and chart in context."""
         url = reverse('recipes:recipes_search')
         response = self.client.post(url, {
             'recipe_name': 'Pasta',
             'chart_type': '#1'
         })
         self.assertEqual(response.status_code, 200)
-        self.assertIn('recipes_df', response.context)
+        self.assertIn('recipe_rows', response.context)
         self.assertIn('chart', response.context)
         # Verify the custom table formatting class is present in the output
         self.assertContains(response, 'dataframe')
 
+    def test_result_table_links_and_escapes_names(self):
+        """Names are escaped and linked to their detail page."""
+        recipe = Recipe.objects.create(name="<script>Pasta</script>", cooking_time=5)
+        response = self.client.post(reverse('recipes:recipes_search'), {'recipe_name': 'pasta', 'chart_type': '#1'})
+        self.assertContains(response, f'href="{reverse("recipes:recipe_detail", kwargs={"pk": recipe.pk})}"')
+        self.assertContains(response, escape(recipe.name))
+        self.assertNotContains(response, recipe.name)
+
+    def test_data_lab_query_count_is_constant(self):
+        """The search must not issue one query per matching recipe."""
+        url = reverse('recipes:recipes_search')
+        ingredient = Ingredient.objects.create(name="flour")
+
+        def search_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(url, {'recipe_name': '', 'chart_type': '#3'})
+            return len(ctx.captured_queries)
+
+        baseline = search_queries()
+        for i in range(10):
+            recipe = Recipe.objects.create(name=f"Bread {i}", cooking_time=30)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient)
+        self.assertEqual(search_queries(), baseline)
+
+class ChartCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='charts', password='password123')
+        Recipe.objects.create(name="Pasta", cooking_time=20)
+        Recipe.objects.create(name="Pasta Salad", cooking_time=5)
+
+    def setUp(self):
+        caches['charts'].clear()
+        self.client.login(username='charts', password='password123')
+
+    def search(self, chart_type='#1'):
+        response = self.client.post(
+            reverse('recipes:recipes_search'), {'recipe_name': 'pasta', 'chart_type': chart_type, 'chart_format': 'png'}
+        )
+        return response.context['chart']
+
+    def test_repeat_search_reuses_rendered_chart(self):
+        with mock.patch.object(charts, 'render_chart', wraps=charts.render_chart) as render:
+            first = self.search()
+            second = self.search()
+        self.assertEqual(first, second)
+        self.assertEqual(render.call_count, 1)
+
+    def test_key_depends_on_chart_type_and_series(self):
+        bar = self.search('#1')
+        self.assertNotEqual(bar, self.search('#3'))
+        Recipe.objects.filter(name="Pasta").update(cooking_time=25)
+        self.assertNotEqual(bar, self.search('#1'))
+
+    def test_page_references_url_served_as_immutable_png(self):
+        url = self.search()
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_evicted_chart_is_404(self):
+        url = self.search()
+        caches['charts'].clear()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+class ChartRenderPoolTest(TestCase):
+    series = {'labels': ['Pasta', 'Soup'], 'cooking_time': [20, 35]}
+
+    def tearDown(self):
+        if charts._pool is not None:
+            charts._discard_pool(charts._pool)
+
+    def test_render_does_not_leave_pyplot_figures(self):
+        import matplotlib.pyplot as plt
+        before = plt.get_fignums()
+        for chart_type in ('#1', '#3'):
+            charts.render(chart_type, dict(self.series, ingredient_count=[3, 5]))
+        self.assertEqual(plt.get_fignums(), before)
+
+    @override_settings(CHART_RENDER_PROCESSES=1, CHART_RENDER_TIMEOUT=60)
+    def test_pool_renders_same_png_as_inline(self):
+        self.assertEqual(charts.render('#1', self.series), charts.render_chart('#1', self.series))
+
+    @override_settings(CHART_RENDER_PROCESSES=1, CHART_RENDER_TIMEOUT=0.001)
+    def test_timeout_discards_pool(self):
+        with self.assertRaises(charts.ChartRenderTimeout):
+            charts.render('#1', self.series)
+        self.assertIsNone(charts._pool)
+
+class ChartDataModeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='data_mode', password='password123')
+        Recipe.objects.bulk_create([Recipe(name=f"Stew {i}", cooking_time=i + 10, difficulty='intermediate') for i in range(100)])
+        Recipe.objects.create(name="Toast", cooking_time=3)
+
+    def setUp(self):
+        self.client.login(username='data_mode', password='password123')
+
+    def get(self, **params):
+        return self.client.get(reverse('recipes:chart_data'), params)
+
+    def test_json_is_downsampled_into_buckets(self):
+        data = self.get(q='stew', chart_type='#1', points=10).json()
+        self.assertEqual(data['points'], 100)
+        self.assertEqual(len(data['labels']), 10)
+        self.assertEqual(data['bucket'], 10)
+        self.assertEqual(len(data['series'][0]['values']), 10)
+
+    def test_small_results_are_not_bucketed(self):
+        data = self.get(q='toast', chart_type='#3').json()
+        self.assertEqual(data['labels'], ["Toast"])
+        self.assertEqual([s['values'] for s in data['series']], [[3], [0]])
+
+    def test_pie_is_aggregated_by_the_database(self):
+        with self.assertNumQueries(1):
+            series = series_from_queryset('#2', search_recipes(''))
+        self.assertEqual(series, {'labels': ['easy', 'intermediate'], 'counts': [1, 100]})
+        # The ranked full-text queryset must not leak its rank column into the GROUP BY
+        self.assertEqual(series_from_queryset('#2', search_recipes('stew')), {'labels': ['intermediate'], 'counts': [100]})
+
+    def test_svg_format(self):
+        response = self.get(chart_type='#1', format='svg')
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(response.content.startswith(b'<svg'))
+
+    def test_invalid_chart_type_is_rejected(self):
+        self.assertEqual(self.get(chart_type='#9').status_code, 400)
+
+    def test_data_lab_inlines_escaped_svg_by_default(self):
+        Recipe.objects.create(name="<b>Bold</b> Stew", cooking_time=5)
+        response = self.client.post(reverse('recipes:recipes_search'), {'recipe_name': 'bold', 'chart_type': '#1'})
+        self.assertIsNone(response.context['chart'])
+        self.assertIn('<svg', response.context['chart_svg'])
+        self.assertNotIn('<b>', response.context['chart_svg'])
+
+class StartupProfileTest(TestCase):
+    def test_boot_does_not_import_analytics_libraries(self):
+        out = StringIO()
+        call_command('startup_profile', stdout=out)
+        self.assertIn('Startup profile OK.', out.getvalue())
+
+    def test_forbidden_module_fails_the_check(self):
+        with self.assertRaisesMessage(CommandError, 'Imported at boot: django'):
+            call_command('startup_profile', forbid=['django'], stdout=StringIO())
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='exporter', password='password123')
+        cls.salad = Recipe.objects.create(name="Greek Salad", cooking_time=10)
+        cls.salad.set_ingredients(['feta', 'olive; oil'])
+        cls.toast = Recipe.objects.create(name="Toast, buttered", cooking_time=3)
+
+    def setUp(self):
+        self.client.login(username='exporter', password='password123')
+
+    def export(self, fmt, **params):
+        response = self.client.get(reverse('recipes:export', kwargs={'fmt': fmt}), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_lists_every_recipe_with_ingredients(self):
+        import csv
+        response, body = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(StringIO(body)))
+        self.assertEqual(rows[0], ['id', 'name', 'cooking_time', 'difficulty', 'ingredient_count', 'ingredients'])
+        self.assertEqual(rows[1][1], "Greek Salad")
+        self.assertEqual(sorted(rows[1][5].split('; ', 1)), ['feta', 'olive; oil'])
+        self.assertEqual(rows[2][1:], ["Toast, buttered", '3', 'easy', '0', ''])
+
+    def test_jsonl_keeps_ingredient_names_intact(self):
+        import json
+        _, body = self.export('jsonl')
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(sorted(records[0]['ingredients']), ['feta', 'olive; oil'])
+        self.assertEqual(records[1]['ingredients'], [])
+
+    def test_search_filter_matches_data_lab(self):
+        _, body = self.export('jsonl', q='feta')
+        self.assertEqual(len(body.splitlines()), 1)
+        self.assertIn('"Greek Salad"', body)
+
+    def test_rows_are_fetched_with_ingredients_in_one_query(self):
+        from .exports import export_rows
+        for i in range(5):
+            Recipe.objects.create(name=f"Soup {i}", cooking_time=30).set_ingredients(['water', f'herb {i}'])
+        with self.assertNumQueries(1):
+            rows = list(export_rows(Recipe.objects.order_by('pk'), chunk_size=2))
+        self.assertEqual(len(rows), 7)
+
+class ImportRecipesTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, filename, content):
+        path = os.path.join(self.tmp.name, filename)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_recipes', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_links_normalized_ingredients(self):
+        Ingredient.objects.create(name="salt")
+        path = self.write('catalog.csv', (
+            'name,cooking_time,ingredients\n'
+            'Omelette,8,Egg; Butter; SALT; egg\n'
+            'Roast Chicken,90,chicken;garlic;thyme;butter;salt\n'
+        ))
+        out, _ = self.run_import(path, batch_size=1)
+        self.assertIn('Imported 2 new and 0 updated recipes with 8 links', out)
+        omelette = Recipe.objects.get(name="Omelette")
+        self.assertEqual((omelette.ingredient_count, omelette.difficulty), (3, 'easy'))
+        self.assertEqual(Recipe.objects.get(name="Roast Chicken").difficulty, 'hard')
+        self.assertEqual(Ingredient.objects.filter(name='salt').count(), 1)
+        self.assertEqual(Ingredient.objects.count(), 6)
+        self.assertEqual(Recipe.objects.with_drift().count(), 0)
+        self.assertEqual(list(search_recipes('thyme').values_list('name', flat=True)), ["Roast Chicken"])
+
+    def test_existing_names_are_skipped_or_upserted(self):
+        Recipe.objects.create(name="Omelette", cooking_time=5).set_ingredients(['egg'])
+        path = self.write('catalog.jsonl', '{"name": "Omelette", "cooking_time": 12, "ingredients": ["egg", "milk", "chive", "salt"]}\n')
+
+        out, _ = self.run_import(path)
+        self.assertIn('Skipped 1 recipes that already exist', out)
+        self.assertEqual(Recipe.objects.get(name="Omelette").cooking_time, 5)
+
+        out, _ = self.run_import(path, upsert=True)
+        self.assertIn('Imported 0 new and 1 updated recipes with 4 links', out)
+        omelette = Recipe.objects.get(name="Omelette")
+        self.assertEqual((omelette.cooking_time, omelette.ingredient_count, omelette.difficulty), (12, 4, 'hard'))
+        self.assertEqual(omelette.ingredients.count(), 4)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        path = self.write('catalog.jsonl', (
+            '{"name": "Toast", "cooking_time": 3, "ingredients": ["bread"]}\n'
+            'not json\n'
+            '{"name": "", "cooking_time": 3}\n'
+            '{"name": "Tea", "cooking_time": "soon"}\n'
+        ))
+        out, err = self.run_import(path)
+        self.assertIn('Imported 1 new', out)
+        self.assertIn('Skipped 3 invalid rows', out)
+        self.assertIn('Line 2: invalid JSON', err)
+        self.assertIn('Line 4: cooking_time', err)
+
+    def test_wrongly_typed_rows_are_reported_and_skipped(self):
+        """Rows with non-string names, non-list ingredients or over-long ingredient names never reach the database."""
+        long_name = 'x' * (Ingredient._meta.get_field('name').max_length + 1)
+        path = self.write('catalog.jsonl', '\n'.join([
+            '{"name": 5, "cooking_time": 3, "ingredients": ["bread"]}',
+            '{"name": "Stew", "cooking_time": 3, "ingredients": 7}',
+            '{"name": "Brine", "cooking_time": 3, "ingredients": "salt"}',
+            '{"name": "Mix", "cooking_time": 3, "ingredients": ["salt", 4]}',
+            json.dumps({"name": "Long", "cooking_time": 3, "ingredients": [long_name]}),
+            '{"name": "Toast", "cooking_time": 3, "ingredients": ["bread"]}',
+        ]) + '\n')
+        out, err = self.run_import(path)
+        self.assertIn('Imported 1 new', out)
+        self.assertIn('Skipped 5 invalid rows', out)
+        self.assertIn('Line 1: name 5 is not a string', err)
+        self.assertIn('Line 3: ingredients must be a list of strings', err)
+        self.assertIn('Line 5: ingredient', err)
+        self.assertEqual(list(Ingredient.objects.values_list('name', flat=True)), ['bread'])
+
+# --- Legacy migration tests ---
+@skipUnless(sqlalchemy, 'SQLAlchemy is not installed')
+class MigrateLegacyRecipesTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'legacy.db')
+        self.url = f'sqlite:///{self.path}'
+        # Schema of cml-prototype/recipe_app.py
+        with sqlite3.connect(self.path) as legacy:
+            legacy.execute(
+                'CREATE TABLE recipes (id INTEGER PRIMARY KEY AUTOINCREMENT, name VARCHAR(50) NOT NULL, '
+                'ingredients VARCHAR(255), cooking_time INTEGER, difficulty VARCHAR(20))'
+            )
+        self.add_rows(
+            ('Omelette', 'Egg, Butter, salt', 8, 'Easy'),
+            ('Roast Chicken', 'chicken, garlic, thyme, butter, Salt', 90, 'Hard'),
+            ('Mystery', 'water', None, None),
+        )
+
+    def add_rows(self, *rows):
+        with sqlite3.connect(self.path) as legacy:
+            legacy.executemany('INSERT INTO recipes (name, ingredients, cooking_time, difficulty) VALUES (?, ?, ?, ?)', rows)
+
+    def migrate(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('migrate_legacy_recipes', self.url, chunk_size=2, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_migrates_in_chunks_and_normalizes_ingredients(self):
+        out, err = self.migrate()
+        self.assertIn('Migrated 3 rows up to id 3: 2 new and 0 updated recipes with 8 links', out)
+        self.assertIn('Row id 3: cooking_time None', err)
+        chicken = Recipe.objects.get(name="Roast Chicken")
+        self.assertEqual((chicken.ingredient_count, chicken.difficulty), (5, 'hard'))
+        self.assertEqual(Ingredient.objects.filter(name__in=['salt', 'butter']).count(), 2)
+        self.assertEqual(Recipe.objects.with_drift().count(), 0)
+        self.assertEqual(ImportCheckpoint.objects.get().last_id, 3)
+        self.assertNotIn(self.path, err)
+
+    def test_resumes_after_checkpoint(self):
+        self.migrate()
+        Recipe.objects.filter(name="Omelette").delete()     # Would come back if the old rows were read again
+        self.add_rows(('Omelette', 'egg, milk, chive, salt', 12, 'Hard'), ('Toast', 'bread', 3, 'Easy'))
+
+        out, _ = self.migrate()
+        self.assertIn('Migrated 2 rows up to id 5: 2 new and 0 updated', out)
+        self.assertEqual(Recipe.objects.get(name="Omelette").difficulty, 'hard')
+        self.assertIn('Nothing to migrate after id 5', self.migrate()[0])
+
+        out, _ = self.migrate(restart=True)
+        self.assertIn('Migrated 5 rows up to id 5: 0 new and 4 updated', out)
+        # Omelette is updated twice, by its old row and then by the later one, which wins again
+        self.assertEqual(Recipe.objects.get(name="Omelette").cooking_time, 12)
+        self.assertEqual(Recipe.objects.count(), 3)
+
 # --- Forms tests ---
 class RecipeSearchFormTest(TestCase):
     def test_form_renders_recipe_name_input(self):
@@ -183,4 +862,534 @@ class RecipeSearchFormTest(TestCase):
     def test_form_invalid_chart_type(self):
         """Ensure the form rejects chart types not defined in choices."""
         form = RecipeSearchForm(data={'recipe_name': 'Tea', 'chart_type': 'invalid_choice'})
-        self.assertFalse(form.is_valid())
\ No newline at end of file
+        self.assertFalse(form.is_valid())
+
+class ImageDerivativeTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = tmp.name
+        settings = override_settings(MEDIA_ROOT=self.media, MEDIA_URL='/media/')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username='cook', password='pw')
+        self.client.login(username='cook', password='pw')
+
+    def upload(self, name, size):
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        buffer = BytesIO()
+        Image.new('RGB', size, (200, 120, 40)).save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media, name))
+
+    def run_worker(self):
+        call_command('run_worker', burst=True, stdout=StringIO())
+
+    def test_upload_creates_derivatives_and_templates_use_srcset(self):
+        recipe = Recipe.objects.create(name="Syrniki", cooking_time=20, image=self.upload('syrniki.jpg', (1200, 800)))
+        self.assertEqual(QueuedTask.objects.get().task_path, 'recipes.tasks.sync_image_derivatives')
+        cards = self.client.get(reverse('recipes:recipe_cards')).json()['html']
+        self.assertIn('src="/media/recipes/syrniki.jpg"', cards)    # The original until the worker has run
+
+        self.run_worker()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_derivatives, {'source': 'recipes/syrniki.jpg', 'widths': [480, 960, 1200]})   # Never upscaled
+        for name in ('syrniki-480w.webp', 'syrniki-480w.jpg', 'syrniki-1200w.webp'):
+            self.assertTrue(self.exists(f'recipes/derivatives/{name}'))
+
+        cards = self.client.get(reverse('recipes:recipe_cards')).json()['html']
+        self.assertIn('type="image/webp" srcset="/media/recipes/derivatives/syrniki-480w.webp 480w,', cards)
+        self.assertIn('src="/media/recipes/derivatives/syrniki-480w.jpg"', cards)
+        self.assertIn('loading="lazy"', cards)
+        self.assertNotIn('/media/recipes/syrniki.jpg', cards)
+        detail = self.client.get(reverse('recipes:recipe_detail', args=[recipe.pk])).content.decode()
+        self.assertIn('src="/media/recipes/derivatives/syrniki-1200w.jpg"', detail)
+        self.assertIn('fetchpriority="high"', detail)
+
+    def test_replacing_the_image_regenerates_and_removes_old_files(self):
+        recipe = Recipe.objects.create(name="Tea", cooking_time=5, image=self.upload('tea.jpg', (600, 400)))
+        self.run_worker()
+        recipe.refresh_from_db()
+        recipe.cooking_time = 6
+        recipe.save()                           # Same image: nothing is queued
+        self.assertEqual(QueuedTask.objects.filter(status='READY').count(), 0)
+        self.assertEqual(recipe.image_derivatives['widths'], [480, 600])
+
+        recipe.image = self.upload('green_tea.png', (300, 300))
+        recipe.save()
+        self.run_worker()
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).image_derivatives, {'source': 'recipes/green_tea.png', 'widths': [300]})
+        self.assertTrue(self.exists('recipes/derivatives/green_tea-300w.webp'))
+        self.assertFalse(self.exists('recipes/derivatives/tea-480w.webp'))
+
+        ingredient = Ingredient.objects.create(name="Mint", image=self.upload('mint.jpg', (800, 800)))
+        self.run_worker()
+        ingredient.refresh_from_db()
+        self.assertEqual(ingredient.image_derivatives['widths'], [480, 800])
+
+    def test_backfill_command(self):
+        recipe = Recipe.objects.create(name="Pasta", cooking_time=15, image=self.upload('pasta.jpg', (1000, 500)))
+        Recipe.objects.filter(pk=recipe.pk).update(image_derivatives={})   # Uploaded before the pipeline existed
+        Recipe.objects.bulk_create([Recipe(name="Lost", cooking_time=5, difficulty='easy', image='recipes/lost.jpg')])
+
+        out, err = StringIO(), StringIO()
+        call_command('generate_image_derivatives', stdout=out, stderr=err)
+        self.assertIn('Generated derivatives for 1 images', out.getvalue())
+        self.assertIn('Skipped 1 unreadable images', out.getvalue())
+        self.assertIn('recipes/lost.jpg', err.getvalue())
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).image_derivatives['widths'], [480, 960, 1000])
+
+        out = StringIO()
+        call_command('generate_image_derivatives', model=['recipes'], stdout=out, stderr=StringIO())
+        self.assertIn('Generated derivatives for 0 images in', out.getvalue())
+        self.assertIn('1 already up to date', out.getvalue())
+
+# Module-level tasks for the queue tests (django.tasks only accepts module-level functions)
+@task(takes_context=True)
+def flaky_task(context, failures):
+    if context.attempt <= failures:
+        raise ValueError(f'attempt {context.attempt} failed')
+    return context.attempt
+
+@task
+def record_task(label):
+    return label
+
+class TaskQueueTest(TestCase):
+    def run_worker(self, **options):
+        out = StringIO()
+        call_command('run_worker', burst=True, stdout=out, **options)
+        return out.getvalue()
+
+    def test_tasks_run_by_priority_and_store_results(self):
+        low = record_task.enqueue('low')
+        high = record_task.using(priority=10).enqueue('high')
+        self.assertEqual(low.status, 'READY')
+        self.assertIn('2 tasks run', self.run_worker())
+
+        low.refresh()
+        self.assertEqual((low.status, low.return_value, low.attempts), ('SUCCESSFUL', 'low', 1))
+        rows = QueuedTask.objects.order_by('started_at')
+        self.assertEqual([row.args for row in rows], [['high'], ['low']])
+        self.assertEqual(record_task.get_result(high.id).return_value, 'high')
+
+    def test_failed_attempts_are_retried_with_backoff(self):
+        from django.utils import timezone
+        result = flaky_task.enqueue(1)
+        self.run_worker()
+        row = QueuedTask.objects.get()
+        self.assertEqual((row.status, len(row.errors)), ('READY', 1))
+        self.assertGreater(row.run_after, timezone.now())               # Not due yet
+        self.assertIn('0 tasks run', self.run_worker())
+
+        QueuedTask.objects.update(run_after=timezone.now())
+        self.run_worker()
+        result.refresh()
+        self.assertEqual((result.status, result.return_value, result.attempts), ('SUCCESSFUL', 2, 2))
+        self.assertEqual(result.errors[0].exception_class, ValueError)
+
+        result = flaky_task.enqueue(5)
+        for _ in range(3):                      # MAX_ATTEMPTS
+            QueuedTask.objects.filter(pk=result.id).update(run_after=timezone.now())
+            self.run_worker()
+        result.refresh()
+        self.assertEqual((result.status, result.attempts), ('FAILED', 3))
+
+    def test_abandoned_tasks_are_requeued(self):
+        from datetime import timedelta
+        from django.tasks import default_task_backend
+        from django.utils import timezone
+        record_task.enqueue('crashed')
+        QueuedTask.objects.update(status='RUNNING', last_attempted_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(default_task_backend.requeue_abandoned(), 1)
+        self.assertIn('1 tasks run', self.run_worker())
+
+    def test_abandoned_last_attempt_fails_the_task(self):
+        """A run lost to a dead worker counts as an attempt, so a task that keeps killing its worker stops."""
+        from datetime import timedelta
+        from django.tasks import default_task_backend
+        from django.utils import timezone
+        result = record_task.enqueue('crashes')
+        QueuedTask.objects.update(
+            status='RUNNING', worker_ids=['a', 'b', 'c'], last_attempted_at=timezone.now() - timedelta(hours=1),  # MAX_ATTEMPTS
+        )
+        self.assertEqual(default_task_backend.requeue_abandoned(), 1)
+        self.assertIn('0 tasks run', self.run_worker())
+        result.refresh()
+        self.assertEqual((result.status, result.attempts), ('FAILED', 3))
+        self.assertEqual(result.errors[0].exception_class_path, 'recipes.task_queue.WorkerLost')
+        self.assertIsNotNone(result.finished_at)
+
+    @override_settings(DIFFICULTY_INLINE_LIMIT=1)
+    def test_large_difficulty_recompute_is_queued(self):
+        salt = Ingredient.objects.create(name="salt")
+        recipes = [Recipe.objects.create(name=name, cooking_time=5) for name in ("Soup", "Stew")]
+        for recipe in recipes:
+            recipe.set_ingredients(['salt', 'water', 'onion', 'carrot'])
+        self.assertEqual(Recipe.objects.get(name="Soup").difficulty, 'medium')
+
+        salt.delete()
+        self.assertEqual(Recipe.objects.get(name="Soup").ingredient_count, 4)  # Stale until the worker runs
+        self.assertEqual(QueuedTask.objects.get().task_path, 'recipes.tasks.recompute_difficulty')
+        self.run_worker()
+        self.assertEqual(Recipe.objects.with_drift().count(), 0)
+        self.assertEqual(Recipe.objects.get(name="Soup").difficulty, 'easy')
+
+    @override_settings(TASKS={'default': {'BACKEND': 'django.tasks.backends.immediate.ImmediateBackend'}})
+    def test_worker_needs_a_database_backend(self):
+        with self.assertRaises(CommandError):
+            self.run_worker()
+
+class TaskQueueConcurrencyTest(TransactionTestCase):
+    def test_worker_threads_run_each_task_once(self):
+        for label in range(40):
+            record_task.enqueue(label)
+        out = StringIO()
+        call_command('run_worker', burst=True, concurrency=4, stdout=out)
+        self.assertIn('40 tasks run', out.getvalue())
+        self.assertEqual(QueuedTask.objects.filter(status='SUCCESSFUL').count(), 40)
+        self.assertTrue(all(len(row.worker_ids) == 1 for row in QueuedTask.objects.all()))
+
+class PageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='regular', password='password123')
+        cls.other = User.objects.create_user(username='visitor', password='password123')
+        cls.staff = User.objects.create_user(username='manager', password='password123', is_staff=True)
+        cls.recipe = Recipe.objects.create(name="Borscht", cooking_time=90)
+        cls.recipe.set_ingredients(['beet', 'cabbage'])
+
+    def setUp(self):
+        caches['pages'].clear()
+        self.client.login(username='regular', password='password123')
+
+    def test_repeat_request_is_served_from_cache(self):
+        url = reverse('recipes:recipes_list')
+        first = self.client.get(url)
+        with CaptureQueriesContext(connection) as hit:
+            second = self.client.get(url)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first.content, second.content)
+        self.assertIn('private', second['Cache-Control'])
+        self.assertLess(len(hit.captured_queries), 4)      # Session, user and versions; no catalog queries
+
+    def test_writes_invalidate_the_pages(self):
+        list_url = reverse('recipes:recipes_list')
+        detail_url = reverse('recipes:recipe_detail', args=[self.recipe.pk])
+        self.client.get(list_url)
+        self.client.get(detail_url)
+
+        Recipe.objects.create(name="Vareniki", cooking_time=40)
+        response = self.client.get(list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Vareniki')
+
+        Ingredient.objects.filter(name='beet').update(name='beetroot')     # Bulk path, no save()
+        response = self.client.get(detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'beetroot')
+
+    def test_cached_page_shows_the_current_user(self):
+        url = reverse('ingredients:ingredients_index')
+        self.client.get(url)
+        self.client.login(username='visitor', password='password123')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'Hello, visitor')
+        self.assertNotContains(response, 'regular')
+
+    def test_anonymous_requests_are_redirected_not_cached(self):
+        url = reverse('recipes:recipes_list')
+        self.client.get(url)
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_stats_report_hit_ratio_and_invalidations(self):
+        url = reverse('recipes:recipes_list')
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(url)
+        Recipe.objects.filter(pk=self.recipe.pk).update(cooking_time=60)
+        self.assertEqual(self.client.get(reverse('recipes:cache_stats')).status_code, 302)    # Staff only
+
+        bumps = CatalogVersion.objects.get(name='recipes').bumps
+        self.client.login(username='manager', password='password123')
+        stats = self.client.get(reverse('recipes:cache_stats')).json()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio']), (2, 1, 0.6667))
+        self.assertEqual(stats['invalidations']['recipes'], bumps)
+        self.assertGreater(bumps, 0)
+
+class FragmentCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='taster', password='password123')
+        cls.recipes = [Recipe.objects.create(name=f"Pelmeni {i}", cooking_time=20 + i) for i in range(3)]
+
+    def setUp(self):
+        caches['fragments'].clear()
+        caches['pages'].clear()
+
+    def cards(self):
+        return render_fragments(Recipe.objects.order_by('pk'), 'recipes/recipe_card.html', 'recipe')
+
+    def test_one_cache_lookup_per_page_and_only_changed_cards_rerender(self):
+        self.assertEqual(self.cards().rendered, 3)
+        with mock.patch.object(caches['fragments'], 'get_many', wraps=caches['fragments'].get_many) as get_many:
+            cards = self.cards()
+        get_many.assert_called_once()
+        self.assertEqual(cards.rendered, 0)
+        self.assertEqual(str(cards).count('recipe-item'), 3)
+
+        self.recipes[0].cooking_time = 95
+        self.recipes[0].save(update_fields=['cooking_time'])
+        Recipe.objects.filter(pk=self.recipes[1].pk).update(cooking_time=96)     # Bulk path, no save()
+        cards = self.cards()
+        self.assertEqual(cards.rendered, 2)
+        self.assertIn('95 minutes', cards[self.recipes[0].pk])
+        self.assertIn('96 minutes', cards[self.recipes[1].pk])
+
+    def test_ingredient_pill_follows_recipe_count(self):
+        self.client.login(username='taster', password='password123')
+        url = reverse('ingredients:ingredients_index')
+        Ingredient.objects.create(name="dill")
+        self.assertContains(self.client.get(url), '<span class="usage-count">0</span>', html=False)
+        self.recipes[0].set_ingredients(['dill'])
+        self.assertContains(self.client.get(url), '<span class="usage-count">1</span>', html=False)
+
+# A view with the classic N+1: one COUNT per recipe
+def count_per_recipe(request):
+    return HttpResponse(str([recipe.ingredients.count() for recipe in Recipe.objects.all()]))
+
+urlpatterns = [path('n-plus-one/', count_per_recipe, name='n_plus_one'), path('recipes/', include('recipes.urls'))]
+
+@override_settings(REQUEST_PROFILING=True, N_PLUS_ONE_THRESHOLD=3)
+class RequestProfilingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='profiler', password='password123')
+        for i in range(4):
+            Recipe.objects.create(name=f"Blini {i}", cooking_time=15)
+
+    def setUp(self):
+        caches['pages'].clear()
+        self.client.login(username='profiler', password='password123')
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs('recipes.requests', 'INFO') as logs:
+            response = self.client.get(reverse('recipes:recipes_list'))
+        self.assertRegex(response['Server-Timing'], r'^sql;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+;desc="Templates", total;dur=')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['view'], record['status'], record['n_plus_one']), ('recipes:recipes_list', 200, 0))
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+    @override_settings(ROOT_URLCONF='recipes.tests')
+    def test_repeated_queries_are_flagged_with_the_view(self):
+        with self.assertLogs('recipes.requests', 'INFO') as logs:
+            self.client.get('/n-plus-one/')
+        self.assertEqual(json.loads(logs.records[0].getMessage())['n_plus_one'], 1)
+        warning = logs.records[1]
+        self.assertEqual((warning.levelname, warning.view, warning.query_count), ('WARNING', 'n_plus_one', 4))
+        self.assertIn('COUNT(', warning.shape)
+
+    def test_streaming_response_is_logged_when_the_body_is_done(self):
+        with self.assertNoLogs('recipes.requests', 'INFO'):
+            response = self.client.get(reverse('recipes:export', args=['csv']))
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        with self.assertLogs('recipes.requests', 'INFO') as logs:
+            body = b''.join(response.streaming_content)
+        self.assertEqual(body.count(b'Blini'), 4)
+        self.assertEqual(json.loads(logs.records[0].getMessage())['view'], 'recipes:export')
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_off_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('recipes:recipes_list')))
+
+class SeedAndBenchmarkCommandTest(TestCase):
+    def test_seed_catalog_bulk_inserts_linked_recipes(self):
+        out = StringIO()
+        call_command('seed_catalog', recipes=40, ingredients=15, links_per_recipe=3, stdout=out)
+        self.assertIn('Seeded 40 recipes', out.getvalue())
+        self.assertEqual((Recipe.objects.count(), Ingredient.objects.count()), (40, 15))
+        self.assertEqual(set(Recipe.objects.values_list('ingredient_count', flat=True)), {3})
+        self.assertFalse(Recipe.objects.with_drift().exists())
+
+    def test_benchmark_writes_comparable_results_and_rolls_back(self):
+        import os, tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        first, second = os.path.join(tmp.name, 'first.json'), os.path.join(tmp.name, 'second.json')
+        options = {'sizes': [30], 'ingredients': 20, 'links_per_recipe': 3, 'repeat': 3}
+        call_command('benchmark_views', output=first, stdout=StringIO(), **options)
+        out = StringIO()
+        call_command('benchmark_views', output=second, compare=first, scenario=['recipes_list', 'recipes_search#2'],
+                     stdout=out, **options)
+
+        with open(second) as f:
+            results = json.load(f)['results']
+        self.assertEqual([(r['size'], r['scenario']) for r in results], [(30, 'recipes_list'), (30, 'recipes_search#2')])
+        self.assertTrue(all(r['queries'] > 0 and r['p50_ms'] <= r['p99_ms'] for r in results))
+        self.assertIn('% vs', out.getvalue())
+        self.assertEqual(Recipe.objects.count(), 0)         # The synthetic catalog and the benchmark user are rolled back
+        self.assertFalse(User.objects.filter(username__startswith='benchmark-').exists())
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='revisitor', password='password123')
+        cls.other = User.objects.create_user(username='neighbour', password='password123')
+        cls.recipe = Recipe.objects.create(name="Solyanka", cooking_time=60)
+        cls.ingredient = Ingredient.objects.create(name="olive")
+
+    def setUp(self):
+        caches['pages'].clear()
+        self.client.login(username='revisitor', password='password123')
+
+    def test_unchanged_page_is_a_304_without_catalog_queries(self):
+        url = reverse('recipes:recipe_detail', args=[self.recipe.pk])
+        first = self.client.get(url)
+        self.assertIn('no-cache', first['Cache-Control'])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, headers={'if-none-match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+        self.assertFalse([q for q in ctx.captured_queries if 'recipes_recipe' in q['sql']])
+
+        response = self.client.get(url, headers={'if-modified-since': first['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_link_change_and_other_user_get_the_full_page(self):
+        url = reverse('ingredients:ingredients_index')
+        etag = self.client.get(url)['ETag']
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=self.ingredient)
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.client.login(username='neighbour', password='password123')
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Hello, neighbour')
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_works_with_the_page_cache_off(self):
+        url = reverse('recipes:recipes_list')
+        first = self.client.get(url)
+        self.assertEqual(first['X-Cache'], 'BYPASS')
+        self.assertContains(first, 'Hello, revisitor')
+        self.assertEqual(self.client.get(url, headers={'if-none-match': first['ETag']}).status_code, 304)
+
+@override_settings(PANTRY_REFRESH_INTERVAL=0)
+class PantryTest(TestCase):
+    def setUp(self):
+        reset_pantry_index()
+        self.omelette = Recipe.objects.create(name='Omelette', cooking_time=5)
+        self.pancakes = Recipe.objects.create(name='Pancakes', cooking_time=15)
+        self.salad = Recipe.objects.create(name='Salad', cooking_time=5)
+        self.omelette.set_ingredients(['eggs', 'butter', 'salt'])
+        self.pancakes.set_ingredients(['eggs', 'flour', 'milk', 'butter'])
+        self.salad.set_ingredients(['lettuce', 'salt'])
+        self.ids = dict(Ingredient.objects.values_list('name', 'pk'))
+
+    def pantry(self, *names):
+        return {self.ids[name] for name in names}
+
+    def cook(self, *names, **options):
+        return [(row['id'], row['have'], row['missing']) for row in what_can_i_cook(self.pantry(*names), **options)['results']]
+
+    def test_ranked_by_fewest_missing_then_most_used(self):
+        self.assertEqual(self.cook('eggs', 'butter', 'salt'), [
+            (self.omelette.pk, 3, 0), (self.salad.pk, 1, 1), (self.pancakes.pk, 2, 2),
+        ])
+
+    def test_contains_all_and_missing_at_most(self):
+        self.assertEqual(self.cook('eggs', 'butter', mode='all'), [(self.omelette.pk, 2, 1), (self.pancakes.pk, 2, 2)])
+        self.assertEqual(self.cook('eggs', 'lettuce', mode='all'), [])
+        self.assertEqual(self.cook('eggs', 'butter', 'salt', mode='missing', max_missing=1), [
+            (self.omelette.pk, 3, 0), (self.salad.pk, 1, 1),
+        ])
+
+    def test_index_and_database_agree(self):
+        index = PantryIndex.build(token=0)
+        for names in (('eggs',), ('salt', 'milk'), ('eggs', 'butter', 'flour', 'milk', 'lettuce')):
+            for mode in ('rank', 'all', 'missing'):
+                self.assertEqual(index.query(self.pantry(*names), mode, 1, 2), pantry_database(self.pantry(*names), mode, 1, 2))
+
+    def test_link_changes_refresh_only_the_changed_recipes(self):
+        self.cook('salt')                       # Builds the index
+        self.salad.set_ingredients(['lettuce', 'salt', 'eggs'])
+        soup = Recipe.objects.create(name='Soup', cooking_time=30)
+        RecipeIngredient.objects.create(recipe=soup, ingredient_id=self.ids['salt'])
+        with self.assertNumQueries(4):          # Version check, changed recipes, recipe count, their links
+            self.assertEqual(self.cook('salt', 'lettuce'), [
+                (soup.pk, 1, 0), (self.salad.pk, 2, 1), (self.omelette.pk, 1, 2),
+            ])
+        self.omelette.delete()                  # A delete rebuilds the index
+        self.assertEqual(self.cook('eggs', mode='all'), [(self.salad.pk, 1, 2), (self.pancakes.pk, 1, 3)])
+
+    def test_view(self):
+        User.objects.create_user(username='home_cook', password='password123')
+        self.client.login(username='home_cook', password='password123')
+        url = reverse('recipes:pantry')
+        response = self.client.get(url, {'ingredients': 'Eggs, butter\nsalt, truffle'})
+        self.assertContains(response, '3 recipes')
+        self.assertContains(response, 'Still needed: flour, milk')
+        self.assertContains(response, 'Not in any recipe: truffle')
+        data = self.client.get(url, {'ingredients': 'eggs', 'mode': 'all', 'format': 'json'}).json()
+        self.assertEqual((data['total'], data['unknown']), (2, []))
+        self.assertEqual(self.client.get(url, {'ingredients': ' , ', 'format': 'json'}).status_code, 400)
+
+class SimilarityTest(TestCase):
+    def setUp(self):
+        self.carbonara = Recipe.objects.create(name='Carbonara', cooking_time=20)
+        self.gricia = Recipe.objects.create(name='Gricia', cooking_time=15)
+        self.amatriciana = Recipe.objects.create(name='Amatriciana', cooking_time=25)
+        self.trifle = Recipe.objects.create(name='Trifle', cooking_time=60)
+        self.carbonara.set_ingredients(['spaghetti', 'guanciale', 'pecorino', 'eggs', 'pepper'])
+        self.gricia.set_ingredients(['spaghetti', 'guanciale', 'pecorino', 'pepper'])
+        self.amatriciana.set_ingredients(['spaghetti', 'guanciale', 'pecorino', 'tomato'])
+        self.trifle.set_ingredients(['sponge', 'custard', 'cream', 'berries'])
+        call_command('build_similarity_index', stdout=StringIO())
+
+    def test_signature_agreement_estimates_jaccard(self):
+        pairs = [(1, i) for i in range(100)] + [(2, i) for i in range(50, 150)]      # Jaccard 50/150
+        first, second = signatures(pairs).values()
+        self.assertAlmostEqual((first == second).mean(), 1 / 3, delta=0.1)
+
+    def test_neighbours_ranked_by_exact_jaccard(self):
+        self.assertEqual(find_similar(self.carbonara.pk, 5), [(self.gricia.pk, 0.8), (self.amatriciana.pk, 0.5)])
+        self.assertEqual(find_similar(self.trifle.pk, 5), [])
+
+    def test_link_changes_mark_the_recipe_stale_until_refreshed(self):
+        self.assertFalse(stale_recipes().exists())
+        self.trifle.set_ingredients(['spaghetti', 'guanciale', 'pecorino', 'eggs', 'pepper', 'cream'])
+        self.assertEqual(list(stale_recipes()), [self.trifle])
+        from .tasks import refresh_similarity
+        self.assertEqual(refresh_similarity.call(), 1)
+        self.assertEqual(find_similar(self.carbonara.pk, 1), [(self.trifle.pk, round(5 / 6, 4))])
+
+    def test_writes_queue_one_delayed_refresh(self):
+        caches['default'].delete(REFRESH_QUEUED_KEY)
+        with self.captureOnCommitCallbacks() as callbacks:
+            RecipeIngredient.objects.create(recipe=self.trifle, ingredient=Ingredient.objects.get(name='eggs'))
+        self.assertIn(schedule_refresh, callbacks)
+        schedule_refresh()
+        schedule_refresh()
+        task = QueuedTask.objects.get()
+        self.assertEqual(task.task_path, 'recipes.tasks.refresh_similarity')
+        self.assertGreater(task.run_after, task.enqueued_at)
+
+    def test_detail_page_lists_cached_neighbours(self):
+        User.objects.create_user(username='taster', password='password123')
+        self.client.login(username='taster', password='password123')
+        caches['pages'].clear()
+        response = self.client.get(reverse('recipes:recipe_detail', args=[self.gricia.pk]))
+        self.assertContains(response, 'Similar Recipes')
+        self.assertEqual([other for other, _ in response.context['similar']], [self.carbonara, self.amatriciana])
+        token = CatalogVersion.current('similarity')['similarity'][0]
+        with self.assertNumQueries(0):          # Served from the neighbour cache until the index changes
+            similar_recipes(self.gricia.pk, token)
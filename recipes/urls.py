@@ -1,16 +1,35 @@
 # recipes/urls.py
-from django.urls import path
-from .views import RecipesListView, RecipeDetailView, records
+from django.urls import path, re_path
+from .views import RecipesListView, RecipeCardsView, RecipeDetailView, records, chart_image, chart_data, export_recipes, pantry
+from .page_cache import cache_stats
 
 app_name = 'recipes'
 
 urlpatterns = [
     # This becomes: http://127.0.0.1:8000/recipes/list/
     path('list/', RecipesListView.as_view(), name='recipes_list'),
+
+    # JSON partial with the next page of recipe cards: http://127.0.0.1:8000/recipes/list/cards/?q=<prefix>&after=<cursor>
+    path('list/cards/', RecipeCardsView.as_view(), name='recipe_cards'),
     
     # This becomes: http://127.0.0.1:8000/recipes/recipe/<id>/
     path('recipe/<int:pk>/', RecipeDetailView.as_view(), name='recipe_detail'),
 
+    # Recipes ranked by the ingredients already at hand: http://127.0.0.1:8000/recipes/pantry/?ingredients=eggs,%20flour
+    path('pantry/', pantry, name='pantry'),
+
     # Data Lab / Search view. This becomes: http://127.0.0.1:8000/recipes/search/
     path('search/', records, name='recipes_search'),
-]
\ No newline at end of file
+
+    # Cached Data Lab chart, addressed by the SHA-256 of its content: http://127.0.0.1:8000/recipes/chart/<hash>.png
+    re_path(r'^chart/(?P<key>[0-9a-f]{64})\.png$', chart_image, name='chart'),
+
+    # Chart series as JSON or SVG: http://127.0.0.1:8000/recipes/chart/data/?q=<term>&chart_type=%231&format=json
+    path('chart/data/', chart_data, name='chart_data'),
+
+    # Streaming dumps of the catalog: http://127.0.0.1:8000/recipes/export.csv or /recipes/export.jsonl (?q=<term> filters)
+    re_path(r'^export\.(?P<fmt>csv|jsonl)$', export_recipes, name='export'),
+
+    # Page cache hit ratio and invalidation counts (staff only): http://127.0.0.1:8000/recipes/cache/stats/
+    path('cache/stats/', cache_stats, name='cache_stats'),
+]
@@ -1,70 +1,75 @@
 # recipe/utils.py
 # Utility functions for the recipes app
-from io import BytesIO 
-import base64
-import matplotlib.pyplot as plt
-import pandas as pd
+from collections import Counter
+from html import escape
+import hashlib
+import json
+from django.core.cache import caches
+from django.db.models import Count
 from django.shortcuts import reverse
+from django.utils.safestring import mark_safe
+from .charts import ChartRenderTimeout, render
+from .instrumentation import timed
 
-# Helper function to convert graph to base64 string
-def get_graph():
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    graph = base64.b64encode(image_png)
-    graph = graph.decode('utf-8')
-    buffer.close()
-    return graph
+# The exact series a chart type plots, as plain lists. Two searches with equal series share one rendered chart.
+def chart_series(chart_type, data):
+    if chart_type == '#2':
+        # Only the difficulty distribution matters for the pie chart, not which recipes produced it
+        counts = sorted(Counter(data['difficulty']).items())
+        return {'labels': [level for level, _ in counts], 'counts': [count for _, count in counts]}
+    series = {'labels': list(data['name']), 'cooking_time': [int(value) for value in data['cooking_time']]}
+    if chart_type == '#3':
+        series['ingredient_count'] = [int(value) for value in data['ingredient_count']]
+    return series
 
-# Main function to generate charts based on selection
-def get_chart(chart_type, data, **kwargs):
-    # Switch plot backend to Anti-Grain Geometry to avoid main thread issues
-    plt.switch_backend('AGG')
-    fig = plt.figure(figsize=(6,4))
-
-    # Truncate recipe names to 18 characters followed by '...'
-    truncated_names = [
-        (name[:18] + '...') if len(name) > 18 else name 
-        for name in data['name']
-    ]
+# Same series straight from a queryset, fetching only the columns the chart needs.
+# The pie chart is aggregated by the database, so its cost does not grow with the number of recipes.
+def series_from_queryset(chart_type, queryset):
+    if chart_type == '#2':
+        counts = queryset.order_by().values('difficulty').annotate(count=Count('pk')).order_by('difficulty')
+        return {'labels': [row['difficulty'] for row in counts], 'counts': [row['count'] for row in counts]}
+    columns = ['name', 'cooking_time'] + (['ingredient_count'] if chart_type == '#3' else [])
+    rows = list(queryset.values_list(*columns))
+    return chart_series(chart_type, dict(zip(columns, zip(*rows))) if rows else {column: [] for column in columns})
 
-    if chart_type == '#1':
-        # Bar Chart: Cooking Time Comparison
-        plt.bar(truncated_names, data['cooking_time'], color='#e67e22')
-        #plt.xlabel('Recipe Name')
-        plt.ylabel('Cooking Time (min)')
-        plt.title('Cooking Time Comparison')
-        plt.xticks(rotation=45, ha='right')         # Tilt labels 45 degrees
+# Content address of a chart: SHA-256 of the chart type and its series
+def chart_key(chart_type, series):
+    payload = json.dumps([chart_type, series], separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
 
-    elif chart_type == '#2':
-        # Pie Chart: Difficulty Distribution
-        # count occurrences of each difficulty level
-        diff_counts = data['difficulty'].value_counts()
-        plt.pie(diff_counts, labels=diff_counts.index, autopct='%1.1f%%', startangle=140)
-        plt.title('Difficulty Distribution')
+# Main function to generate charts based on selection. Returns the URL of the PNG, which is rendered only
+# when the same chart type and series are not already in the 'charts' cache (LRU-bounded, see settings.CACHES).
+# Returns None when rendering timed out, so the results are shown without a chart.
+def get_chart(chart_type, data, **kwargs):
+    series = chart_series(chart_type, data)
+    key = chart_key(chart_type, series)
+    cache = caches['charts']
+    if cache.get(key) is None:
+        try:
+            with timed('chart'):
+                png = render(chart_type, series)
+            cache.set(key, png)
+        except ChartRenderTimeout:
+            return None
+    return reverse('recipes:chart', kwargs={'key': key})
 
-    elif chart_type == '#3':
-        # Line Chart: Ingredients vs Time
-        # We need the count of ingredients which is a ManyToMany relationship
-        # This assumes 'ingredient_count' was added to the dataframe in the view
-        plt.plot(truncated_names, data['cooking_time'], marker='o', label='Cooking Time')
-        plt.plot(truncated_names, data['ingredient_count'], marker='s', label='Ingredient Count')
-        #plt.xlabel('Recipes')
-        plt.title('Complexity Trends')
-        plt.legend()
-        plt.xticks(rotation=45, ha='right')         # Tilt labels 45 degrees
-    
-    plt.tight_layout()
-    chart = get_graph()
-    return chart
+# Resolves the detail URL once and splits it around the pk, e.g. ('/recipes/recipe/', '/'), so that a results
+# table of any size builds its links by concatenation instead of calling reverse() for every row
+def detail_url_parts():
+    prefix, _, suffix = reverse('recipes:recipe_detail', kwargs={'pk': 0}).rpartition('0')
+    return prefix, suffix
 
-# Function to transform recipe names into clickable links
-def get_recipe_links(data):
-    # This iterates through the dataframe and replaces the name 
-    # with an HTML anchor tag pointing to the detail view
-    for index, row in data.iterrows():
-        recipe_id = row['id']
-        url = reverse('recipes:recipe_detail', kwargs={'pk': recipe_id})
-        data.at[index, 'name'] = f'<a href="{url}" class="text-decoration-none text-primary font-weight-bold">{row["name"]}</a>'
-    return data
\ No newline at end of file
+# Table rows for Data Lab results in one pass over (id, name, cooking_time, difficulty, ingredient_count)
+# tuples, yielded as escaped HTML chunks of `chunk_size` rows. One format call per row is far cheaper
+# than a template loop with five variables per row.
+def result_rows(rows, chunk_size=500):
+    prefix, suffix = detail_url_parts()
+    row = (
+        '<tr><td><a href="{}{}{}" class="text-decoration-none text-primary font-weight-bold">{}</a></td>'
+        '<td>{}</td><td>{}</td><td>{}</td></tr>\n'
+    )
+    for start in range(0, len(rows), chunk_size):
+        yield mark_safe(''.join(
+            row.format(prefix, recipe_id, suffix, escape(name), cooking_time, escape(difficulty or ''), ingredient_count)
+            for recipe_id, name, cooking_time, difficulty, ingredient_count in rows[start:start + chunk_size]
+        ))
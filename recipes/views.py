@@ -1,79 +1,194 @@
 # recipes/views.py
 # Views for the recipes app
 
-import pandas as pd
+from django.conf import settings
 from django.shortcuts import render
-from django.db import models
+from django.core.cache import caches
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.views.generic import ListView, DetailView           # Import ListView and DetailView for class-based views
 from django.contrib.auth.mixins import LoginRequiredMixin       # For protecting Class-based views
 from django.contrib.auth.decorators import login_required       # For protecting function-based views
-from .models import Recipe
-from .forms import RecipeSearchForm
-from .utils import get_chart, get_recipe_links
+from ingredients.models import Ingredient
+from .models import Recipe, RecipeIngredient
+from .forms import PantryForm, RecipeSearchForm
+from .utils import chart_series, get_chart, result_rows, series_from_queryset
+from .charts import MAX_POINTS, chart_payload, render_svg
+from .pagination import filter_name_prefix, keyset_page
+from .search import get_search_backend
+from .exports import FORMATS, export_rows
+from .page_cache import CachedPageMixin
+from .instrumentation import timed
+from .similarity import similar_recipes
 
-# Class-based views for listing recipes and showing recipe details
-class RecipesListView(LoginRequiredMixin, ListView):            # Class-based view to display a list of recipes
+# Class-based views for listing recipes and showing recipe details.
+# CachedPageMixin serves repeat requests from the page cache until the catalog changes (recipes/page_cache.py).
+class RecipesListView(LoginRequiredMixin, CachedPageMixin, ListView):            # Class-based view to display a list of recipes
     model = Recipe                                              # specify the model to use for this view
     template_name = 'recipes/recipes_list.html'                 # specify the template to render
     context_object_name = 'recipes'                             # specify the context variable name to use in the template
+    page_size = 24                                              # number of cards per keyset page
 
-class RecipeDetailView(LoginRequiredMixin, DetailView):         # Class-based view to display details of a single recipe
+    # Filter by name prefix (?q=) on the server instead of hiding cards in the browser
+    def get_queryset(self):
+        return filter_name_prefix(Recipe.objects.all(), self.request.GET.get('q', ''))
+
+    # Keyset pagination: ?sort=name|id and ?after=<cursor> replace OFFSET paging
+    def get_context_data(self, **kwargs):
+        sort = 'id' if self.request.GET.get('sort') == 'id' else 'name'
+        recipes, next_cursor = keyset_page(
+            self.object_list, sort=sort, cursor=self.request.GET.get('after'), size=self.page_size
+        )
+        return super().get_context_data(
+            object_list=recipes,
+            next_cursor=next_cursor,
+            q=self.request.GET.get('q', ''),
+            sort=sort,
+            **kwargs,
+        )
+
+class RecipeCardsView(RecipesListView):                         # JSON partial used by the list page's filter box and "Load more"
+    def render_to_response(self, context, **response_kwargs):
+        html = render_to_string('recipes/recipe_cards.html', context, request=self.request)
+        return JsonResponse({'html': html, 'next': context['next_cursor']})
+
+class RecipeDetailView(LoginRequiredMixin, CachedPageMixin, DetailView):    # Class-based view to display details of a single recipe
+    cache_versions = ('recipes', 'ingredients', 'similarity')   # The page lists the recipe's ingredients and its neighbours
     model = Recipe                                              # specify the model to use for this view
     template_name = 'recipes/recipe_detail.html'                # specify the template to render
     context_object_name = 'recipe'                              # specify the context variable name to use in the template
 
+    # "Similar recipes": the cached MinHash/LSH neighbour list plus one query for the neighbours themselves
+    def get_context_data(self, **kwargs):
+        neighbors = similar_recipes(self.object.pk, self.catalog_versions['similarity'][0])
+        recipes = Recipe.objects.in_bulk([pk for pk, _ in neighbors]) if neighbors else {}
+        similar = [(recipes[pk], score) for pk, score in neighbors if pk in recipes]
+        return super().get_context_data(similar=similar, **kwargs)
+
+# Logic for searching: Search by Name OR Ingredient Name OR Difficulty
+# The search backend matches word prefixes through the full-text index and orders results by rank
+def search_recipes(term):
+    if term:
+        return get_search_backend().search(Recipe.objects.all(), term)
+    return Recipe.objects.all()
+
+RESULT_COLUMNS = ('id', 'name', 'cooking_time', 'difficulty', 'ingredient_count')
+
 # Function-based view for the Data Lab / Search
 @login_required
 def records(request):
     form = RecipeSearchForm(request.POST or None)       # Instantiate the form with POST data if available, otherwise create an empty form
-    recipes_df = None
+    recipe_rows = None
     chart = None
+    chart_svg = None
     qs = None
 
     if request.method == 'POST':
         recipe_name = request.POST.get('recipe_name')
         chart_type = request.POST.get('chart_type')
+        chart_format = request.POST.get('chart_format') or 'svg'
+
+        qs = search_recipes(recipe_name)
 
-        # Logic for searching: Search by Name OR Ingredient Name OR Difficulty
-        # Using icontains for the wildcard/partial search requirement
-        if recipe_name:
-            qs = Recipe.objects.filter(
-                models.Q(name__icontains=recipe_name) | 
-                models.Q(ingredients__name__icontains=recipe_name) |
-                models.Q(difficulty__icontains=recipe_name)
-            ).distinct()
-        else:
-            qs = Recipe.objects.all()
-
-        if qs.exists():
-            # 1. Convert QuerySet to DataFrame
-            # We fetch 'id' to create links and 'ingredients' to count them
-            data = []
-            for obj in qs:
-                item = {
-                    'id': obj.id,
-                    'name': obj.name,
-                    'cooking_time': obj.cooking_time,
-                    'difficulty': obj.difficulty,
-                    'ingredient_count': obj.ingredients.count(),
-                }
-                data.append(item)
-            
-            recipes_df = pd.DataFrame(data)
-
-            # 2. Generate Chart (Kwargs used for line chart logic)
-            chart = get_chart(chart_type, recipes_df)
-
-            # 3. Transform names into clickable HTML links
-            recipes_df = get_recipe_links(recipes_df)
-
-            # 4. Convert to HTML table (removing ID from view but keeping it for links)
-            recipes_df = recipes_df.to_html(index=False, escape=False, columns=['name', 'cooking_time', 'difficulty', 'ingredient_count'])
+        # 1. Fetch plain tuples in one query; 'ingredient_count' is a stored column, 'id' builds the links
+        recipe_rows = list(qs.values_list(*RESULT_COLUMNS))
 
+        if recipe_rows:
+            # 2. Generate Chart from the columns: inline SVG from downsampled series, or the cached matplotlib PNG
+            columns = dict(zip(RESULT_COLUMNS, zip(*recipe_rows)))
+            if chart_format == 'png':
+                chart = get_chart(chart_type, columns)
+            else:
+                with timed('chart'):
+                    chart_svg = mark_safe(render_svg(chart_payload(chart_type, chart_series(chart_type, columns))))
+
+    # 3. Table rows are generated while the template renders, linked through one pre-resolved detail URL
     context = {
         'form': form,
-        'recipes_df': recipes_df,
+        'recipe_rows': recipe_rows,
+        'recipe_table': result_rows(recipe_rows or []),
         'chart': chart,
+        'chart_svg': chart_svg,
     }
 
-    return render(request, 'recipes/recipes_search.html', context)
\ No newline at end of file
+    return render(request, 'recipes/recipes_search.html', context)
+
+# Serves a chart rendered by get_chart(). The URL is the hash of the chart's content, so a given URL
+# always returns the same bytes and browsers may keep it for a year without revalidating.
+@login_required
+def chart_image(request, key):
+    png = caches['charts'].get(key)
+    if png is None:
+        raise Http404('Chart expired, run the search again.')
+    response = HttpResponse(png, content_type='image/png')
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'     # private: charts sit behind the login
+    response['ETag'] = f'"{key}"'
+    return response
+
+# Chart data for the Data Lab without server-side plotting: GET ?q=<term>&chart_type=%231&format=json|svg&points=N
+# json returns the pre-aggregated series for drawing in the browser, svg a ready-made vector image.
+# Bar and line charts with more than `points` recipes are averaged into that many buckets.
+@login_required
+def chart_data(request):
+    chart_type = request.GET.get('chart_type', '#1')
+    if chart_type not in ('#1', '#2', '#3'):
+        return JsonResponse({'error': 'chart_type must be one of #1, #2, #3'}, status=400)
+    try:
+        points = min(max(int(request.GET.get('points', MAX_POINTS)), 2), 500)
+    except ValueError:
+        points = MAX_POINTS
+
+    payload = chart_payload(chart_type, series_from_queryset(chart_type, search_recipes(request.GET.get('q'))), points)
+    if request.GET.get('format') == 'svg':
+        with timed('chart'):
+            svg = render_svg(payload)
+        return HttpResponse(svg, content_type='image/svg+xml')
+    return JsonResponse(payload)
+
+# Streaming catalog dump: /recipes/export.csv or /recipes/export.jsonl, optionally filtered like the Data Lab with ?q=<term>
+@login_required
+def export_recipes(request, fmt):
+    content_type, lines = FORMATS[fmt]
+    term = request.GET.get('q')
+    queryset = search_recipes(term) if term else Recipe.objects.order_by('pk')     # Searches keep their rank order
+    response = StreamingHttpResponse(lines(export_rows(queryset)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="recipes.{fmt}"'
+    return response
+
+# "What can I cook": GET ?ingredients=eggs, flour, milk&mode=rank|all|missing&max_missing=K (&format=json)
+# ranks recipes by how many of the pantry's ingredients they use, from the in-process index of recipes/pantry.py
+@login_required
+def pantry(request):
+    from .pantry import what_can_i_cook     # The index is built with numpy, kept out of worker boot (startup_profile)
+    form = PantryForm(request.GET or None)
+    context = {'form': form}
+    if form.is_valid():
+        names = form.cleaned_data['ingredients']
+        ids_by_name = dict(Ingredient.objects.filter(name__in=names).values_list('name', 'pk'))
+        found = what_can_i_cook(
+            set(ids_by_name.values()),
+            mode=form.cleaned_data['mode'] or 'rank',
+            max_missing=form.cleaned_data['max_missing'] or 0,
+            limit=settings.PANTRY_RESULTS,
+        )
+        if request.GET.get('format') == 'json':
+            return JsonResponse({**found, 'unknown': [name for name in names if name not in ids_by_name]})
+
+        # The page also names what each listed recipe still needs: two queries for the whole page
+        recipes = Recipe.objects.in_bulk([row['id'] for row in found['results']])
+        needed = {}
+        links = RecipeIngredient._base_manager.filter(recipe__in=recipes).exclude(ingredient__in=ids_by_name.values())
+        for recipe_id, name in links.order_by('ingredient__name').values_list('recipe_id', 'ingredient__name'):
+            needed.setdefault(recipe_id, []).append(name)
+        context.update(
+            total=found['total'],
+            results=[
+                {**row, 'recipe': recipes[row['id']], 'needed': needed.get(row['id'], [])}
+                for row in found['results'] if row['id'] in recipes         # Skips a recipe deleted since the index was read
+            ],
+            unknown=[name for name in names if name not in ids_by_name],
+        )
+    elif request.GET.get('format') == 'json':
+        return JsonResponse({'errors': form.errors}, status=400)
+    return render(request, 'recipes/pantry.html', context)
@@ -0,0 +1,16 @@
+# recipes/worker.py
+# Entry point of the worker processes started by `run_worker --processes`. They are spawned, so this module
+# must import without Django being set up: everything else is imported after django.setup().
+import signal
+import threading
+
+def run_process(alias, queues, burst, poll_interval):
+    import django
+    django.setup()
+    from django.tasks import task_backends
+    from .task_queue import Worker
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    Worker(task_backends[alias], queues, stop, burst, poll_interval).run()